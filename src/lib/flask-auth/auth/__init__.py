@@ -1 +1,6 @@
-from auth.authenticator import Authenticator, auth_token
\ No newline at end of file
+from auth.authenticator import Authenticator, auth_token, get_claims
+from auth.authorization import roles_predicate, scopes_predicate
+from auth.claims import Claims
+from auth.exceptions import InsufficientScopeError
+from auth.jwks import JwksBundle, JwksCache, shared_jwks_cache
+from auth.token_cache import VerifiedTokenCache
@@ -1,18 +1,31 @@
-from functools import wraps
-from typing import Union
-from flask import Flask, request, jsonify, _request_ctx_stack
+import threading
+from functools import partial, wraps
+from typing import List, Union
+from flask import Flask, g, request, jsonify
 from urllib.error import URLError
-from jwt import decode, PyJWKClient
+from jwt import decode
+from jwt.algorithms import requires_cryptography
 import jwt.exceptions as jwt_error
+from auth.authorization import ClaimsPredicate, roles_predicate, scopes_predicate
+from auth.claims import Claims
 from auth.exceptions import *
+from auth.jwks import JwksBundle, shared_jwks_cache
+from auth.token_cache import VerifiedTokenCache
 from auth.utils import get_access_token
 from werkzeug.local import LocalProxy
 
 
-# allows flask applications to access the auth token
-auth_token: dict = LocalProxy(lambda: 
-    getattr(_request_ctx_stack.top, 'auth_token', None)
-)
+def get_claims() -> Union[Claims, None]:
+    '''
+    Returns the verified claims of the access token of the current request, or
+    None if the request has not been authenticated.
+    '''
+    return g.get('auth_claims', None)
+
+
+# allows flask applications to access the raw claims of the auth token, see
+# get_claims for the claims object
+auth_token: dict = LocalProxy(lambda: getattr(get_claims(), 'raw', None))
 
 
 class Authenticator(object):
@@ -22,10 +35,16 @@ class Authenticator(object):
     Attributes:
         issuer: The URL of the openid connect issuer
         audience: The audience of the service
-        jwks_uri: The URI of the issuer's JWKS
+        algorithms: The JWS algorithms of the access tokens that are accepted
+        jwks_client: The cache of the signing keys of the issuer's JWKS, shared
+            by every Authenticator of the process with the same JWKS URI, or
+            the JwksBundle of the keys if they are given locally. The cache is
+            created on first use, a JwksBundle when the authenticator is.
+        token_cache: The claims of recently verified tokens, None if disabled
     '''
     issuer: Union[str, None] = None
     audience: Union[str, None] = None
+    algorithms: List[str] = ['RS256']
 
     def __init__(self, app: Flask):
         '''
@@ -38,21 +57,72 @@ class Authenticator(object):
             app != None
             AUTH_ISSUER in app.config
             AUTH_AUDIENCE in app.config
-            AUTH_JWKS_URI in app.config
+            AUTH_JWKS_URI, AUTH_JWKS or AUTH_JWKS_FILE in app.config
+            AUTH_ALGORITHMS, the asymmetric JWS algorithms of the access tokens
+                that are accepted, e.g. ['RS256', 'ES256', 'EdDSA'], is
+                optional and ['RS256'] by default
+            AUTH_JWKS, the issuer's JWKS as JSON, is used instead of fetching
+                it from AUTH_JWKS_URI if given
+            AUTH_JWKS_FILE, the path of a file with the issuer's JWKS, is used
+                instead of fetching it from AUTH_JWKS_URI if given
+            AUTH_JWKS_RELOAD_INTERVAL, the seconds between checks for a changed
+                AUTH_JWKS_FILE, is optional
+            AUTH_JWKS_TTL, the seconds after which signing keys are refetched,
+                is optional
+            AUTH_JWKS_MAX_STALE, the seconds signing keys are still used for
+                while they cannot be refetched, is optional
+            AUTH_TOKEN_CACHE_SIZE, the most verified tokens whose claims are
+                cached, 0 to verify every token every time, is optional
 
         Post-conditions:
             Registers error handler with app that catches authentication errors
             and returns the appropriate response.
+            The authenticator is app.extensions['auth'].
+            A local JWKS is loaded now, raising OSError if AUTH_JWKS_FILE
+            cannot be read, ValueError if the JWKS is not JSON and
+            PyJWKClientError if it has no signing keys. The JWKS at
+            AUTH_JWKS_URI is not fetched until the first token is verified.
         '''
         assert app != None
         config_keys = app.config.keys()
         assert 'AUTH_ISSUER' in config_keys
         assert 'AUTH_AUDIENCE' in config_keys
-        assert 'AUTH_JWKS_URI' in config_keys
+        jwks = app.config.get('AUTH_JWKS', None)
+        jwks_file = app.config.get('AUTH_JWKS_FILE', None)
+        jwks_uri = app.config.get('AUTH_JWKS_URI', None)
+        assert jwks or jwks_file or jwks_uri
 
         self.issuer = app.config.get('AUTH_ISSUER')
         self.audience = app.config.get('AUTH_AUDIENCE')
-        self.jwks_client = PyJWKClient(app.config.get('AUTH_JWKS_URI'))
+        self.algorithms = list(app.config.get('AUTH_ALGORITHMS', ['RS256']))
+        assert len(self.algorithms) > 0
+        assert all(algorithm in requires_cryptography for algorithm in self.algorithms)
+        self._jwks_client = None
+        self._jwks_client_lock = threading.Lock()
+        # a local JWKS needs no network, so a broken one fails here rather than on every request
+        if jwks:
+            self._jwks_client = JwksBundle(jwks)
+        elif jwks_file:
+            self._jwks_client = JwksBundle(path=jwks_file,
+                reload_interval=app.config.get('AUTH_JWKS_RELOAD_INTERVAL', None))
+        else:
+            # fetched on first use, see jwks_client
+            self._create_jwks_client = partial(shared_jwks_cache, jwks_uri,
+                ttl=app.config.get('AUTH_JWKS_TTL', 300),
+                max_stale=app.config.get('AUTH_JWKS_MAX_STALE', 24 * 60 * 60),
+            )
+        token_cache_size = app.config.get('AUTH_TOKEN_CACHE_SIZE', 10000)
+        self.token_cache = VerifiedTokenCache(token_cache_size) \
+            if token_cache_size > 0 else None
+        app.extensions['auth'] = self
+
+        @app.before_request
+        def clear_claims():
+            '''
+            Forgets the claims of an earlier request, in case it shared the
+            app context, and so g, with this request.
+            '''
+            g.pop('auth_claims', None)
 
         @app.errorhandler(AuthError)
         def handle_pyjwt_error(e: AuthError):
@@ -80,6 +150,25 @@ class Authenticator(object):
             }, HTTPStatus.INTERNAL_SERVER_ERROR
 
 
+    @property
+    def jwks_client(self):
+        '''
+        The cache of the signing keys of the issuer's JWKS. A cache of the JWKS
+        at AUTH_JWKS_URI is created when the first token is verified, so
+        creating an app neither fetches keys nor starts a refresh thread.
+        '''
+        if self._jwks_client is None:
+            with self._jwks_client_lock:
+                if self._jwks_client is None:
+                    self._jwks_client = self._create_jwks_client()
+        return self._jwks_client
+
+
+    @jwks_client.setter
+    def jwks_client(self, jwks_client):
+        self._jwks_client = jwks_client
+
+
     def require_token(self, func):
         '''
         Decorator that requires that requests to the decorated route provide
@@ -99,24 +188,156 @@ class Authenticator(object):
             '''
             The route function that wrapped by require_auth
             '''
-            token = get_access_token(request)
-            try:
-                signing_key = self.jwks_client.get_signing_key_from_jwt(token)
-                data: dict = decode(token, 
-                    signing_key.key, 
-                    algorithms=['RS256'],
-                    issuer=self.issuer,
-                    audience=self.audience,
-                )
-            except jwt_error.InvalidTokenError as error:
-                raise InvalidTokenError(str(error))
-
-            except jwt_error.PyJWKClientError as error:
-                raise InvalidTokenError('Key does not match provider')
-
-            except jwt_error.PyJWTError as error:
-                raise AuthError()
-
-            _request_ctx_stack.top.auth_token = data
+            self.authenticate()
             return func(*args, **kwargs)
         return wrapped_route
+
+
+    def require_scopes(self, *scopes: str, require_all: bool = True):
+        '''
+        Decorator that requires that requests to the decorated route provide an
+        access token with all, or if require_all is False any, of the given
+        scopes. Implies require_token.
+
+        Args:
+            scopes: the required scopes
+            require_all: False to require any one of the scopes
+
+        Pre-conditions:
+            at least one scope is given
+
+        Post-conditions:
+            Requests whose token lacks the scopes are answered with 403
+            Forbidden and an insufficient_scope error.
+
+        Example:
+            @app.route('/hello', methods=['GET'])
+            @auth.require_scopes('hello:read')
+            def hello():
+            return 'Hello World!'
+        '''
+        return self._require_claims(scopes_predicate(scopes, require_all),
+            f'requires scope {_describe(scopes, require_all)}')
+
+
+    def require_roles(self, *roles: str, client: Union[str, None] = None,
+        require_all: bool = True):
+        '''
+        Decorator that requires that requests to the decorated route provide an
+        access token with all, or if require_all is False any, of the given
+        Keycloak realm roles, or roles of client if client is given. Implies
+        require_token.
+
+        Args:
+            roles: the required roles
+            client: the client id of the roles, None for realm roles
+            require_all: False to require any one of the roles
+
+        Pre-conditions:
+            at least one role is given
+
+        Post-conditions:
+            Requests whose token lacks the roles are answered with 403
+            Forbidden and an insufficient_scope error.
+        '''
+        return self._require_claims(roles_predicate(roles, client, require_all),
+            f'requires role {_describe(roles, require_all)}')
+
+
+    def _require_claims(self, predicate: ClaimsPredicate, description: str):
+        '''
+        Returns a decorator that requires that the verified claims of requests
+        to the decorated route satisfy predicate.
+        '''
+        def decorator(func):
+            @wraps(func)
+            def wrapped_route(*args, **kwargs):
+                if not predicate(self.authenticate()):
+                    raise InsufficientScopeError(description)
+                return func(*args, **kwargs)
+            return wrapped_route
+        return decorator
+
+
+    def authenticate(self) -> Claims:
+        '''
+        Returns the verified claims of the access token of the current request.
+        The token is only verified once per request however many decorators
+        need its claims, which are then stored in flask.g, see get_claims.
+
+        Post-conditions:
+            Raises AuthError if the request has no valid access token.
+        '''
+        claims = g.get('auth_claims', None)
+        if claims == None:
+            claims = Claims(self.verify_token(get_access_token(request)))
+            g.auth_claims = claims
+        return claims
+
+
+    def verify_token(self, token: str) -> dict:
+        '''
+        Verifies an access token and returns its claims. The claims of tokens
+        that were already verified are taken from the verified token cache,
+        without verifying the signature again.
+
+        Args:
+            token: the access token
+
+        Pre-conditions:
+            token != None
+
+        Post-conditions:
+            Raises InvalidTokenError if the token is invalid.
+            Raises AuthError if the token cannot be verified.
+        '''
+        assert token != None
+
+        if self.token_cache != None:
+            data = self.token_cache.get(token)
+            if data != None:
+                return data
+
+        try:
+            signing_key = self.jwks_client.get_signing_key_from_jwt(token)
+            data: dict = decode(token,
+                signing_key.key,
+                algorithms=self._key_algorithms(signing_key),
+                issuer=self.issuer,
+                audience=self.audience,
+            )
+        except jwt_error.InvalidTokenError as error:
+            raise InvalidTokenError(str(error))
+
+        except jwt_error.PyJWKClientError as error:
+            raise InvalidTokenError('Key does not match provider')
+
+        except jwt_error.PyJWTError as error:
+            raise AuthError()
+
+        if self.token_cache != None:
+            self.token_cache.put(token, data)
+        return data
+
+
+    def _key_algorithms(self, signing_key) -> List[str]:
+        '''
+        Returns the algorithms a token signed with signing_key may use: the
+        algorithm of the key's JWK, if it is accepted. Keys that do not know
+        their algorithm, e.g. those of a PyJWKClient, may be used with any
+        accepted algorithm.
+
+        Post-conditions:
+            Raises InvalidTokenError if the key's algorithm is not accepted.
+        '''
+        algorithm = getattr(signing_key, 'algorithm_name', None)
+        if not isinstance(algorithm, str):
+            return self.algorithms
+        if algorithm not in self.algorithms:
+            raise InvalidTokenError(f'Key algorithm {algorithm} is not accepted')
+        return [algorithm]
+
+
+def _describe(values, require_all: bool) -> str:
+    separator = ' and ' if require_all else ' or '
+    return separator.join(sorted(set(values)))
@@ -0,0 +1,66 @@
+'''
+Claim predicates for authorizing requests by the scopes and roles of their
+access token. Predicates are compiled once, when a route is decorated, so a
+request only pays for set membership tests on the scopes and roles its Claims
+parsed once.
+'''
+from typing import Callable, FrozenSet, Iterable, Union
+from auth.claims import Claims
+
+
+ClaimsPredicate = Callable[[Claims], bool]
+
+
+def scopes_predicate(scopes: Iterable[str], require_all: bool = True) -> ClaimsPredicate:
+    '''
+    Compiles a predicate that is true for claims whose space separated scope
+    claim has all, or if require_all is False any, of scopes.
+
+    Pre-conditions:
+        scopes has at least one scope
+    '''
+    required = _required_set(scopes)
+
+    if require_all:
+        def has_scopes(claims: Claims) -> bool:
+            return required <= claims.scopes
+    else:
+        def has_scopes(claims: Claims) -> bool:
+            return not required.isdisjoint(claims.scopes)
+    return has_scopes
+
+
+def roles_predicate(roles: Iterable[str], client: Union[str, None] = None,
+    require_all: bool = True) -> ClaimsPredicate:
+    '''
+    Compiles a predicate that is true for claims with all, or if require_all is
+    False any, of roles. Roles are Keycloak realm roles, from the
+    realm_access.roles claim, or if client is given the roles of that client,
+    from the resource_access.<client>.roles claim.
+
+    Pre-conditions:
+        roles has at least one role
+    '''
+    required = _required_set(roles)
+
+    if client is None:
+        def roles_of(claims: Claims) -> FrozenSet[str]:
+            return claims.roles
+    else:
+        def roles_of(claims: Claims) -> FrozenSet[str]:
+            return claims.client_roles(client)
+
+    if require_all:
+        def has_roles(claims: Claims) -> bool:
+            return required <= roles_of(claims)
+    else:
+        def has_roles(claims: Claims) -> bool:
+            return not required.isdisjoint(roles_of(claims))
+    return has_roles
+
+
+def _required_set(values: Iterable[str]) -> frozenset:
+    required = frozenset(values)
+    assert len(required) > 0
+    assert all(isinstance(value, str) for value in required)
+    return required
@@ -0,0 +1,113 @@
+'''
+The verified claims of the access token of a request.
+'''
+from typing import Dict, FrozenSet, Iterable, Union
+
+
+class Claims(object):
+    '''
+    The verified claims of an access token. Routes read the fields they need,
+    the scopes and roles are only parsed from the raw claims the first time
+    they are read, by a route or the checks of require_scopes and
+    require_roles.
+
+    Attributes:
+        raw: The claims as they were decoded from the access token
+    '''
+    __slots__ = ('raw', '_scopes', '_roles', '_client_roles')
+
+    def __init__(self, raw: dict):
+        '''
+        Wraps the claims decoded from a verified access token.
+
+        Pre-conditions:
+            raw != None
+        '''
+        assert raw != None
+
+        self.raw = raw
+        self._scopes: Union[FrozenSet[str], None] = None
+        self._roles: Union[FrozenSet[str], None] = None
+        self._client_roles: Union[Dict[str, FrozenSet[str]], None] = None
+
+
+    @property
+    def subject(self) -> Union[str, None]:
+        '''
+        The sub claim, the id of the user the token was issued to.
+        '''
+        return self.raw.get('sub', None)
+
+
+    @property
+    def user_id(self) -> Union[str, None]:
+        '''
+        The id of the user the token was issued to, its subject.
+        '''
+        return self.raw.get('sub', None)
+
+
+    @property
+    def expires_at(self) -> Union[int, None]:
+        '''
+        The exp claim, the unix time at which the token expires.
+        '''
+        return self.raw.get('exp', None)
+
+
+    @property
+    def scopes(self) -> FrozenSet[str]:
+        '''
+        The scopes of the space separated scope claim.
+        '''
+        if self._scopes is None:
+            scope = self.raw.get('scope', None)
+            self._scopes = frozenset(scope.split() if isinstance(scope, str) else ())
+        return self._scopes
+
+
+    @property
+    def roles(self) -> FrozenSet[str]:
+        '''
+        The Keycloak realm roles of the realm_access.roles claim.
+        '''
+        if self._roles is None:
+            self._roles = _strings(get_roles(self.raw))
+        return self._roles
+
+
+    def client_roles(self, client: str) -> FrozenSet[str]:
+        '''
+        Returns the Keycloak roles of a client, of the
+        resource_access.<client>.roles claim.
+        '''
+        if self._client_roles is None:
+            self._client_roles = {}
+        roles = self._client_roles.get(client, None)
+        if roles is None:
+            roles = self._client_roles[client] = _strings(get_roles(self.raw, client))
+        return roles
+
+
+    def __repr__(self) -> str:
+        return f'Claims({self.raw!r})'
+
+
+def get_roles(claims: dict, client: Union[str, None] = None) -> list:
+    '''
+    Returns the Keycloak realm roles of claims, from the realm_access.roles
+    claim, or if client is given the roles of that client, from the
+    resource_access.<client>.roles claim. Malformed role claims have no roles.
+    '''
+    if client is None:
+        access = claims.get('realm_access', None)
+    else:
+        resource_access = claims.get('resource_access', None)
+        access = resource_access.get(client, None) if isinstance(resource_access, dict) else None
+
+    roles = access.get('roles', None) if isinstance(access, dict) else None
+    return roles if isinstance(roles, list) else []
+
+
+def _strings(values: Iterable) -> FrozenSet[str]:
+    return frozenset(value for value in values if isinstance(value, str))
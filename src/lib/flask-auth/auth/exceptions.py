@@ -47,3 +47,18 @@ class MalformedAuthError(AuthError):
     request.
     '''
     pass
+
+
+class InsufficientScopeError(AuthError):
+    '''
+    An authorization error due to a valid access token that does not have the
+    scopes or roles required by the requested route.
+    '''
+    status_code: int = HTTPStatus.FORBIDDEN
+
+    def __init__(self, message) -> None:
+        '''
+        Initialize an insufficient scope error.
+        '''
+        super().__init__(message)
+        self.error = 'insufficient_scope'
@@ -0,0 +1,429 @@
+'''
+A process wide cache of the signing keys of an auth provider's JWKS, and a
+local JWKS bundle that can be used in its place.
+'''
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+from typing import Callable, Dict, Union
+from urllib.error import URLError
+from jwt import PyJWK, get_unverified_header
+from jwt.exceptions import PyJWKClientError, PyJWTError
+
+
+logger = logging.getLogger(__name__)
+
+# the caches shared by every Authenticator of the process, by JWKS URI
+_shared_caches: Dict[str, 'JwksCache'] = {}
+_shared_caches_lock = threading.Lock()
+
+# the algorithms of JWKs without an alg, by kty and crv
+_DEFAULT_ALGORITHMS = {
+    ('RSA', None): 'RS256',
+    ('EC', 'P-256'): 'ES256',
+    ('EC', 'P-384'): 'ES384',
+    ('EC', 'P-521'): 'ES512',
+    ('OKP', 'Ed25519'): 'EdDSA',
+}
+
+
+def shared_jwks_cache(uri: str, **options) -> 'JwksCache':
+    '''
+    Returns the JwksCache of the process for a JWKS URI, creating it with the
+    given JwksCache options the first time the URI is used.
+
+    Pre-conditions:
+        uri != None
+    '''
+    assert uri != None
+
+    with _shared_caches_lock:
+        cache = _shared_caches.get(uri, None)
+        if cache is None:
+            cache = JwksCache(uri, **options)
+            _shared_caches[uri] = cache
+        return cache
+
+
+class JwksCache(object):
+    '''
+    A kid indexed cache of the signing keys of a JWKS. It can be used in place
+    of a PyJWKClient.
+
+    Keys are fetched on first use, then kept fresh by a background thread that
+    refetches the JWKS every refresh_interval seconds. Keys older than ttl are
+    still used while a refetch is in progress, and keys are only dropped once
+    no refetch has succeeded for max_stale seconds, so an auth provider outage
+    does not fail every request. A token with an unknown kid refetches the
+    JWKS at most once every min_fetch_interval seconds, and concurrent
+    requests share a single fetch.
+
+    Attributes:
+        uri: The URI of the JWKS
+        ttl: Seconds after which cached keys are refetched
+        refresh_interval: Seconds between background refetches
+        max_stale: Seconds after which cached keys are dropped if they could
+            not be refetched
+        min_fetch_interval: The fewest seconds between refetches for unknown kids
+        timeout: Seconds to wait for the JWKS endpoint
+    '''
+    def __init__(self,
+        uri: str,
+        ttl: float = 300,
+        refresh_interval: Union[float, None] = None,
+        max_stale: float = 24 * 60 * 60,
+        min_fetch_interval: float = 5,
+        timeout: float = 10,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        '''
+        Creates an empty JWKS cache. Nothing is fetched until a key is needed.
+
+        Args:
+            uri: The URI of the JWKS
+            ttl: Seconds after which cached keys are refetched
+            refresh_interval: Seconds between background refetches, ttl / 2 if None
+            max_stale: Seconds after which cached keys are dropped if they
+                could not be refetched
+            min_fetch_interval: The fewest seconds between refetches for unknown kids
+            timeout: Seconds to wait for the JWKS endpoint
+            clock: Returns the current time in seconds
+
+        Pre-conditions:
+            uri != None
+            0 < ttl <= max_stale
+            refresh_interval == None or refresh_interval > 0
+        '''
+        assert uri != None
+        assert 0 < ttl <= max_stale
+        assert refresh_interval == None or refresh_interval > 0
+
+        self.uri = uri
+        self.ttl = ttl
+        self.refresh_interval = ttl / 2 if refresh_interval is None else refresh_interval
+        self.max_stale = max_stale
+        self.min_fetch_interval = min_fetch_interval
+        self.timeout = timeout
+        self.clock = clock
+
+        # replaced, never mutated, so that lookups need no lock
+        self._keys: Dict[str, PyJWK] = {}
+        self._fetched_at: Union[float, None] = None
+        self._fetch_attempted_at: Union[float, None] = None
+        # the number of fetches that finished, successful or not
+        self._fetches = 0
+        self._fetch_error: Union[Exception, None] = None
+        self._fetch_lock = threading.Lock()
+
+        self._refresher: Union[threading.Thread, None] = None
+        self._refresher_pid: Union[int, None] = None
+        self._refresher_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+
+
+    def get_signing_key_from_jwt(self, token: str) -> PyJWK:
+        '''
+        Returns the signing key for the kid in the header of a token. The token
+        is not verified.
+
+        Post-conditions:
+            Raises jwt.exceptions.DecodeError if the token cannot be decoded.
+            See get_signing_key.
+        '''
+        return self.get_signing_key(get_unverified_header(token).get('kid'))
+
+
+    def get_signing_key(self, kid: str) -> PyJWK:
+        '''
+        Returns the signing key of the JWKS with the given kid.
+
+        Post-conditions:
+            Raises PyJWKClientError if the JWKS has no signing key with kid.
+            Raises URLError if the JWKS had to be fetched and could not be.
+        '''
+        self._start_refresher()
+
+        keys = self._keys
+        age = self._age()
+        if age is not None and age >= self.max_stale:
+            keys = {}
+        elif age is not None and age >= self.ttl:
+            # stale while revalidate, the refresher fetches the keys in the background
+            self._wakeup.set()
+
+        key = keys.get(kid, None)
+        if key is not None:
+            return key
+
+        fetches = self._fetches
+        if self._fetch_lock.locked() or self._fetch_attempted_at is None \
+            or self.clock() - self._fetch_attempted_at >= self.min_fetch_interval:
+            self._fetch(fetches)
+            keys = self._keys
+        elif self._fetch_error is not None and len(keys) == 0:
+            raise self._fetch_error
+
+        key = keys.get(kid, None)
+        if key is None:
+            raise PyJWKClientError(f'Unable to find a signing key that matches: "{kid}"')
+        return key
+
+
+    def refresh(self) -> None:
+        '''
+        Fetches the JWKS now. If another thread is already fetching it, waits
+        for that fetch instead of starting another.
+
+        Post-conditions:
+            Raises URLError if the JWKS could not be fetched.
+        '''
+        self._fetch(self._fetches)
+
+
+    def close(self) -> None:
+        '''
+        Stops the background refresher.
+        '''
+        self._stopped = True
+        self._wakeup.set()
+
+
+    def _fetch(self, fetches: int) -> None:
+        '''
+        Fetches the JWKS unless a fetch finished since fetches was read from
+        self._fetches, in which case the outcome of that fetch is used.
+        '''
+        with self._fetch_lock:
+            if self._fetches == fetches:
+                self._fetch_attempted_at = self.clock()
+                try:
+                    self._keys = self._fetch_keys()
+                    self._fetched_at = self.clock()
+                    self._fetch_error = None
+                except Exception as error: # pylint: disable=broad-except
+                    self._fetch_error = error
+                self._fetches += 1
+            if self._fetch_error is not None:
+                raise self._fetch_error
+
+
+    def _fetch_keys(self) -> Dict[str, PyJWK]:
+        try:
+            with urllib.request.urlopen(self.uri, timeout=self.timeout) as response:
+                data = json.load(response)
+        except URLError:
+            raise
+        except OSError as error:
+            # e.g. a read timeout, reported like any other failure to reach the JWKS
+            raise URLError(error) from error
+
+        return _signing_keys(data)
+
+
+    def _age(self) -> Union[float, None]:
+        return None if self._fetched_at is None else self.clock() - self._fetched_at
+
+
+    def _start_refresher(self) -> None:
+        '''
+        Starts the background refresher, or restarts it in a forked process,
+        which does not inherit the thread.
+        '''
+        pid = os.getpid()
+        if self._refresher_pid == pid or self._stopped:
+            return
+        with self._refresher_lock:
+            if self._refresher_pid == pid:
+                return
+            self._refresher = threading.Thread(target=self._refresh_forever,
+                name=f'jwks-refresher {self.uri}', daemon=True)
+            self._refresher.start()
+            self._refresher_pid = pid
+
+
+    def _refresh_forever(self) -> None:
+        while True:
+            self._wakeup.wait(self.refresh_interval)
+            self._wakeup.clear()
+            if self._stopped:
+                return
+            try:
+                self.refresh()
+            except Exception: # pylint: disable=broad-except
+                logger.warning('failed to refresh the JWKS %s, using cached keys', self.uri,
+                    exc_info=True)
+
+
+class JwksBundle(object):
+    '''
+    The signing keys of a JWKS bundle that is loaded from a local file or JSON
+    string, rather than fetched from the auth provider, so verifying tokens
+    never waits on the network and keeps working while the provider is down.
+    It can be used in place of a JwksCache.
+
+    A file bundle is reloaded when it has changed, at most every
+    reload_interval seconds, so rotated keys are picked up without a restart.
+    If a reload fails the keys loaded before are kept.
+
+    Attributes:
+        path: The path of the JWKS file, None for a JSON string bundle
+        reload_interval: Seconds between checks for a changed file, None to
+            never reload
+    '''
+    def __init__(self,
+        jwks: Union[str, dict, None] = None,
+        path: Union[str, None] = None,
+        reload_interval: Union[float, None] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        '''
+        Loads a JWKS bundle from either a JSON string or dict, or a file.
+
+        Args:
+            jwks: The JWKS, as JSON or a dict
+            path: The path of a JWKS JSON file
+            reload_interval: Seconds between checks for a changed file, None to
+                never reload
+            clock: Returns the current time in seconds
+
+        Pre-conditions:
+            exactly one of jwks and path != None
+            reload_interval == None or (path != None and reload_interval > 0)
+
+        Post-conditions:
+            Raises OSError if the file cannot be read.
+            Raises ValueError if the bundle is not JSON.
+            Raises PyJWKClientError if the bundle has no signing keys.
+        '''
+        assert (jwks is None) != (path is None)
+        assert reload_interval == None or (path != None and reload_interval > 0)
+
+        self.path = path
+        self.reload_interval = reload_interval
+        self.clock = clock
+
+        self._mtime: Union[int, None] = None
+        self._checked_at = clock()
+        self._reload_lock = threading.Lock()
+        if path is None:
+            self._keys = _signing_keys(json.loads(jwks) if isinstance(jwks, str) else jwks)
+        else:
+            self._keys = self._load()
+
+
+    def get_signing_key_from_jwt(self, token: str) -> PyJWK:
+        '''
+        Returns the signing key for the kid in the header of a token. The token
+        is not verified.
+
+        Post-conditions:
+            Raises jwt.exceptions.DecodeError if the token cannot be decoded.
+            See get_signing_key.
+        '''
+        return self.get_signing_key(get_unverified_header(token).get('kid'))
+
+
+    def get_signing_key(self, kid: str) -> PyJWK:
+        '''
+        Returns the signing key of the bundle with the given kid.
+
+        Post-conditions:
+            Raises PyJWKClientError if the bundle has no signing key with kid.
+        '''
+        if self.reload_interval != None \
+            and self.clock() - self._checked_at >= self.reload_interval:
+            self._reload()
+
+        key = self._keys.get(kid, None)
+        if key is None:
+            raise PyJWKClientError(f'Unable to find a signing key that matches: "{kid}"')
+        return key
+
+
+    def refresh(self) -> None:
+        '''
+        Reloads a file bundle now if it has changed.
+
+        Post-conditions:
+            Raises OSError, ValueError or PyJWKClientError if the file has
+            changed but could not be loaded, in which case the keys loaded
+            before are kept.
+        '''
+        if self.path != None:
+            with self._reload_lock:
+                self._load_if_changed()
+
+
+    def close(self) -> None:
+        '''
+        Does nothing, a bundle has no background refresher to stop.
+        '''
+
+
+    def _reload(self) -> None:
+        '''
+        Reloads the file if it has changed, unless another thread already is
+        reloading it, in which case the loaded keys are used meanwhile.
+        '''
+        if not self._reload_lock.acquire(blocking=False):
+            return
+        try:
+            self._load_if_changed()
+        except Exception: # pylint: disable=broad-except
+            logger.warning('failed to reload the JWKS bundle %s, using loaded keys', self.path,
+                exc_info=True)
+        finally:
+            self._reload_lock.release()
+
+
+    def _load_if_changed(self) -> None:
+        self._checked_at = self.clock()
+        if os.stat(self.path).st_mtime_ns != self._mtime:
+            self._keys = self._load()
+
+
+    def _load(self) -> Dict[str, PyJWK]:
+        with open(self.path, 'rb') as jwks_file:
+            mtime = os.fstat(jwks_file.fileno()).st_mtime_ns
+            keys = _signing_keys(json.load(jwks_file))
+        self._mtime = mtime
+        return keys
+
+
+def _signing_keys(data: dict) -> Dict[str, PyJWK]:
+    '''
+    Returns the signing keys of a JWKS by kid. Every key has an algorithm_name,
+    the JWS algorithm it verifies signatures of. Keys of algorithms that
+    cannot be used are skipped.
+
+    Post-conditions:
+        Raises PyJWKClientError if the JWKS is invalid or has no signing keys.
+    '''
+    jwks = data.get('keys', None) if isinstance(data, dict) else None
+    if not isinstance(jwks, list):
+        raise PyJWKClientError('The JWKS is invalid: it has no keys list')
+
+    keys = {}
+    for jwk in jwks:
+        if not isinstance(jwk, dict) or jwk.get('use', 'sig') != 'sig' or not jwk.get('kid'):
+            continue
+        algorithm = jwk.get('alg', None) \
+            or _DEFAULT_ALGORITHMS.get((jwk.get('kty', None), jwk.get('crv', None)), None)
+        if algorithm is None:
+            logger.warning('skipping JWK %s: unsupported key type', jwk.get('kid'))
+            continue
+        try:
+            key = PyJWK(jwk, algorithm)
+        except PyJWTError as error:
+            logger.warning('skipping JWK %s: %s', jwk.get('kid'), error)
+            continue
+        key.algorithm_name = algorithm
+        keys[key.key_id] = key
+
+    if len(keys) == 0:
+        raise PyJWKClientError('The JWKS did not contain any signing keys')
+    return keys
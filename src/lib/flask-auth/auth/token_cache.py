@@ -0,0 +1,86 @@
+'''
+A cache of the claims of access tokens that have already been verified.
+'''
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Tuple, Union
+
+
+class VerifiedTokenCache(object):
+    '''
+    A least recently used cache of verified access token claims, so that
+    repeated requests with the same token skip signature verification.
+
+    Tokens are keyed by their SHA-256 digest, so the cache does not hold bearer
+    tokens, and every token is only cached until its own exp claim.
+
+    Attributes:
+        max_size: The most tokens that are cached
+    '''
+    def __init__(self, max_size: int = 10000, clock: Callable[[], float] = time.time):
+        '''
+        Creates an empty cache.
+
+        Args:
+            max_size: The most tokens that are cached
+            clock: Returns the current unix time in seconds
+
+        Pre-conditions:
+            max_size > 0
+        '''
+        assert max_size > 0
+
+        self.max_size = max_size
+        self.clock = clock
+        self._entries: 'OrderedDict[bytes, Tuple[float, dict]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def get(self, token: str) -> Union[dict, None]:
+        '''
+        Returns a copy of the claims of a verified token, or None if the token
+        is not cached or has expired.
+        '''
+        key = _digest(token)
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                return None
+            expires_at, claims = entry
+            if self.clock() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return dict(claims)
+
+
+    def put(self, token: str, claims: dict) -> None:
+        '''
+        Caches the claims of a token that has been verified, until its exp
+        claim. Tokens without an exp claim are not cached.
+
+        Pre-conditions:
+            claims != None
+        '''
+        assert claims != None
+
+        expires_at = claims.get('exp', None)
+        if not isinstance(expires_at, (int, float)) or isinstance(expires_at, bool):
+            return
+
+        key = _digest(token)
+        with self._lock:
+            self._entries[key] = (expires_at, dict(claims))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
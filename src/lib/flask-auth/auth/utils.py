@@ -1,7 +1,7 @@
 '''
 Utility functions for the authentication library.
 '''
-from requests import Request
+from flask import Request
 from auth.exceptions import *
 
 
@@ -0,0 +1,119 @@
+'''
+Token verification benchmark by signature algorithm.
+
+Times verifying access tokens signed with RS256, ES256 and EdDSA keys that are
+generated locally, both as bare signature verifications and as requests to a
+protected flask route with the verified token cache disabled, and prints the
+size of the tokens.
+
+Run from src/lib/flask-auth:
+    PYTHONPATH=. python bench/bench_algorithms.py --number 2000
+'''
+import argparse, time, jwt
+from http import HTTPStatus
+from flask import Flask
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from auth import Authenticator, JwksBundle, auth_token
+from tests.test_authenticator import create_jwks
+
+
+def generate_keys() -> dict:
+    '''
+    Returns a private key for each algorithm.
+    '''
+    return {
+        'RS256': rsa.generate_private_key(public_exponent=65537, key_size=2048,
+            backend=default_backend()),
+        'ES256': ec.generate_private_key(ec.SECP256R1(), default_backend()),
+        'EdDSA': ed25519.Ed25519PrivateKey.generate(),
+    }
+
+
+def create_app(keys: dict):
+    '''
+    Creates a flask app with a protected route that accepts tokens signed with
+    any of keys.
+    '''
+    app = Flask(__name__)
+    app.config.update({
+        'AUTH_ISSUER': 'bench_issuer',
+        'AUTH_AUDIENCE': 'bench',
+        'AUTH_JWKS': {'keys': [
+            jwk for algorithm, key in keys.items()
+            for jwk in create_jwks(algorithm, key=key, alg=algorithm)['keys']
+        ]},
+        'AUTH_ALGORITHMS': list(keys),
+        'AUTH_TOKEN_CACHE_SIZE': 0,
+    })
+    auth = Authenticator(app)
+
+    @app.route('/protected', methods=['GET'])
+    @auth.require_token
+    def protected():
+        return auth_token['sub'], HTTPStatus.OK
+
+    return app, auth
+
+
+def create_token(algorithm: str, key) -> str:
+    '''
+    Creates an access token like one issued by Keycloak, signed with key.
+    '''
+    return jwt.encode({
+        'iss': 'bench_issuer',
+        'aud': 'bench',
+        'sub': 'f81d4fae-7dec-11d0-a765-00a0c91e6bf6',
+        'exp': int(time.time()) + 3600,
+        'iat': int(time.time()),
+        'typ': 'Bearer',
+        'scope': 'openid profile email',
+        'email': 'bench-user@safe-zone.local',
+        'realm_access': {'roles': ['offline_access', 'uma_authorization', 'user']},
+    }, key, algorithm=algorithm, headers={'kid': algorithm})
+
+
+def time_verify(token: str, bundle: JwksBundle, number: int) -> float:
+    '''
+    Returns the mean seconds to verify the signature of token.
+    '''
+    signing_key = bundle.get_signing_key_from_jwt(token)
+    algorithms = [signing_key.algorithm_name]
+    start = time.perf_counter()
+    for _ in range(number):
+        jwt.decode(token, signing_key.key, algorithms=algorithms, audience='bench')
+    return (time.perf_counter() - start) / number
+
+
+def time_requests(client, token: str, number: int) -> float:
+    '''
+    Returns the mean latency of requests to the protected route with token.
+    '''
+    headers = {'Authorization': 'Bearer ' + token}
+    start = time.perf_counter()
+    for _ in range(number):
+        response = client.get('/protected', headers=headers)
+        assert response.status_code == HTTPStatus.OK, response.data
+    return (time.perf_counter() - start) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+
+    keys = generate_keys()
+    app, auth = create_app(keys)
+    client = app.test_client()
+
+    print(f'{"algorithm":>9} {"token":>11} {"verify":>12} {"verifies/s":>11} {"request":>12}')
+    for algorithm, key in keys.items():
+        token = create_token(algorithm, key)
+        verify = time_verify(token, auth.jwks_client, args.number)
+        request = time_requests(client, token, args.number)
+        print(f'{algorithm:>9} {len(token):>5} bytes {verify * 1e6:>9.1f} us '
+            f'{1 / verify:>11.0f} {request * 1e6:>9.1f} us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+'''
+Per-request authentication overhead benchmark.
+
+Serves a protected and an unprotected flask route and times requests to them
+with the signing keys fetched by PyJWKClient without caching, by PyJWKClient
+with its default lru cache and by JwksCache, against a local JWKS stand-in
+with a simulated provider latency.
+
+Run from src/lib/flask-auth:
+    PYTHONPATH=. python bench/bench_auth.py --requests 2000 --latency 0.02
+'''
+import argparse, time, jwt
+from http import HTTPStatus
+from flask import Flask
+from jwt import PyJWKClient
+from auth import Authenticator, JwksCache, auth_token
+from tests.test_jwks import JwksServer, generate_key, to_jwk
+
+
+def create_app(jwks_uri: str):
+    '''
+    Creates a flask app with a protected and an unprotected route.
+    '''
+    app = Flask(__name__)
+    app.config.update({
+        'AUTH_ISSUER': 'bench_issuer',
+        'AUTH_AUDIENCE': 'bench',
+        'AUTH_JWKS_URI': jwks_uri,
+    })
+    auth = Authenticator(app)
+
+    @app.route('/protected', methods=['GET'])
+    @auth.require_token
+    def protected():
+        return auth_token['sub'], HTTPStatus.OK
+
+    @app.route('/unprotected', methods=['GET'])
+    def unprotected():
+        return 'bench-user', HTTPStatus.OK
+
+    return app, auth
+
+
+def run(name: str, client, path: str, token: str, requests: int, server: JwksServer,
+    baseline: float = None) -> float:
+    '''
+    Prints the mean latency of requests to path and returns it.
+    '''
+    headers = {'Authorization': 'Bearer ' + token}
+    jwks_requests = server.requests
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = client.get(path, headers=headers)
+        assert response.status_code == HTTPStatus.OK, response.data
+    latency = (time.perf_counter() - start) / requests
+
+    overhead = '' if baseline is None else f', {(latency - baseline) * 1e6:8.1f} us auth'
+    print(f'{name:<28} {latency * 1e6:9.1f} us per request{overhead}, '
+        f'{server.requests - jwks_requests} JWKS fetches')
+    return latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.02,
+        help='seconds the JWKS stand-in waits before responding')
+    args = parser.parse_args()
+
+    key = generate_key()
+    server = JwksServer({'keys': [to_jwk(key, 'bench-key')]})
+    server.delay = args.latency
+    token = jwt.encode({
+        'iss': 'bench_issuer',
+        'aud': 'bench',
+        'sub': 'bench-user',
+        'exp': int(time.time()) + 3600,
+    }, key, algorithm='RS256', headers={'kid': 'bench-key'})
+
+    app, auth = create_app(server.uri)
+    client = app.test_client()
+    baseline = run('unprotected', client, '/unprotected', token, args.requests, server)
+
+    auth.jwks_client = PyJWKClient(server.uri, cache_keys=False)
+    run('PyJWKClient, no cache', client, '/protected', token,
+        max(1, args.requests // 20), server, baseline)
+
+    auth.jwks_client = PyJWKClient(server.uri)
+    run('PyJWKClient, lru cache', client, '/protected', token, args.requests, server,
+        baseline)
+
+    auth.jwks_client = JwksCache(server.uri)
+    run('JwksCache', client, '/protected', token, args.requests, server, baseline)
+    auth.jwks_client.close()
+    server.close()
+
+
+if __name__ == '__main__':
+    main()
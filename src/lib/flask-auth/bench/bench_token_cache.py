@@ -0,0 +1,86 @@
+'''
+Verified token cache benchmark.
+
+Times requests to a protected flask route with and without the verified token
+cache, for several token reuse ratios: the fraction of requests that carry a
+token that was already used by an earlier request.
+
+Run from src/lib/flask-auth:
+    PYTHONPATH=. python bench/bench_token_cache.py --requests 2000
+'''
+import argparse, random, time, jwt
+from http import HTTPStatus
+from auth import JwksCache, VerifiedTokenCache
+from bench_auth import create_app
+from tests.test_jwks import JwksServer, generate_key, to_jwk
+
+
+def create_tokens(key, count: int):
+    '''
+    Creates count distinct access tokens.
+    '''
+    return [
+        jwt.encode({
+            'iss': 'bench_issuer',
+            'aud': 'bench',
+            'sub': f'bench-user-{index}',
+            'exp': int(time.time()) + 3600,
+        }, key, algorithm='RS256', headers={'kid': 'bench-key'})
+        for index in range(count)
+    ]
+
+
+def request_tokens(tokens, requests: int, reuse: float):
+    '''
+    Returns the token of each of requests requests, so that the fraction reuse
+    of them carry a token an earlier request already carried.
+    '''
+    unique = max(1, round(requests * (1 - reuse)))
+    sequence = tokens[:unique] + random.choices(tokens[:unique], k=requests - unique)
+    random.shuffle(sequence)
+    return sequence
+
+
+def run(client, sequence, path: str = '/protected') -> float:
+    '''
+    Requests path once per token of sequence and returns the mean latency.
+    '''
+    start = time.perf_counter()
+    for token in sequence:
+        response = client.get(path, headers={'Authorization': 'Bearer ' + token})
+        assert response.status_code == HTTPStatus.OK, response.data
+    return (time.perf_counter() - start) / len(sequence)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--reuse', type=float, nargs='+', default=[0, 0.5, 0.9, 0.99])
+    args = parser.parse_args()
+
+    key = generate_key()
+    server = JwksServer({'keys': [to_jwk(key, 'bench-key')]})
+    tokens = create_tokens(key, args.requests)
+    app, auth = create_app(server.uri)
+    auth.jwks_client = JwksCache(server.uri)
+    client = app.test_client()
+
+    baseline = run(client, tokens, '/unprotected')
+    print(f'unprotected route: {baseline * 1e6:.1f} us per request')
+    print(f'{"reuse":>6} {"no cache":>12} {"cache":>12}')
+    for reuse in args.reuse:
+        sequence = request_tokens(tokens, args.requests, reuse)
+
+        auth.token_cache = None
+        uncached = run(client, sequence)
+        auth.token_cache = VerifiedTokenCache()
+        cached = run(client, sequence)
+
+        print(f'{reuse:>6.0%} {uncached * 1e6:>9.1f} us {cached * 1e6:>9.1f} us')
+
+    auth.jwks_client.close()
+    server.close()
+
+
+if __name__ == '__main__':
+    main()
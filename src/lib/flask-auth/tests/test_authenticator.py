@@ -1,10 +1,13 @@
-import unittest, time, jwt
+import unittest, json, os, tempfile, time, jwt
 from unittest.mock import MagicMock
 from flask import Flask
-from auth import Authenticator, auth_token
+from auth import Authenticator, JwksBundle, auth_token
 from http import HTTPStatus
+from jwt.algorithms import OKPAlgorithm, RSAAlgorithm
+from jwt.exceptions import PyJWKClientError
+from jwt.utils import base64url_encode
 from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
 from cryptography.hazmat.backends import default_backend
 
 
@@ -26,6 +29,47 @@ public_pem = private_key.public_key().public_bytes(
 ).decode()
 
 
+def to_public_jwk(key) -> dict:
+    '''
+    Returns the public JWK of an RSA, P-256 or Ed25519 private key.
+    '''
+    public_key = key.public_key()
+    if isinstance(public_key, rsa.RSAPublicKey):
+        return json.loads(RSAAlgorithm.to_jwk(public_key))
+    if isinstance(public_key, ec.EllipticCurvePublicKey):
+        numbers = public_key.public_numbers()
+        return {
+            'kty': 'EC',
+            'crv': 'P-256',
+            'x': base64url_encode(numbers.x.to_bytes(32, 'big')).decode(),
+            'y': base64url_encode(numbers.y.to_bytes(32, 'big')).decode(),
+        }
+    return json.loads(OKPAlgorithm.to_jwk(public_key))
+
+
+def create_jwks(*kids: str, key=private_key, alg: str = 'RS256') -> dict:
+    '''
+    Returns a JWKS with the public key of key under each kid, for the
+    algorithm alg, or without an alg if alg is None.
+    '''
+    jwk = dict(to_public_jwk(key), use='sig')
+    if alg != None:
+        jwk['alg'] = alg
+    return {'keys': [dict(jwk, kid=kid) for kid in kids]}
+
+
+def create_token(kid: str = '0', key=private_pem, algorithm: str = 'RS256') -> str:
+    '''
+    Returns a valid access token signed by key.
+    '''
+    return jwt.encode({
+        'iss': 'test_issuer',
+        'exp': int(time.time()) + 30,
+        'aud': 'test',
+        'sub': 'test-user',
+    }, key, algorithm=algorithm, headers={'kid': kid})
+
+
 class TestAuthenticatorInit(unittest.TestCase):
     '''
     The test cases for the initialization of the `Authenticator`. This is a
@@ -295,5 +339,278 @@ class TestAuthenticator(unittest.TestCase):
             self.assertEqual(response.data, str(None).encode())
 
 
+
+class TestJwksBundle(unittest.TestCase):
+    '''
+    The test cases for verifying tokens with a local JWKS bundle, instead of
+    the JWKS of the auth provider.
+    '''
+    def setUp(self) -> None:
+        self.app = Flask(__name__)
+        self.app.config.update({
+            'TESTING': True,
+            'AUTH_ISSUER': 'test_issuer',
+            'AUTH_AUDIENCE': 'test',
+            # nothing listens here, so any request to it would fail
+            'AUTH_JWKS_URI': 'http://127.0.0.1:9/auth/jwks',
+        })
+        self.now = 0.0
+        jwks_file = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False)
+        jwks_file.close()
+        self.path = jwks_file.name
+        self.addCleanup(os.remove, self.path)
+        self.write_jwks(create_jwks('0'))
+
+
+    def write_jwks(self, jwks):
+        '''
+        Writes the JWKS file, with a new modification time.
+        '''
+        with open(self.path, 'w') as jwks_file:
+            jwks_file.write(jwks if isinstance(jwks, str) else json.dumps(jwks))
+        mtime = time.time() + self.now
+        os.utime(self.path, (mtime, mtime))
+
+
+    def create_auth(self) -> Authenticator:
+        '''
+        Creates an authenticator with a protected route.
+        '''
+        auth = Authenticator(self.app)
+
+        @self.app.route('/test/protected', methods=['GET'])
+        @auth.require_token
+        def protected():
+            return auth_token['sub'], HTTPStatus.OK
+
+        return auth
+
+
+    def get_protected(self, access_token: str):
+        '''
+        Requests the protected route with an access token.
+        '''
+        with self.app.test_client() as client:
+            return client.get('/test/protected', headers={
+                'Authorization': 'Bearer ' + access_token
+            })
+
+
+    def test_jwks_config(self):
+        '''
+        Test that tokens are verified with the keys of AUTH_JWKS rather than
+        the JWKS at AUTH_JWKS_URI.
+        '''
+        self.app.config['AUTH_JWKS'] = json.dumps(create_jwks('0'))
+        auth = self.create_auth()
+        self.assertIsInstance(auth.jwks_client, JwksBundle)
+
+        response = self.get_protected(create_token())
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.data, b'test-user')
+
+
+    def test_jwks_file_config(self):
+        '''
+        Test that tokens are verified with the keys of AUTH_JWKS_FILE rather
+        than the JWKS at AUTH_JWKS_URI, and that tokens signed with other keys
+        are rejected.
+        '''
+        self.app.config['AUTH_JWKS_FILE'] = self.path
+        auth = self.create_auth()
+        self.assertEqual(auth.jwks_client.path, self.path)
+
+        self.assertEqual(self.get_protected(create_token()).status_code, HTTPStatus.OK)
+        response = self.get_protected(create_token('unknown'))
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+        self.assertEqual(response.get_json()['error'], 'invalid_token')
+
+
+    def test_missing_jwks_file(self):
+        '''
+        Test that an authenticator cannot be created with a JWKS file that
+        cannot be read, instead of failing every request.
+        '''
+        self.app.config['AUTH_JWKS_FILE'] = self.path + '.missing'
+        with self.assertRaises(OSError):
+            Authenticator(self.app)
+
+
+    def test_invalid_jwks(self):
+        '''
+        Test that an authenticator cannot be created with an AUTH_JWKS without
+        signing keys, instead of rejecting every token.
+        '''
+        for jwks, error in [('not json', ValueError), (json.dumps({'keys': []}), PyJWKClientError)]:
+            with self.subTest(jwks=jwks):
+                self.app.config['AUTH_JWKS'] = jwks
+                with self.assertRaises(error):
+                    Authenticator(self.app)
+
+
+    def test_jwks_uri_fetched_on_first_use(self):
+        '''
+        Test that creating an authenticator does not fetch the JWKS at
+        AUTH_JWKS_URI, while a local JWKS is loaded right away.
+        '''
+        auth = Authenticator(self.app)
+        self.assertIsNone(auth._jwks_client)
+
+        self.app.config['AUTH_JWKS_FILE'] = self.path
+        self.assertEqual(Authenticator(self.app)._jwks_client.path, self.path)
+
+
+    def test_no_jwks(self):
+        '''
+        Test that a JWKS bundle must have signing keys.
+        '''
+        with self.assertRaises(PyJWKClientError):
+            JwksBundle({'keys': []})
+        with self.assertRaises(ValueError):
+            JwksBundle('not json')
+        with self.assertRaises(OSError):
+            JwksBundle(path=self.path + '.missing')
+        with self.assertRaises(AssertionError):
+            JwksBundle(create_jwks('0'), reload_interval=10)
+
+
+    def test_reload(self):
+        '''
+        Test that a changed JWKS file is reloaded after reload_interval, and
+        that the loaded keys are kept if it cannot be reloaded.
+        '''
+        bundle = JwksBundle(path=self.path, reload_interval=10, clock=lambda: self.now)
+        self.write_jwks(create_jwks('1'))
+
+        self.now += 5
+        self.assertEqual(bundle.get_signing_key('0').key_id, '0')
+        with self.assertRaises(PyJWKClientError):
+            bundle.get_signing_key('1')
+
+        self.now += 5
+        self.assertEqual(bundle.get_signing_key('1').key_id, '1')
+        with self.assertRaises(PyJWKClientError):
+            bundle.get_signing_key('0')
+
+        self.write_jwks('{"keys": [')
+        self.now += 10
+        self.assertEqual(bundle.get_signing_key('1').key_id, '1')
+        with self.assertRaises(ValueError):
+            bundle.refresh()
+
+        self.write_jwks(create_jwks('2'))
+        bundle.refresh()
+        self.assertEqual(bundle.get_signing_key('2').key_id, '2')
+
+
+    def test_no_reload_interval(self):
+        '''
+        Test that the JWKS file is never reloaded without a reload_interval.
+        '''
+        bundle = JwksBundle(path=self.path, clock=lambda: self.now)
+        self.write_jwks(create_jwks('1'))
+        self.now += 24 * 60 * 60
+        self.assertEqual(bundle.get_signing_key('0').key_id, '0')
+        with self.assertRaises(PyJWKClientError):
+            bundle.get_signing_key('1')
+
+
+
+class TestAlgorithms(unittest.TestCase):
+    '''
+    The test cases for accepting access tokens signed with other algorithms
+    than RS256.
+    '''
+    ec_key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    ed_key = ed25519.Ed25519PrivateKey.generate()
+
+    def setUp(self) -> None:
+        self.app = Flask(__name__)
+        self.app.config.update({
+            'TESTING': True,
+            'AUTH_ISSUER': 'test_issuer',
+            'AUTH_AUDIENCE': 'test',
+            'AUTH_JWKS': {'keys': create_jwks('rsa')['keys']
+                + create_jwks('ec', key=self.ec_key, alg='ES256')['keys']
+                + create_jwks('ed', key=self.ed_key, alg=None)['keys']},
+            'AUTH_ALGORITHMS': ['RS256', 'ES256', 'EdDSA'],
+        })
+
+
+    def create_auth(self) -> Authenticator:
+        '''
+        Creates an authenticator with a protected route.
+        '''
+        auth = Authenticator(self.app)
+
+        @self.app.route('/test/protected', methods=['GET'])
+        @auth.require_token
+        def protected():
+            return auth_token['sub'], HTTPStatus.OK
+
+        return auth
+
+
+    def get_protected(self, access_token: str):
+        '''
+        Requests the protected route with an access token.
+        '''
+        with self.app.test_client() as client:
+            return client.get('/test/protected', headers={
+                'Authorization': 'Bearer ' + access_token
+            })
+
+
+    def test_accepted_algorithms(self):
+        '''
+        Test that tokens are verified with the algorithm of their signing key's
+        JWK, or the algorithm inferred from the key if the JWK has no alg.
+        '''
+        self.create_auth()
+        for token in [
+            create_token('rsa'),
+            create_token('ec', self.ec_key, 'ES256'),
+            create_token('ed', self.ed_key, 'EdDSA'),
+        ]:
+            with self.subTest(algorithm=jwt.get_unverified_header(token)['alg']):
+                response = self.get_protected(token)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                self.assertEqual(response.data, b'test-user')
+
+
+    def test_algorithm_not_accepted(self):
+        '''
+        Test that tokens signed with keys of algorithms that are not accepted
+        are rejected, and that only RS256 is accepted by default.
+        '''
+        del self.app.config['AUTH_ALGORITHMS']
+        self.create_auth()
+        response = self.get_protected(create_token('ec', self.ec_key, 'ES256'))
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+        self.assertEqual(response.get_json()['error'], 'invalid_token')
+
+
+    def test_algorithm_does_not_match_key(self):
+        '''
+        Test that tokens must be signed with the algorithm of their signing
+        key, even if their own algorithm is accepted.
+        '''
+        self.create_auth()
+        response = self.get_protected(create_token('ec'))
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+        self.assertEqual(response.get_json()['error'], 'invalid_token')
+
+
+    def test_symmetric_algorithms(self):
+        '''
+        Test the assertion that only asymmetric algorithms can be accepted.
+        '''
+        for algorithms in [[], ['RS256', 'HS256'], ['none']]:
+            with self.subTest(algorithms=algorithms):
+                self.app.config['AUTH_ALGORITHMS'] = algorithms
+                with self.assertRaises(AssertionError):
+                    Authenticator(self.app)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,235 @@
+import unittest, time, jwt
+from unittest.mock import MagicMock
+from flask import Flask
+from http import HTTPStatus
+from auth import Authenticator, Claims, auth_token
+from auth.authorization import roles_predicate, scopes_predicate
+from tests.test_authenticator import private_pem, public_pem
+
+
+class TestScopesPredicate(unittest.TestCase):
+    '''
+    The test cases for the compiled scope predicates.
+    '''
+    def test_require_all(self):
+        '''
+        Test that every scope is required by default.
+        '''
+        predicate = scopes_predicate(['mibs:read', 'mibs:write'])
+        self.assertTrue(predicate(Claims({'scope': 'openid mibs:read mibs:write'})))
+        self.assertFalse(predicate(Claims({'scope': 'openid mibs:read'})))
+        self.assertFalse(predicate(Claims({'scope': 'mibs:read-write'})))
+
+
+    def test_require_any(self):
+        '''
+        Test that any one scope is enough when require_all is False.
+        '''
+        predicate = scopes_predicate(['mibs:read', 'mibs:write'], require_all=False)
+        self.assertTrue(predicate(Claims({'scope': 'openid mibs:write'})))
+        self.assertFalse(predicate(Claims({'scope': 'openid profile'})))
+
+
+    def test_missing_or_invalid_scope_claim(self):
+        '''
+        Test that claims without a string scope claim have no scopes.
+        '''
+        for require_all in [True, False]:
+            predicate = scopes_predicate(['mibs:read'], require_all=require_all)
+            self.assertFalse(predicate(Claims({})))
+            self.assertFalse(predicate(Claims({'scope': ['mibs:read']})))
+
+
+    def test_no_scopes(self):
+        '''
+        Test that at least one scope must be required.
+        '''
+        with self.assertRaises(AssertionError):
+            scopes_predicate([])
+
+
+class TestRolesPredicate(unittest.TestCase):
+    '''
+    The test cases for the compiled role predicates.
+    '''
+    claims = Claims({
+        'realm_access': {'roles': ['user', 'offline_access']},
+        'resource_access': {'mibs': {'roles': ['mibs-admin']}},
+    })
+
+
+    def test_realm_roles(self):
+        '''
+        Test that realm roles are read from realm_access.roles.
+        '''
+        self.assertTrue(roles_predicate(['user'])(self.claims))
+        self.assertTrue(roles_predicate(['user', 'offline_access'])(self.claims))
+        self.assertFalse(roles_predicate(['user', 'admin'])(self.claims))
+        self.assertTrue(roles_predicate(['user', 'admin'], require_all=False)(self.claims))
+        self.assertFalse(roles_predicate(['mibs-admin'])(self.claims))
+
+
+    def test_client_roles(self):
+        '''
+        Test that client roles are read from resource_access.<client>.roles.
+        '''
+        self.assertTrue(roles_predicate(['mibs-admin'], client='mibs')(self.claims))
+        self.assertFalse(roles_predicate(['user'], client='mibs')(self.claims))
+        self.assertFalse(roles_predicate(['mibs-admin'], client='other')(self.claims))
+
+
+    def test_missing_or_invalid_role_claims(self):
+        '''
+        Test that claims without well formed role claims have no roles.
+        '''
+        for claims in [{}, {'realm_access': None}, {'realm_access': {'roles': 'user'}},
+            {'resource_access': []}, {'resource_access': {'mibs': None}}]:
+            with self.subTest(claims=claims):
+                self.assertFalse(roles_predicate(['user'])(Claims(claims)))
+                self.assertFalse(roles_predicate(['user'], client='mibs')(Claims(claims)))
+
+
+class TestAuthorizationDecorators(unittest.TestCase):
+    '''
+    The test cases for the require_scopes and require_roles decorators.
+    '''
+    def setUp(self) -> None:
+        self.app = Flask(__name__)
+        self.app.config.update({
+            'TESTING': True,
+            'AUTH_ISSUER': 'test_issuer',
+            'AUTH_AUDIENCE': 'test',
+            'AUTH_JWKS_URI': 'http://localhost/auth/jwks',
+            'AUTH_TOKEN_CACHE_SIZE': 0,
+        })
+        self.auth = Authenticator(self.app)
+        mock_signing_key = MagicMock()
+        mock_signing_key.key = public_pem
+        self.auth.jwks_client = MagicMock()
+        self.auth.jwks_client.get_signing_key_from_jwt = MagicMock(
+            return_value=mock_signing_key
+        )
+        auth = self.auth
+
+        @self.app.route('/test/read', methods=['GET'])
+        @auth.require_scopes('mibs:read')
+        def read():
+            return auth_token['sub'], HTTPStatus.OK
+
+        @self.app.route('/test/read-or-write', methods=['GET'])
+        @auth.require_scopes('mibs:read', 'mibs:write', require_all=False)
+        def read_or_write():
+            return auth_token['sub'], HTTPStatus.OK
+
+        @self.app.route('/test/admin', methods=['GET'])
+        @auth.require_token
+        @auth.require_scopes('mibs:read', 'mibs:write')
+        @auth.require_roles('user')
+        @auth.require_roles('mibs-admin', client='mibs')
+        def admin():
+            return auth_token['sub'], HTTPStatus.OK
+
+
+    def get(self, path: str, scope: str = None, realm_roles=None, client_roles=None):
+        '''
+        Requests path with an access token that has the given claims.
+        '''
+        payload = {
+            'iss': 'test_issuer',
+            'exp': int(time.time()) + 30,
+            'aud': 'test',
+            'sub': 'test-user',
+        }
+        if scope != None:
+            payload['scope'] = scope
+        if realm_roles != None:
+            payload['realm_access'] = {'roles': realm_roles}
+        if client_roles != None:
+            payload['resource_access'] = {'mibs': {'roles': client_roles}}
+        access_token = jwt.encode(payload, private_pem, algorithm='RS256',
+            headers={'kid': '0'})
+        with self.app.test_client() as client:
+            return client.get(path, headers={
+                'Authorization': 'Bearer ' + access_token
+            })
+
+
+    def assert_forbidden(self, response, description: str):
+        '''
+        Asserts that a response is an insufficient_scope error.
+        '''
+        self.assertEqual(response.status_code, HTTPStatus.FORBIDDEN)
+        self.assertEqual(response.get_json(), {
+            'error': 'insufficient_scope',
+            'error_description': description,
+        })
+        self.assertIn('error="insufficient_scope"', response.headers['WWW-Authenticate'])
+
+
+    def test_require_scopes(self):
+        '''
+        Test that require_scopes allows tokens with the scope and forbids
+        tokens without it.
+        '''
+        response = self.get('/test/read', scope='openid mibs:read')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.data, b'test-user')
+
+        self.assert_forbidden(self.get('/test/read', scope='openid'),
+            'requires scope mibs:read')
+        self.assert_forbidden(self.get('/test/read'), 'requires scope mibs:read')
+
+
+    def test_require_any_scope(self):
+        '''
+        Test that require_scopes with require_all=False allows tokens with any
+        one of the scopes.
+        '''
+        for scope in ['mibs:read', 'mibs:write', 'mibs:write mibs:read']:
+            with self.subTest(scope=scope):
+                response = self.get('/test/read-or-write', scope=scope)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assert_forbidden(self.get('/test/read-or-write', scope='profile'),
+            'requires scope mibs:read or mibs:write')
+
+
+    def test_requires_token(self):
+        '''
+        Test that the decorators authenticate the request when no require_token
+        did.
+        '''
+        with self.app.test_client() as client:
+            response = client.get('/test/read')
+            self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+            response = client.get('/test/read', headers={
+                'Authorization': 'Bearer not-a-token'
+            })
+            self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+            self.assertEqual(response.get_json()['error'], 'invalid_token')
+
+
+    def test_stacked_decorators(self):
+        '''
+        Test that stacked decorators each check their claims but verify the
+        token only once per request.
+        '''
+        response = self.get('/test/admin', scope='mibs:read mibs:write',
+            realm_roles=['user'], client_roles=['mibs-admin'])
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(self.auth.jwks_client.get_signing_key_from_jwt.call_count, 1)
+
+        for claims, description in [
+            ({'scope': 'mibs:read', 'realm_roles': ['user'], 'client_roles': ['mibs-admin']},
+                'requires scope mibs:read and mibs:write'),
+            ({'scope': 'mibs:read mibs:write', 'client_roles': ['mibs-admin']},
+                'requires role user'),
+            ({'scope': 'mibs:read mibs:write', 'realm_roles': ['user', 'mibs-admin']},
+                'requires role mibs-admin'),
+        ]:
+            with self.subTest(claims=claims):
+                self.assert_forbidden(self.get('/test/admin', **claims), description)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import unittest, time, jwt
+from unittest.mock import MagicMock
+from flask import Flask
+from http import HTTPStatus
+from auth import Authenticator, Claims, auth_token, get_claims, roles_predicate, \
+    scopes_predicate
+from tests.test_authenticator import private_pem, public_pem
+
+
+class TestClaims(unittest.TestCase):
+    '''
+    The test cases for the claims object.
+    '''
+    raw = {
+        'sub': 'test-user',
+        'exp': 1000,
+        'scope': 'openid mibs:read',
+        'realm_access': {'roles': ['user', {'not': 'a role'}]},
+        'resource_access': {'mibs': {'roles': ['mibs-admin']}},
+    }
+
+    def test_fields(self):
+        '''
+        Test that the fields of the claims are read from the raw claims.
+        '''
+        claims = Claims(self.raw)
+        self.assertIs(claims.raw, self.raw)
+        self.assertEqual(claims.subject, 'test-user')
+        self.assertEqual(claims.user_id, 'test-user')
+        self.assertEqual(claims.expires_at, 1000)
+        self.assertEqual(claims.scopes, {'openid', 'mibs:read'})
+        self.assertEqual(claims.roles, {'user'})
+        self.assertEqual(claims.client_roles('mibs'), {'mibs-admin'})
+        self.assertEqual(claims.client_roles('other'), frozenset())
+
+
+    def test_missing_claims(self):
+        '''
+        Test that missing claims have no value.
+        '''
+        claims = Claims({})
+        self.assertIsNone(claims.subject)
+        self.assertIsNone(claims.expires_at)
+        self.assertEqual(claims.scopes, frozenset())
+        self.assertEqual(claims.roles, frozenset())
+
+
+    def test_lazy(self):
+        '''
+        Test that scopes and roles are parsed once, when first read, and that
+        claims objects have no per-instance dict.
+        '''
+        claims = Claims(self.raw)
+        self.assertIsNone(claims._scopes)
+        self.assertIsNone(claims._roles)
+        self.assertIs(claims.scopes, claims.scopes)
+        self.assertIsNone(claims._roles)
+        self.assertIs(claims.client_roles('mibs'), claims.client_roles('mibs'))
+        self.assertFalse(hasattr(claims, '__dict__'))
+
+
+    def test_parsed_by_predicates(self):
+        '''
+        Test that the predicates of require_scopes and require_roles read the
+        parsed scopes and roles, so a request parses them once.
+        '''
+        claims = Claims(self.raw)
+        self.assertTrue(scopes_predicate(['mibs:read'])(claims))
+        self.assertTrue(roles_predicate(['user'])(claims))
+        self.assertTrue(roles_predicate(['mibs-admin'], client='mibs')(claims))
+        scopes, roles, client_roles = claims.scopes, claims.roles, claims.client_roles('mibs')
+
+        self.assertFalse(scopes_predicate(['mibs:write'])(claims))
+        self.assertFalse(roles_predicate(['admin'], client='mibs')(claims))
+        self.assertIs(claims.scopes, scopes)
+        self.assertIs(claims.roles, roles)
+        self.assertIs(claims.client_roles('mibs'), client_roles)
+
+
+class TestGetClaims(unittest.TestCase):
+    '''
+    The test cases for accessing the claims of the current request.
+    '''
+    def setUp(self) -> None:
+        self.app = Flask(__name__)
+        self.app.config.update({
+            'TESTING': True,
+            'AUTH_ISSUER': 'test_issuer',
+            'AUTH_AUDIENCE': 'test',
+            'AUTH_JWKS_URI': 'http://localhost/auth/jwks',
+        })
+        self.auth = Authenticator(self.app)
+        mock_signing_key = MagicMock()
+        mock_signing_key.key = public_pem
+        self.auth.jwks_client = MagicMock()
+        self.auth.jwks_client.get_signing_key_from_jwt = MagicMock(
+            return_value=mock_signing_key
+        )
+
+        @self.app.route('/test/protected', methods=['GET'])
+        @self.auth.require_token
+        def protected():
+            claims = get_claims()
+            return {
+                'userId': claims.user_id,
+                'scopes': sorted(claims.scopes),
+                'sub': auth_token['sub'],
+            }, HTTPStatus.OK
+
+        @self.app.route('/test/unprotected', methods=['GET'])
+        def unprotected():
+            return {'claims': repr(get_claims()), 'auth_token': auth_token == None}, \
+                HTTPStatus.OK
+
+        self.access_token = jwt.encode({
+            'iss': 'test_issuer',
+            'exp': int(time.time()) + 30,
+            'aud': 'test',
+            'sub': 'test-user',
+            'scope': 'openid mibs:read',
+        }, private_pem, algorithm='RS256', headers={'kid': '0'})
+
+
+    def test_protected(self):
+        '''
+        Test that protected routes can read the claims of their request.
+        '''
+        self.assertIs(self.app.extensions['auth'], self.auth)
+        with self.app.test_client() as client:
+            response = client.get('/test/protected', headers={
+                'Authorization': 'Bearer ' + self.access_token
+            })
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            self.assertEqual(response.get_json(), {
+                'userId': 'test-user',
+                'scopes': ['mibs:read', 'openid'],
+                'sub': 'test-user',
+            })
+
+
+    def test_shared_app_context(self):
+        '''
+        Test that the claims of a request are not seen by a later request that
+        shares its app context.
+        '''
+        with self.app.app_context(), self.app.test_client() as client:
+            response = client.get('/test/protected', headers={
+                'Authorization': 'Bearer ' + self.access_token
+            })
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+
+            response = client.get('/test/unprotected')
+            self.assertEqual(response.get_json(), {'claims': 'None', 'auth_token': True})
+            response = client.get('/test/protected')
+            self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,300 @@
+import json, threading, time, unittest, jwt
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import URLError
+from flask import Flask
+from jwt.algorithms import RSAAlgorithm
+from jwt.exceptions import PyJWKClientError
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.backends import default_backend
+from auth import Authenticator, JwksCache, auth_token, shared_jwks_cache
+
+
+def generate_key():
+    '''
+    Generates an RSA private key to sign test tokens with.
+    '''
+    return rsa.generate_private_key(
+        public_exponent=65537,
+        key_size=2048,
+        backend=default_backend()
+    )
+
+
+def to_jwk(private_key, kid: str) -> dict:
+    '''
+    Returns the public JWK of a private key.
+    '''
+    jwk = json.loads(RSAAlgorithm.to_jwk(private_key.public_key()))
+    jwk.update({'kid': kid, 'use': 'sig', 'alg': 'RS256'})
+    return jwk
+
+
+class JwksServer(object):
+    '''
+    A local stand-in for an auth provider's JWKS endpoint.
+
+    Attributes:
+        jwks: The JWKS that is served
+        requests: The number of requests received
+        delay: Seconds to wait before responding
+        available: False to respond with 503 Service Unavailable
+    '''
+    def __init__(self, jwks: dict):
+        self.jwks = jwks
+        self.requests = 0
+        self.delay = 0
+        self.available = True
+
+        server = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                time.sleep(server.delay)
+                if not server.available:
+                    self.send_error(HTTPStatus.SERVICE_UNAVAILABLE)
+                    return
+                body = json.dumps(server.jwks).encode()
+                self.send_response(HTTPStatus.OK)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.http_server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.uri = f'http://127.0.0.1:{self.http_server.server_port}/auth/jwks'
+        self.thread = threading.Thread(target=self.http_server.serve_forever,
+            kwargs={'poll_interval': 0.01}, daemon=True)
+        self.thread.start()
+
+
+    def close(self):
+        self.http_server.shutdown()
+        self.http_server.server_close()
+
+
+signing_key = generate_key()
+rotated_key = generate_key()
+
+
+class TestJwksCache(unittest.TestCase):
+    '''
+    The test cases for the JWKS signing-key cache, against a local JWKS
+    stand-in server.
+    '''
+    def setUp(self) -> None:
+        self.server = JwksServer({'keys': [to_jwk(signing_key, 'key-1')]})
+        self.addCleanup(self.server.close)
+        self.now = 0.0
+
+
+    def create_cache(self, **options) -> JwksCache:
+        '''
+        Creates a cache of the stand-in server's JWKS with a fake clock.
+        '''
+        options.setdefault('refresh_interval', 3600)
+        cache = JwksCache(self.server.uri, ttl=60, max_stale=600,
+            clock=lambda: self.now, **options)
+        self.addCleanup(cache.close)
+        return cache
+
+
+    def wait_for_requests(self, requests: int):
+        '''
+        Waits for the stand-in server to receive a number of requests.
+        '''
+        deadline = time.monotonic() + 5
+        while self.server.requests < requests and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.server.requests, requests)
+
+
+    def test_fetches_once(self):
+        '''
+        Test that the JWKS is fetched on first use and then served from the
+        cache.
+        '''
+        cache = self.create_cache()
+        for _ in range(10):
+            self.assertEqual(cache.get_signing_key('key-1').key_id, 'key-1')
+            self.now += 5
+        self.assertEqual(self.server.requests, 1)
+
+
+    def test_get_signing_key_from_jwt(self):
+        '''
+        Test that the signing key of a token is found by its kid.
+        '''
+        cache = self.create_cache()
+        token = jwt.encode({'sub': 'test-user'}, signing_key, algorithm='RS256',
+            headers={'kid': 'key-1'})
+        self.assertEqual(cache.get_signing_key_from_jwt(token).key_id, 'key-1')
+        with self.assertRaises(jwt.exceptions.DecodeError):
+            cache.get_signing_key_from_jwt('not a token')
+
+
+    def test_unknown_kid_refetches(self):
+        '''
+        Test that an unknown kid refetches the JWKS, so rotated keys are found,
+        but at most once every min_fetch_interval.
+        '''
+        cache = self.create_cache(min_fetch_interval=5)
+        cache.get_signing_key('key-1')
+        self.server.jwks['keys'].append(to_jwk(rotated_key, 'key-2'))
+
+        self.now += 5
+        self.assertEqual(cache.get_signing_key('key-2').key_id, 'key-2')
+        self.assertEqual(self.server.requests, 2)
+
+        for _ in range(10):
+            with self.assertRaises(PyJWKClientError):
+                cache.get_signing_key('unknown')
+        self.assertEqual(self.server.requests, 2)
+
+        self.now += 5
+        with self.assertRaises(PyJWKClientError):
+            cache.get_signing_key('unknown')
+        self.assertEqual(self.server.requests, 3)
+
+
+    def test_single_flight(self):
+        '''
+        Test that concurrent requests for an unknown kid share a single fetch.
+        '''
+        cache = self.create_cache()
+        self.server.delay = 0.2
+        keys = []
+        threads = [
+            threading.Thread(target=lambda: keys.append(cache.get_signing_key('key-1')))
+            for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(keys), 10)
+        self.assertEqual(self.server.requests, 1)
+
+
+    def test_stale_while_revalidate(self):
+        '''
+        Test that keys older than the ttl are still used while they are
+        refetched in the background.
+        '''
+        cache = self.create_cache()
+        cache.get_signing_key('key-1')
+        self.server.delay = 0.2
+        self.server.jwks = {'keys': [to_jwk(rotated_key, 'key-2')]}
+
+        self.now += 61
+        start = time.monotonic()
+        self.assertEqual(cache.get_signing_key('key-1').key_id, 'key-1')
+        self.assertLess(time.monotonic() - start, 0.1)
+
+        self.wait_for_requests(2)
+        deadline = time.monotonic() + 5
+        while 'key-2' not in cache._keys and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(cache.get_signing_key('key-2').key_id, 'key-2')
+
+
+    def test_provider_outage(self):
+        '''
+        Test that cached keys are used while the JWKS cannot be fetched, until
+        they are max_stale seconds old.
+        '''
+        cache = self.create_cache()
+        cache.get_signing_key('key-1')
+        self.server.available = False
+
+        self.now += 300
+        self.assertEqual(cache.get_signing_key('key-1').key_id, 'key-1')
+        self.wait_for_requests(2)
+
+        self.now += 300
+        with self.assertRaises(URLError):
+            cache.get_signing_key('key-1')
+
+        self.server.available = True
+        self.now += 5
+        self.assertEqual(cache.get_signing_key('key-1').key_id, 'key-1')
+
+
+    def test_provider_unreachable(self):
+        '''
+        Test that a URLError is raised when no keys could ever be fetched, and
+        that the failed fetch is not retried by every request.
+        '''
+        self.server.available = False
+        cache = self.create_cache()
+        for _ in range(5):
+            with self.assertRaises(URLError):
+                cache.get_signing_key('key-1')
+        self.assertEqual(self.server.requests, 1)
+
+
+    def test_background_refresh(self):
+        '''
+        Test that the keys are refetched in the background every
+        refresh_interval.
+        '''
+        cache = self.create_cache(refresh_interval=0.05)
+        cache.get_signing_key('key-1')
+        deadline = time.monotonic() + 5
+        while self.server.requests < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertGreaterEqual(self.server.requests, 3)
+
+
+    def test_shared_jwks_cache(self):
+        '''
+        Test that the process shares one cache per JWKS URI.
+        '''
+        cache = shared_jwks_cache(self.server.uri)
+        self.addCleanup(cache.close)
+        self.assertIs(shared_jwks_cache(self.server.uri), cache)
+        self.assertIsNot(shared_jwks_cache(self.server.uri + '?other'), cache)
+
+
+    def test_authenticator(self):
+        '''
+        Test that the Authenticator verifies tokens with the cached keys and
+        only fetches the JWKS once for many requests.
+        '''
+        app = Flask(__name__)
+        app.config.update({
+            'TESTING': True,
+            'AUTH_ISSUER': 'test_issuer',
+            'AUTH_AUDIENCE': 'test',
+            'AUTH_JWKS_URI': self.server.uri,
+        })
+        auth = Authenticator(app)
+        self.addCleanup(auth.jwks_client.close)
+
+        @app.route('/test/protected', methods=['GET'])
+        @auth.require_token
+        def protected():
+            return auth_token['sub'], HTTPStatus.OK
+
+        access_token = jwt.encode({
+            'iss': 'test_issuer',
+            'exp': int(time.time()) + 30,
+            'aud': 'test',
+            'sub': 'test-user',
+        }, signing_key, algorithm='RS256', headers={'kid': 'key-1'})
+        with app.test_client() as client:
+            for _ in range(10):
+                response = client.get('/test/protected', headers={
+                    'Authorization': 'Bearer ' + access_token
+                })
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                self.assertEqual(response.data, b'test-user')
+        self.assertEqual(self.server.requests, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+import unittest, time, jwt
+from unittest.mock import MagicMock
+from flask import Flask
+from http import HTTPStatus
+from auth import Authenticator, VerifiedTokenCache, auth_token
+from tests.test_authenticator import private_pem, public_pem
+
+
+class TestVerifiedTokenCache(unittest.TestCase):
+    '''
+    The test cases for the verified token cache.
+    '''
+    def setUp(self) -> None:
+        self.now = 1000.0
+        self.cache = VerifiedTokenCache(max_size=2, clock=lambda: self.now)
+
+
+    def test_get_put(self):
+        '''
+        Test that the claims of a cached token are returned until it expires.
+        '''
+        self.assertIsNone(self.cache.get('token-1'))
+        self.cache.put('token-1', {'sub': 'user-1', 'exp': 1010})
+        self.assertEqual(self.cache.get('token-1'), {'sub': 'user-1', 'exp': 1010})
+        self.assertIsNone(self.cache.get('token-2'))
+
+        self.now = 1010
+        self.assertIsNone(self.cache.get('token-1'))
+        self.assertEqual(len(self.cache), 0)
+
+
+    def test_returns_copy(self):
+        '''
+        Test that changing returned claims does not change the cached claims.
+        '''
+        self.cache.put('token-1', {'sub': 'user-1', 'exp': 1010})
+        self.cache.get('token-1')['sub'] = 'someone-else'
+        self.assertEqual(self.cache.get('token-1')['sub'], 'user-1')
+
+
+    def test_no_exp(self):
+        '''
+        Test that tokens without an expiry are never cached.
+        '''
+        self.cache.put('token-1', {'sub': 'user-1'})
+        self.cache.put('token-2', {'sub': 'user-2', 'exp': 'soon'})
+        self.assertEqual(len(self.cache), 0)
+
+
+    def test_least_recently_used_evicted(self):
+        '''
+        Test that the least recently used token is evicted when the cache is
+        full.
+        '''
+        self.cache.put('token-1', {'sub': 'user-1', 'exp': 1010})
+        self.cache.put('token-2', {'sub': 'user-2', 'exp': 1010})
+        self.cache.get('token-1')
+        self.cache.put('token-3', {'sub': 'user-3', 'exp': 1010})
+
+        self.assertIsNotNone(self.cache.get('token-1'))
+        self.assertIsNone(self.cache.get('token-2'))
+        self.assertIsNotNone(self.cache.get('token-3'))
+
+
+class TestAuthenticatorTokenCache(unittest.TestCase):
+    '''
+    The test cases for the verified token cache of the authenticator.
+    '''
+    def setUp(self) -> None:
+        self.app = Flask(__name__)
+        self.app.config.update({
+            'TESTING': True,
+            'AUTH_ISSUER': 'test_issuer',
+            'AUTH_AUDIENCE': 'test',
+            'AUTH_JWKS_URI': 'http://localhost/auth/jwks',
+        })
+
+
+    def create_auth(self) -> Authenticator:
+        '''
+        Creates an authenticator with a mock JWKS client and a protected route.
+        '''
+        auth = Authenticator(self.app)
+        mock_signing_key = MagicMock()
+        mock_signing_key.key = public_pem
+        auth.jwks_client = MagicMock()
+        auth.jwks_client.get_signing_key_from_jwt = MagicMock(
+            return_value=mock_signing_key
+        )
+
+        @self.app.route('/test/protected', methods=['GET'])
+        @auth.require_token
+        def protected():
+            return auth_token['sub'], HTTPStatus.OK
+
+        return auth
+
+
+    def get_protected(self, access_token: str):
+        '''
+        Requests the protected route with an access token.
+        '''
+        with self.app.test_client() as client:
+            return client.get('/test/protected', headers={
+                'Authorization': 'Bearer ' + access_token
+            })
+
+
+    def create_token(self, exp: int, sub: str = 'test-user') -> str:
+        '''
+        Creates a signed access token.
+        '''
+        return jwt.encode({
+            'iss': 'test_issuer',
+            'exp': exp,
+            'aud': 'test',
+            'sub': sub,
+        }, private_pem, algorithm='RS256', headers={'kid': '0'})
+
+
+    def test_repeated_token_verified_once(self):
+        '''
+        Test that repeated requests with the same token only verify it once.
+        '''
+        auth = self.create_auth()
+        access_token = self.create_token(int(time.time()) + 30)
+        for _ in range(5):
+            response = self.get_protected(access_token)
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            self.assertEqual(response.data, b'test-user')
+        self.assertEqual(auth.jwks_client.get_signing_key_from_jwt.call_count, 1)
+
+        other_token = self.create_token(int(time.time()) + 30, sub='other-user')
+        self.assertEqual(self.get_protected(other_token).data, b'other-user')
+        self.assertEqual(auth.jwks_client.get_signing_key_from_jwt.call_count, 2)
+
+
+    def test_expired_cached_token(self):
+        '''
+        Test that a cached token is verified again once it has reached its exp.
+        '''
+        auth = self.create_auth()
+        access_token = self.create_token(int(time.time()) + 30)
+        self.assertEqual(self.get_protected(access_token).status_code, HTTPStatus.OK)
+        self.assertEqual(self.get_protected(access_token).status_code, HTTPStatus.OK)
+        self.assertEqual(auth.jwks_client.get_signing_key_from_jwt.call_count, 1)
+
+        auth.token_cache.clock = lambda: time.time() + 30
+        self.assertEqual(self.get_protected(access_token).status_code, HTTPStatus.OK)
+        self.assertEqual(auth.jwks_client.get_signing_key_from_jwt.call_count, 2)
+
+
+    def test_invalid_token_not_cached(self):
+        '''
+        Test that tokens that fail verification are not cached.
+        '''
+        auth = self.create_auth()
+        access_token = self.create_token(int(time.time()) - 30)
+        for _ in range(2):
+            response = self.get_protected(access_token)
+            self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+        self.assertEqual(len(auth.token_cache), 0)
+
+
+    def test_cache_disabled(self):
+        '''
+        Test that every request verifies its token when AUTH_TOKEN_CACHE_SIZE
+        is 0.
+        '''
+        self.app.config['AUTH_TOKEN_CACHE_SIZE'] = 0
+        auth = self.create_auth()
+        self.assertIsNone(auth.token_cache)
+        access_token = self.create_token(int(time.time()) + 30)
+        for _ in range(3):
+            self.assertEqual(self.get_protected(access_token).status_code, HTTPStatus.OK)
+        self.assertEqual(auth.jwks_client.get_signing_key_from_jwt.call_count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+'''
+POST /mibs/batch throughput benchmark.
+
+Creates the same bottles by looping over POST /mibs and with POST /mibs/batch
+through the flask test client, and reports bottles created per second for each.
+
+Run from src/projects/mibs with the same PYTHONPATH as the tests:
+    python bench/bench_batch.py --messages 5000 --batch-size 500
+'''
+import argparse
+
+from api.mibs import mibs_blueprint
+from common import create_app, create_client, timer
+from models import Message, db
+
+
+def create_bodies(count: int, recipients_per_message: int):
+    '''
+    Creates count MessageInABottle request bodies with recipients_per_message
+    recipients each.
+    '''
+    return [
+        {
+            'message': f'bench message {index}',
+            'recipients': [
+                {'email': f'recipient{index}-{recipient}@bench.local'}
+                for recipient in range(recipients_per_message)
+            ],
+            'sendTime': '2030-01-01T12:00:00.000Z',
+        }
+        for index in range(count)
+    ]
+
+
+def post_each(client, bodies):
+    '''
+    Creates every body with its own POST /mibs.
+    '''
+    for body in bodies:
+        response = client.post('/mibs', json=body)
+        assert response.status_code == 201, response.data
+
+
+def post_batches(client, bodies, batch_size: int):
+    '''
+    Creates the bodies batch_size at a time with POST /mibs/batch.
+    '''
+    for start in range(0, len(bodies), batch_size):
+        response = client.post('/mibs/batch', json=bodies[start:start + batch_size])
+        assert response.status_code == 201, response.data
+
+
+def run(name: str, app, create):
+    '''
+    Empties the Message table, runs create and prints its throughput.
+    '''
+    with app.app_context():
+        Message.query.delete()
+        db.session.commit()
+
+    with timer() as elapsed:
+        create()
+
+    with app.app_context():
+        count = Message.query.count()
+    print(f'{name:<28} {count / elapsed["seconds"]:>8.0f} bottles/s ({count} bottles)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--recipients', type=int, default=2, help='recipients per message')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--db-uri', default=None,
+        help='database to benchmark against, defaults to a temporary SQLite file')
+    args = parser.parse_args()
+
+    app = create_app(args.db_uri)
+    app.register_blueprint(mibs_blueprint)
+    client = create_client(app)
+    bodies = create_bodies(args.messages, args.recipients)
+
+    run('POST /mibs per bottle', app, lambda: post_each(client, bodies))
+    run(f'POST /mibs/batch of {args.batch_size}', app,
+        lambda: post_batches(client, bodies, args.batch_size))
+
+
+if __name__ == '__main__':
+    main()
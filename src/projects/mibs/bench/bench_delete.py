@@ -0,0 +1,112 @@
+'''
+DELETE /mibs latency benchmark.
+
+Seeds 10k messages with recipients for one user among other users' messages,
+then times deleting all of them with delete_mibs_for_user, with the previous
+count-then-delete and with per-object ORM deletes, and times deleting the same
+messages by explicit messageIds.
+
+Run from src/projects/mibs with the same PYTHONPATH as the tests:
+    python bench/bench_delete.py --messages 10000 --recipients 3
+'''
+import argparse
+import statistics
+
+from sqlalchemy import event
+
+from api.mibs import MAX_DELETE_MESSAGE_IDS, delete_mibs_for_user
+from common import create_app, seed_messages, timer
+from models import Message, db
+
+USER_ID = 'bench-user'
+
+
+def count_then_delete(user_id: str) -> int:
+    '''
+    The previous delete_mibs_for_user: counts the messages then deletes them.
+    '''
+    query = Message.query.filter(Message.user_id == user_id)
+    count = query.count()
+    if count > 0:
+        query.delete()
+        db.session.commit()
+    return count
+
+
+def orm_delete(user_id: str) -> int:
+    '''
+    Loads the messages and deletes them one object at a time through the ORM.
+    '''
+    messages = Message.query.filter(Message.user_id == user_id).all()
+    for message in messages:
+        db.session.delete(message)
+    db.session.commit()
+    return len(messages)
+
+
+def delete_by_message_ids(user_id: str, message_ids) -> int:
+    '''
+    Deletes message_ids with delete_mibs_for_user, MAX_DELETE_MESSAGE_IDS at a
+    time like a client of DELETE /mibs?messageIds=... would.
+    '''
+    deleted = 0
+    for start in range(0, len(message_ids), MAX_DELETE_MESSAGE_IDS):
+        deleted += delete_mibs_for_user(user_id,
+            message_ids=message_ids[start:start + MAX_DELETE_MESSAGE_IDS])
+    return deleted
+
+
+def run(name: str, delete, args, other_messages: int):
+    '''
+    Reseeds the user's messages before every repeat, then prints the median
+    latency of delete.
+    '''
+    latencies = []
+    for _ in range(args.repeat):
+        seed_messages(args.messages, args.recipients, user_id=USER_ID,
+            first_message_id=other_messages + 1)
+        with timer() as elapsed:
+            deleted = delete()
+        latencies.append(elapsed['seconds'])
+        assert deleted == args.messages, f'{name} deleted {deleted} messages'
+
+    print(f'{name:<36} {statistics.median(latencies) * 1000:>9.1f} ms '
+        f'for {args.messages} messages')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--recipients', type=int, default=3, help='recipients per message')
+    parser.add_argument('--other-users-messages', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--db-uri', default=None,
+        help='database to benchmark against, defaults to a temporary SQLite file')
+    args = parser.parse_args()
+
+    app = create_app(args.db_uri)
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            # the recipients are deleted by ON DELETE CASCADE, which SQLite only enforces with
+            # foreign keys on
+            event.listen(db.engine, 'connect',
+                lambda connection, _: connection.execute('PRAGMA foreign_keys=ON'))
+            db.engine.dispose()
+
+        seed_messages(args.other_users_messages, args.recipients, user_id='other-user')
+        message_ids = list(range(args.other_users_messages + 1,
+            args.other_users_messages + args.messages + 1))
+
+        run('delete_mibs_for_user', lambda: delete_mibs_for_user(USER_ID),
+            args, args.other_users_messages)
+        run('delete_mibs_for_user by messageIds',
+            lambda: delete_by_message_ids(USER_ID, message_ids),
+            args, args.other_users_messages)
+        run('count then delete (previous)', lambda: count_then_delete(USER_ID),
+            args, args.other_users_messages)
+        run('ORM delete per message', lambda: orm_delete(USER_ID),
+            args, args.other_users_messages)
+
+
+if __name__ == '__main__':
+    main()
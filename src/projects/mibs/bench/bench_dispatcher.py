@@ -0,0 +1,89 @@
+'''
+Dispatcher throughput benchmark.
+
+Seeds due messages, drains them with several dispatcher processes against a
+local SMTP stand-in and reports messages sent per second. Also checks that no
+recipient was sent to more than once.
+
+Run from src/projects/mibs with the same PYTHONPATH as the tests:
+    python bench/bench_dispatcher.py --messages 20000 --workers 4
+'''
+import argparse
+import multiprocessing
+
+from common import create_app, seed_messages, timer
+from dispatcher import DeliveryBackend, Dispatcher, SmtpBackend
+from models import Message, db
+from smtp_sink import SmtpSink
+
+
+class NullBackend(DeliveryBackend):
+    '''
+    Delivers nothing but reports every recipient as delivered, to measure the
+    cost of the dispatcher itself.
+    '''
+    def deliver(self, messages, delivered=None):
+        return {recipient.recipient_id for message in messages for recipient in message.recipients}
+
+
+def worker(db_uri: str, backend_name: str, smtp_port: int, batch_size: int):
+    '''
+    Dispatches batches until there are no due messages left.
+    '''
+    app = create_app(db_uri)
+    if backend_name == 'null':
+        backend = NullBackend()
+    else:
+        backend = SmtpBackend('127.0.0.1', smtp_port, 'bench@bench.local')
+
+    with app.app_context():
+        dispatcher = Dispatcher(db.session, backend, batch_size=batch_size)
+        while dispatcher.dispatch_batch() > 0:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--recipients', type=int, default=1, help='recipients per message')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--backend', choices=['smtp', 'null'], default='smtp')
+    parser.add_argument('--db-uri', default=None,
+        help='database to benchmark against, defaults to a temporary SQLite file')
+    args = parser.parse_args()
+
+    app = create_app(args.db_uri)
+    db_uri = app.config['SQLALCHEMY_DATABASE_URI']
+    with app.app_context():
+        seed_messages(args.messages, args.recipients)
+        db.engine.dispose()
+
+    context = multiprocessing.get_context('spawn')
+    with SmtpSink() as sink:
+        workers = [
+            context.Process(target=worker,
+                args=(db_uri, args.backend, sink.port, args.batch_size))
+            for _ in range(args.workers)
+        ]
+        with timer() as elapsed:
+            for process in workers:
+                process.start()
+            for process in workers:
+                process.join()
+
+    with app.app_context():
+        sent = Message.query.filter(Message.sent).count()
+
+    print(f'backend={args.backend} workers={args.workers} batch_size={args.batch_size} '
+        f'db={db_uri.split(":")[0]}')
+    print(f'sent {sent}/{args.messages} messages in {elapsed["seconds"]:.2f}s: '
+        f'{sent / elapsed["seconds"]:.0f} messages/s')
+    if args.backend == 'smtp':
+        duplicates = sum(1 for count in sink.handler.recipients.values() if count > 1)
+        print(f'smtp server accepted {sink.handler.emails} emails, '
+            f'{duplicates} recipients were sent to more than once')
+
+
+if __name__ == '__main__':
+    main()
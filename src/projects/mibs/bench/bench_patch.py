@@ -0,0 +1,92 @@
+'''
+PATCH /mibs latency benchmark.
+
+Seeds a bottle with recipients, then times changing only its sendTime through
+the flask test client with PATCH /mibs and with a full PUT /mibs body, and
+reports the median latency, request body size and SQL statements per request.
+
+Run from src/projects/mibs with the same PYTHONPATH as the tests:
+    python bench/bench_patch.py --recipients 100 --repeat 200
+'''
+import argparse
+import statistics
+
+from flask import json
+from sqlalchemy import event
+
+from api.mibs import mibs_blueprint
+from common import create_app, create_client, seed_messages, timer
+from models import db
+
+
+def put_body(recipients: int, send_time: str):
+    '''
+    Creates the full PUT /mibs body of the seeded bottle with send_time.
+    '''
+    return {
+        'messageId': 1,
+        'message': 'bench message 1',
+        'recipients': [
+            {'email': f'recipient1-{index}@bench.local'} for index in range(recipients)
+        ],
+        'sendTime': send_time,
+    }
+
+
+def run(name: str, engine, send, repeat: int):
+    '''
+    Prints the median latency and statement count of repeat requests made by
+    calling send with the index of each request.
+    '''
+    statements = []
+    def count(*_):
+        statements.append(None)
+
+    latencies = []
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        for index in range(repeat):
+            with timer() as elapsed:
+                response, size = send(index)
+            latencies.append(elapsed['seconds'])
+            assert response.status_code == 200, response.data
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+    print(f'{name:<10} {statistics.median(latencies) * 1000:>8.2f} ms '
+        f'{size:>7} bytes {len(statements) / repeat:>5.1f} statements per request')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--recipients', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--db-uri', default=None,
+        help='database to benchmark against, defaults to a temporary SQLite file')
+    args = parser.parse_args()
+
+    app = create_app(args.db_uri)
+    app.register_blueprint(mibs_blueprint)
+    client = create_client(app)
+    with app.app_context():
+        seed_messages(1, args.recipients)
+        engine = db.engine
+
+    def send_time(index):
+        return f'2030-01-01T12:{index % 60:02d}:00.000Z'
+
+    def patch(index):
+        body = json.dumps({'sendTime': send_time(index)})
+        return client.patch('/mibs?messageId=1', data=body,
+            content_type='application/merge-patch+json'), len(body)
+
+    def put(index):
+        body = json.dumps(put_body(args.recipients, send_time(index)))
+        return client.put('/mibs', data=body, content_type='application/json'), len(body)
+
+    run('PATCH', engine, patch, args.repeat)
+    run('PUT', engine, put, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+'''
+PUT /mibs recipient update benchmark.
+
+Seeds a bottle with 1,000 recipients, then times PUT /mibs requests through the
+flask test client that each change one of its emails, once with the diff based
+MessageRepository.update and once with the previous full replacement of the
+recipients, and reports the median latency and SQL statements per request.
+
+Run from src/projects/mibs with the same PYTHONPATH as the tests:
+    python bench/bench_put.py --recipients 1000 --repeat 50
+'''
+import argparse
+import statistics
+from unittest.mock import patch
+
+from sqlalchemy import event
+
+from api.mibs import mibs_blueprint
+from common import create_app, create_client, seed_messages, timer
+from models import EmailMessageRecipient, db
+from models.repository import MessageRepository
+
+
+def replace_recipients(repository, message, mib):
+    '''
+    The previous PUT /mibs update: replaces every recipient of the message.
+    '''
+    # pylint: disable=unused-argument
+    message.message = mib.message
+    message.send_time = mib.send_time
+    message.email_recipients = [EmailMessageRecipient(email=email) for email in mib.emails]
+
+
+def create_body(recipients: int, changed: str):
+    '''
+    Creates the PUT /mibs body of the seeded bottle with its first email changed
+    to changed.
+    '''
+    return {
+        'messageId': 1,
+        'message': 'bench message',
+        'recipients': [{'email': changed}] + [
+            {'email': f'recipient1-{index}@bench.local'} for index in range(1, recipients)
+        ],
+        'sendTime': '2030-01-01T12:00:00.000Z',
+    }
+
+
+def run(name: str, app, client, args):
+    '''
+    Reseeds the bottle, then prints the median latency and statement count of
+    PUT /mibs requests that each change one email.
+    '''
+    with app.app_context():
+        db.session.execute(EmailMessageRecipient.__table__.delete())
+        db.session.execute(db.Model.metadata.tables['Message'].delete())
+        db.session.commit()
+        seed_messages(1, args.recipients)
+        engine = db.engine
+
+    statements = []
+    def count(*_):
+        statements.append(None)
+
+    bodies = [create_body(args.recipients, f'changed{index % 2}@bench.local')
+        for index in range(args.repeat)]
+    latencies = []
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        for body in bodies:
+            with timer() as elapsed:
+                response = client.put('/mibs', json=body)
+            latencies.append(elapsed['seconds'])
+            assert response.status_code == 200, response.data
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+    print(f'{name:<24} {statistics.median(latencies) * 1000:>8.2f} ms '
+        f'{len(statements) / args.repeat:>7.1f} statements per PUT')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--recipients', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--db-uri', default=None,
+        help='database to benchmark against, defaults to a temporary SQLite file')
+    args = parser.parse_args()
+
+    app = create_app(args.db_uri)
+    app.register_blueprint(mibs_blueprint)
+    client = create_client(app)
+
+    run('diff based update', app, client, args)
+    with patch.object(MessageRepository, 'update', replace_recipients):
+        run('full replacement', app, client, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+'''
+Per-user query latency load test.
+
+Grows the MIBS tables to more and more users, each with the same number of
+messages whose messageIds are interleaved with those of the other users, and
+times the user scoped queries of MessageRepository for random users at each
+size. With every query starting from the userId index the latencies stay flat
+as the tables grow.
+
+Run from src/projects/mibs with the same PYTHONPATH as the tests:
+    python bench/bench_scoping.py --users 100 1000 10000 --messages-per-user 50
+'''
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime
+
+from common import create_app
+from models import EmailMessageRecipient, Message, db
+from models.repository import MessageRepository
+
+
+def seed_users(first_user: int, last_user: int, messages_per_user: int, first_message_id: int,
+    chunk_size: int = 5000) -> int:
+    '''
+    Bulk inserts messages_per_user messages, each with one recipient, for the
+    users first_user to last_user - 1, interleaving the messageIds of the users.
+    Returns the next free messageId.
+    '''
+    users = last_user - first_user
+    count = users * messages_per_user
+    send_time = datetime(2030, 1, 1)
+    for start in range(0, count, chunk_size):
+        indexes = range(start, min(start + chunk_size, count))
+        db.session.execute(Message.__table__.insert(), [
+            {
+                'messageId': first_message_id + index,
+                'userId': f'user-{first_user + index % users}',
+                'message': f'bench message {index}',
+                'sendTime': send_time,
+                'sent': False,
+            }
+            for index in indexes
+        ])
+        db.session.execute(EmailMessageRecipient.__table__.insert(), [
+            {'MessageId': first_message_id + index, 'email': f'{index}@bench.local', 'sent': False}
+            for index in indexes
+        ])
+    db.session.commit()
+    return first_message_id + count
+
+
+def time_queries(users: int, samples: int, page_size: int) -> dict:
+    '''
+    Times the queries of MessageRepository for samples random users and
+    returns the median and 99th percentile latency of each query.
+    '''
+    timings = {'get': [], 'page': [], 'next page': [], 'count': []}
+    for _ in range(samples):
+        messages = MessageRepository(f'user-{random.randrange(users)}')
+        message_id = messages.after(None).with_entities(Message.message_id).first().message_id
+        db.session.expire_all()
+
+        for name, query in [
+            ('get', lambda: messages.get(message_id)),
+            ('page', lambda: messages.page(None, None, page_size)),
+            ('next page', lambda: messages.last_message_id_of_page(message_id, page_size)),
+            ('count', lambda: messages.query().count()),
+        ]:
+            start = time.perf_counter()
+            query()
+            timings[name].append(time.perf_counter() - start)
+            db.session.expire_all()
+
+    return {
+        name: (statistics.median(values), statistics.quantiles(values, n=100)[98])
+        for name, values in timings.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--users', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--messages-per-user', type=int, default=50)
+    parser.add_argument('--samples', type=int, default=200)
+    parser.add_argument('--page-size', type=int, default=20)
+    parser.add_argument('--db-uri', default=None,
+        help='database to benchmark against, defaults to a temporary SQLite file')
+    args = parser.parse_args()
+
+    app = create_app(args.db_uri)
+    with app.app_context():
+        Message.query.delete()
+        db.session.commit()
+
+        users = 0
+        next_message_id = 1
+        print(f'{"users":>7} {"messages":>9}  ' + '  '.join(
+            f'{name + " p50/p99 ms":>21}' for name in ['get', 'page', 'next page', 'count']))
+        for total_users in sorted(args.users):
+            next_message_id = seed_users(users, total_users, args.messages_per_user,
+                next_message_id)
+            users = total_users
+            timings = time_queries(users, args.samples, args.page_size)
+            print(f'{users:>7} {next_message_id - 1:>9}  ' + '  '.join(
+                f'{p50 * 1e3:>10.3f} /{p99 * 1e3:>8.3f}' for p50, p99 in timings.values()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+'''
+SMTP delivery backend benchmark.
+
+Delivers the same batch of messages with one SMTP connection per email
+(SmtpBackend), with a pool of persistent connections (PooledSmtpBackend) and
+with many concurrent asyncio transactions (AsyncSmtpBackend) against a local
+SMTP stand-in, and reports messages per second for each.
+
+Run from src/projects/mibs with the same PYTHONPATH as the tests:
+    python bench/bench_smtp.py --messages 2000 --recipients 3 --latency 0.02
+'''
+import argparse
+from datetime import datetime
+
+from common import timer
+from dispatcher import AsyncSmtpBackend, OutgoingMessage, OutgoingRecipient, PooledSmtpBackend, \
+    SmtpBackend
+from smtp_sink import SmtpSink
+
+SENDER = 'bench@bench.local'
+
+
+def create_messages(count: int, recipients_per_message: int):
+    '''
+    Creates count outgoing messages with recipients_per_message recipients each.
+    '''
+    return [
+        OutgoingMessage(
+            message_id=message_id,
+            user_id='bench-user',
+            message=f'bench message {message_id}',
+            send_time=datetime.utcnow(),
+            recipients=[
+                OutgoingRecipient(
+                    recipient_id=message_id * recipients_per_message + index,
+                    email=f'recipient{message_id}-{index}@bench.local')
+                for index in range(recipients_per_message)
+            ])
+        for message_id in range(count)
+    ]
+
+
+def run(name: str, backend, messages, sink: SmtpSink):
+    '''
+    Delivers messages with backend and prints its throughput.
+    '''
+    emails_before = sink.handler.emails
+    with timer() as elapsed:
+        delivered = backend.deliver(messages)
+    recipients = sum(len(message.recipients) for message in messages)
+
+    print(f'{name:<32} {len(messages) / elapsed["seconds"]:>8.0f} messages/s '
+        f'{len(delivered)}/{recipients} recipients delivered, '
+        f'{sink.handler.emails - emails_before} SMTP transactions')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--recipients', type=int, default=3, help='recipients per message')
+    parser.add_argument('--pool-size', type=int, default=4)
+    parser.add_argument('--max-messages-per-connection', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=100,
+        help='transactions in flight for the asyncio backend')
+    parser.add_argument('--latency', type=float, default=0,
+        help='seconds the SMTP stand-in waits before accepting an email')
+    args = parser.parse_args()
+
+    messages = create_messages(args.messages, args.recipients)
+    with SmtpSink(latency=args.latency) as sink:
+        run('one connection per email', SmtpBackend(sink.host, sink.port, SENDER),
+            messages, sink)
+
+        backend = PooledSmtpBackend(sink.host, sink.port, SENDER, pool_size=1,
+            max_messages_per_connection=args.max_messages_per_connection)
+        run('pooled, 1 connection', backend, messages, sink)
+        backend.close()
+
+        backend = PooledSmtpBackend(sink.host, sink.port, SENDER, pool_size=args.pool_size,
+            max_messages_per_connection=args.max_messages_per_connection)
+        run(f'pooled, {args.pool_size} connections', backend, messages, sink)
+        backend.close()
+
+        backend = AsyncSmtpBackend(sink.host, sink.port, SENDER, concurrency=args.concurrency,
+            max_messages_per_connection=args.max_messages_per_connection)
+        run(f'asyncio, {args.concurrency} in flight', backend, messages, sink)
+        backend.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+'''
+POST /mibs request validation micro-benchmark.
+
+Times the validation of one POST /mibs request body with the previous two pass
+validation (dateutil, then the swagger models) and with parse_mib, and reports
+microseconds per request body for each.
+
+Run from src/projects/mibs with the same PYTHONPATH as the tests:
+    python bench/bench_validation.py --recipients 3
+'''
+import argparse
+import timeit
+
+from dateutil.parser import parse as datetimeParse
+
+from api.validation import parse_mib
+from lib.mibs.python.openapi.swagger_server.models import EmailRecipient, MessageInABottle
+
+
+def parse_recipients(recipients):
+    '''
+    The previous api.mibs._parse_recipients.
+    '''
+    email_recipients = []
+    unknown_recipients = []
+    for recipient in recipients:
+        if 'email' in recipient:
+            email_recipients.append(EmailRecipient.from_dict(recipient))
+        else:
+            unknown_recipients.append(recipient)
+    return email_recipients, unknown_recipients
+
+
+def previous_validation(body):
+    '''
+    The previous POST /mibs validation: validate() checked the body, parsing the
+    recipients and sendTime, then the handler parsed it again into a swagger
+    MessageInABottle and parsed its recipients a second time.
+    '''
+    for key in ['message', 'recipients']:
+        if not key in body:
+            return None
+    email_recipients, unknown_recipients = parse_recipients(body['recipients'])
+    if len(unknown_recipients) > 0 or len(email_recipients) <= 0 or not 'sendTime' in body:
+        return None
+    try:
+        datetimeParse(body['sendTime'])
+    except ValueError:
+        return None
+
+    mib = MessageInABottle.from_dict(body)
+    email_recipients, _ = parse_recipients(mib.recipients)
+    return mib, email_recipients
+
+
+def run(name: str, validate, body, number: int):
+    '''
+    Prints the best time of validating body, in microseconds.
+    '''
+    seconds = min(timeit.repeat(lambda: validate(body), number=number, repeat=5)) / number
+    print(f'{name:<28} {seconds * 1e6:>8.1f} us per request body')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--recipients', type=int, default=3, help='recipients per message')
+    parser.add_argument('--number', type=int, default=5000, help='validations per repeat')
+    args = parser.parse_args()
+
+    body = {
+        'message': 'bench message',
+        'recipients': [
+            {'email': f'recipient{index}@bench.local'} for index in range(args.recipients)
+        ],
+        'sendTime': '2030-01-01T12:00:00.000Z',
+    }
+
+    run('previous, two passes', previous_validation, body, args.number)
+    run('parse_mib, one pass', parse_mib, body, args.number)
+
+
+if __name__ == '__main__':
+    main()
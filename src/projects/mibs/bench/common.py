@@ -0,0 +1,117 @@
+'''
+Helpers shared by the MIBS benchmarks.
+'''
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Iterator
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from flask import Flask
+from flask.testing import FlaskClient
+from jwt.algorithms import RSAAlgorithm
+from auth import Authenticator
+from models import EmailMessageRecipient, Message, db
+
+
+def create_app(db_uri: str = None, engine_options: dict = None) -> Flask:
+    '''
+    Creates a flask app bound to db_uri, or to a new temporary SQLite database
+    file if db_uri is None, with the MIBS tables created. engine_options are
+    the SQLALCHEMY_ENGINE_OPTIONS of the app.
+    '''
+    if db_uri is None:
+        db_uri = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='mibs-bench-'), 'mibs.db')
+
+    app = Flask(__name__)
+    app.config.update({
+        'SQLALCHEMY_DATABASE_URI': db_uri,
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'SQLALCHEMY_ENGINE_OPTIONS': dict(engine_options or {}),
+    })
+    if db_uri.startswith('sqlite'):
+        # several benchmark processes may write to the same SQLite file
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'].setdefault('connect_args', {})['timeout'] = 60
+
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def create_client(app: Flask, user_id: str = 'bench-user') -> FlaskClient:
+    '''
+    Creates a test client of app whose requests carry an access token for
+    user_id, with an Authenticator for app that accepts it. Must be called
+    before the first request to app.
+    '''
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(RSAAlgorithm.to_jwk(key.public_key()))
+    app.config.update({
+        'AUTH_ISSUER': 'bench_issuer',
+        'AUTH_AUDIENCE': 'bench',
+        'AUTH_JWKS': {'keys': [dict(jwk, kid='bench-key', use='sig')]},
+    })
+    Authenticator(app)
+
+    client = app.test_client()
+    client.environ_base['HTTP_AUTHORIZATION'] = 'Bearer ' + jwt.encode({
+        'iss': 'bench_issuer',
+        'aud': 'bench',
+        'sub': user_id,
+        'exp': int(time.time()) + 24 * 60 * 60,
+    }, key, algorithm='RS256', headers={'kid': 'bench-key'})
+    return client
+
+
+def seed_messages(count: int, recipients_per_message: int = 1, user_id: str = 'bench-user',
+    send_time: datetime = None, first_message_id: int = 1, chunk_size: int = 5000,
+    sent: bool = False):
+    '''
+    Bulk inserts count messages for user_id, each with recipients_per_message
+    unique email recipients, that were sent at send_time if sent. Must be
+    called inside an app context.
+    '''
+    send_time = datetime.utcnow() - timedelta(minutes=1) if send_time is None else send_time
+    for start in range(first_message_id, first_message_id + count, chunk_size):
+        message_ids = range(start, min(start + chunk_size, first_message_id + count))
+        db.session.execute(Message.__table__.insert(), [
+            {
+                'messageId': message_id,
+                'userId': user_id,
+                'message': f'bench message {message_id}',
+                'sendTime': send_time,
+                'sent': sent,
+                'lastSentTime': send_time if sent else None,
+            }
+            for message_id in message_ids
+        ])
+        db.session.execute(EmailMessageRecipient.__table__.insert(), [
+            {
+                'MessageId': message_id,
+                'email': f'recipient{message_id}-{index}@bench.local',
+                'sent': sent,
+                'sendAttemptTime': send_time if sent else None,
+            }
+            for message_id in message_ids
+            for index in range(recipients_per_message)
+        ])
+    db.session.commit()
+
+
+@contextmanager
+def timer() -> Iterator[dict]:
+    '''
+    Times the body of a with statement. The elapsed seconds are stored in the
+    yielded dict under "seconds".
+    '''
+    result = {}
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result['seconds'] = time.perf_counter() - start
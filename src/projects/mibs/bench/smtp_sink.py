@@ -0,0 +1,67 @@
+'''
+A local SMTP server that accepts and counts emails, used as a stand-in for a
+real mail server by the benchmarks. Requires aiosmtpd (pip install aiosmtpd).
+'''
+import asyncio
+import socket
+import threading
+from collections import Counter
+
+from aiosmtpd.controller import Controller
+
+
+class CountingHandler:
+    '''
+    aiosmtpd handler that counts every accepted email and recipient.
+
+    Attributes:
+        emails: The number of emails accepted
+        recipients: The number of times each recipient address was sent to
+        latency: Seconds to wait before accepting an email, to simulate a
+            remote mail server
+    '''
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.emails = 0
+        self.recipients = Counter()
+
+    async def handle_DATA(self, server, session, envelope): # pylint: disable=invalid-name
+        '''
+        Accepts an email.
+        '''
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        with self.lock:
+            self.emails += 1
+            self.recipients.update(envelope.rcpt_tos)
+        return '250 OK'
+
+
+class SmtpSink:
+    '''
+    Runs a CountingHandler SMTP server on a free localhost port in a background
+    thread.
+
+        with SmtpSink() as sink:
+            send_emails('localhost', sink.port)
+            print(sink.handler.emails)
+    '''
+    def __init__(self, host: str = '127.0.0.1', latency: float = 0):
+        self.host = host
+        self.port = _free_port(host)
+        self.handler = CountingHandler(latency)
+        self.controller = Controller(self.handler, hostname=host, port=self.port)
+
+    def __enter__(self):
+        self.controller.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.controller.stop()
+
+
+def _free_port(host: str) -> int:
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
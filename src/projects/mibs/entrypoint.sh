@@ -7,6 +7,8 @@ if [ "$1" == "test" ]; then
     python3 -m unittest discover
     python3 -m unittest discover -s lib/auth
 else
+    # the app does not create tables, the schema is managed by the migrations
+    (cd /app && PYTHONPATH=$PYTHONPATH:/app/src alembic upgrade head) || exit 1
     uwsgi --ini /app/uwsgi.ini &
     source /docker-entrypoint.sh
 fi
\ No newline at end of file
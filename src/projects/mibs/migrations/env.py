@@ -0,0 +1,94 @@
+"""
+Alembic environment for the MIBS database.
+
+The database URL is, in order of precedence:
+    - the db_uri -x argument, e.g. alembic -x db_uri=sqlite:///mibs.db upgrade head
+    - the SQLALCHEMY_DATABASE_URI environment variable
+    - built from DB_USER, DB_PASSWORD and DB_DATABASE like src/app.py
+"""
+from logging.config import fileConfig
+from os import environ as env
+
+from sqlalchemy import engine_from_config
+from sqlalchemy import pool
+from models import db
+from alembic import context
+
+# this is the Alembic Config object, which provides
+# access to the values within the .ini file in use.
+config = context.config
+
+# Interpret the config file for Python logging.
+# This line sets up loggers basically.
+# There is no file when the migrations are run from code, e.g. by the tests.
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = db.metadata
+
+
+def get_url():
+    """Returns the URL of the database to migrate."""
+    url = context.get_x_argument(as_dictionary=True).get('db_uri')
+    if url is None:
+        url = env.get('SQLALCHEMY_DATABASE_URI')
+    if url is None:
+        url = (f"postgresql+psycopg2://{env.get('DB_USER')}:{env.get('DB_PASSWORD')}"
+            f"@{env.get('DB_HOST', 'postgres')}/{env.get('DB_DATABASE')}")
+    return url
+
+
+def run_migrations_offline():
+    """Run migrations in 'offline' mode.
+
+    This configures the context with just a URL
+    and not an Engine, though an Engine is acceptable
+    here as well.  By skipping the Engine creation
+    we don't even need a DBAPI to be available.
+
+    Calls to context.execute() here emit the given string to the
+    script output.
+
+    """
+    context.configure(
+        url=get_url(),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+        transaction_per_migration=True,
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    """Run migrations in 'online' mode.
+
+    In this scenario we need to create an Engine
+    and associate a connection with the context.
+
+    """
+    configuration = config.get_section(config.config_ini_section, {})
+    configuration['sqlalchemy.url'] = get_url()
+    connectable = engine_from_config(
+        configuration,
+        prefix="sqlalchemy.",
+        poolclass=pool.NullPool,
+    )
+
+    with connectable.connect() as connection:
+        # a migration's locks are released when it commits, not when the last one does
+        context.configure(
+            connection=connection, target_metadata=target_metadata,
+            transaction_per_migration=True,
+        )
+
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
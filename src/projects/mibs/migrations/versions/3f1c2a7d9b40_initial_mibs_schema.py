@@ -0,0 +1,52 @@
+"""initial MIBS schema
+
+Revision ID: 3f1c2a7d9b40
+Revises: 
+Create Date: 2021-11-20 10:12:41.308114
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a7d9b40'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # databases created by db.create_all() before migrations existed already
+    # have these tables, they are adopted as they are
+    existing_tables = [] if context.is_offline_mode() \
+        else sa.inspect(op.get_bind()).get_table_names()
+
+    if 'Message' not in existing_tables:
+        op.create_table('Message',
+        sa.Column('messageId', sa.Integer(), nullable=False),
+        sa.Column('userId', sa.Unicode(), nullable=False),
+        sa.Column('message', sa.UnicodeText(), nullable=False),
+        sa.Column('sendTime', sa.DateTime(), nullable=False),
+        sa.Column('sent', sa.Boolean(), nullable=False),
+        sa.Column('lastSentTime', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('messageId'),
+        # SQLite must not reuse the ids of deleted or archived messages
+        sqlite_autoincrement=True
+        )
+
+    if 'EmailMessageRecipient' not in existing_tables:
+        op.create_table('EmailMessageRecipient',
+        sa.Column('messageSendRequestId', sa.Integer(), nullable=False),
+        sa.Column('MessageId', sa.Integer(), nullable=False),
+        sa.Column('email', sa.Unicode(), nullable=False),
+        sa.Column('sent', sa.Boolean(), nullable=False),
+        sa.Column('sendAttemptTime', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['MessageId'], ['Message.messageId'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('messageSendRequestId')
+        )
+
+
+def downgrade():
+    op.drop_table('EmailMessageRecipient')
+    op.drop_table('Message')
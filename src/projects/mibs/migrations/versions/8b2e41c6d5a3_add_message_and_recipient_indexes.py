@@ -0,0 +1,49 @@
+"""add Message and EmailMessageRecipient indexes
+
+Revision ID: 8b2e41c6d5a3
+Revises: 3f1c2a7d9b40
+Create Date: 2021-11-20 10:31:05.771925
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+from models.online import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2e41c6d5a3'
+down_revision = '3f1c2a7d9b40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # db.create_all() creates these indexes with new tables, skip the ones that exist
+    message_indexes = set()
+    recipient_indexes = set()
+    if not context.is_offline_mode():
+        inspector = sa.inspect(op.get_bind())
+        message_indexes = {index['name'] for index in inspector.get_indexes('Message')}
+        recipient_indexes = {
+            index['name'] for index in inspector.get_indexes('EmailMessageRecipient')
+        }
+
+    # built without blocking the writes to the tables, which may be large
+    if 'ix_Message_userId_messageId' not in message_indexes:
+        create_index_concurrently('ix_Message_userId_messageId', 'Message',
+            ['userId', 'messageId'])
+
+    if 'ix_Message_sendTime_unsent' not in message_indexes:
+        create_index_concurrently('ix_Message_sendTime_unsent', 'Message', ['sendTime'],
+            postgresql_where=sa.text('NOT sent'),
+            sqlite_where=sa.text('NOT sent'))
+
+    if 'ix_EmailMessageRecipient_MessageId' not in recipient_indexes:
+        create_index_concurrently('ix_EmailMessageRecipient_MessageId', 'EmailMessageRecipient',
+            ['MessageId'])
+
+
+def downgrade():
+    drop_index_concurrently('ix_EmailMessageRecipient_MessageId', 'EmailMessageRecipient')
+    drop_index_concurrently('ix_Message_sendTime_unsent', 'Message')
+    drop_index_concurrently('ix_Message_userId_messageId', 'Message')
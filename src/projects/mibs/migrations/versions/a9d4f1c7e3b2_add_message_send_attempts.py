@@ -0,0 +1,37 @@
+"""add Message.sendAttempts
+
+Revision ID: a9d4f1c7e3b2
+Revises: f7c3e2a9b1d8
+Create Date: 2021-12-06 14:27:09.348112
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+from models.online import lock_timeout
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9d4f1c7e3b2'
+down_revision = 'f7c3e2a9b1d8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # db.create_all() creates the column in databases it has not been created in yet
+    if not context.is_offline_mode() and 'sendAttempts' in [
+        column['name'] for column in sa.inspect(op.get_bind()).get_columns('Message')
+    ]:
+        return
+
+    # a constant server default does not rewrite the table, existing messages start at 0
+    with lock_timeout():
+        op.add_column('Message', sa.Column('sendAttempts', sa.Integer(), nullable=False,
+            server_default='0'))
+
+
+def downgrade():
+    # SQLite can only drop the column by recreating the table, with AUTOINCREMENT again
+    with lock_timeout(), op.batch_alter_table('Message',
+        table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        batch_op.drop_column('sendAttempts')
@@ -0,0 +1,38 @@
+"""add IdempotencyKey
+
+Revision ID: c4d9e7a1f2b6
+Revises: 8b2e41c6d5a3
+Create Date: 2021-11-27 14:05:12.402318
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d9e7a1f2b6'
+down_revision = '8b2e41c6d5a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # db.create_all() creates the table in databases it has not been created in yet
+    if not context.is_offline_mode() \
+        and 'IdempotencyKey' in sa.inspect(op.get_bind()).get_table_names():
+        return
+
+    op.create_table('IdempotencyKey',
+    sa.Column('userId', sa.Unicode(), nullable=False),
+    sa.Column('key', sa.Unicode(length=255), nullable=False),
+    sa.Column('requestHash', sa.Unicode(length=64), nullable=False),
+    sa.Column('messageId', sa.Integer(), nullable=False),
+    sa.Column('createdAt', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('userId', 'key')
+    )
+    op.create_index('ix_IdempotencyKey_createdAt', 'IdempotencyKey', ['createdAt'])
+
+
+def downgrade():
+    op.drop_index('ix_IdempotencyKey_createdAt', table_name='IdempotencyKey')
+    op.drop_table('IdempotencyKey')
@@ -0,0 +1,42 @@
+"""add Message.failed and ArchivedMessage.failed
+
+Revision ID: d2b8f5e1c7a4
+Revises: a9d4f1c7e3b2
+Create Date: 2021-12-07 10:18:42.907615
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+from models.online import lock_timeout
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2b8f5e1c7a4'
+down_revision = 'a9d4f1c7e3b2'
+branch_labels = None
+depends_on = None
+
+tables = ['Message', 'ArchivedMessage']
+
+
+def upgrade():
+    for table in tables:
+        # db.create_all() creates the column in databases it has not been created in yet
+        if not context.is_offline_mode() and 'failed' in [
+            column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)
+        ]:
+            continue
+
+        # a constant server default does not rewrite the table, no message has failed yet
+        with lock_timeout():
+            op.add_column(table, sa.Column('failed', sa.Boolean(), nullable=False,
+                server_default=sa.false()))
+
+
+def downgrade():
+    # SQLite can only drop the column by recreating the table, Message with AUTOINCREMENT
+    # again
+    for table in reversed(tables):
+        with lock_timeout(), op.batch_alter_table(table,
+            table_kwargs={'sqlite_autoincrement': table == 'Message'}) as batch_op:
+            batch_op.drop_column('failed')
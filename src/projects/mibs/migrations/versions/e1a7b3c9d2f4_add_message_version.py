@@ -0,0 +1,38 @@
+"""add Message.version
+
+Revision ID: e1a7b3c9d2f4
+Revises: c4d9e7a1f2b6
+Create Date: 2021-11-28 10:41:36.118204
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+from models.online import lock_timeout
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1a7b3c9d2f4'
+down_revision = 'c4d9e7a1f2b6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # db.create_all() creates the column in databases it has not been created in yet
+    if not context.is_offline_mode() and 'version' in [
+        column['name'] for column in sa.inspect(op.get_bind()).get_columns('Message')
+    ]:
+        return
+
+    # existing messages start at version 1 through the server default, without rewriting them,
+    # so the ACCESS EXCLUSIVE lock is short, but it must not queue behind a long transaction
+    with lock_timeout():
+        op.add_column('Message', sa.Column('version', sa.Integer(), nullable=False,
+            server_default='1'))
+
+
+def downgrade():
+    # SQLite can only drop the column by recreating the table, with AUTOINCREMENT again
+    with lock_timeout(), op.batch_alter_table('Message',
+        table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,73 @@
+"""add ArchivedMessage and ArchivedEmailMessageRecipient
+
+Revision ID: f7c3e2a9b1d8
+Revises: e1a7b3c9d2f4
+Create Date: 2021-12-04 09:12:47.530817
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+from models.online import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7c3e2a9b1d8'
+down_revision = 'e1a7b3c9d2f4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # db.create_all() creates the tables and indexes in databases they have not been created in yet
+    tables = set()
+    message_indexes = set()
+    if not context.is_offline_mode():
+        inspector = sa.inspect(op.get_bind())
+        tables = set(inspector.get_table_names())
+        message_indexes = {index['name'] for index in inspector.get_indexes('Message')}
+
+    # new and empty, creating them and their indexes locks nothing else
+    if 'ArchivedMessage' not in tables:
+        op.create_table('ArchivedMessage',
+            sa.Column('messageId', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('userId', sa.Unicode(), nullable=False),
+            sa.Column('message', sa.UnicodeText(), nullable=False),
+            sa.Column('sendTime', sa.DateTime(), nullable=False),
+            sa.Column('sent', sa.Boolean(), nullable=False),
+            sa.Column('lastSentTime', sa.DateTime(), nullable=True),
+            sa.Column('version', sa.Integer(), nullable=False),
+            sa.Column('archivedAt', sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint('messageId')
+        )
+        op.create_index('ix_ArchivedMessage_userId_messageId', 'ArchivedMessage',
+            ['userId', 'messageId'])
+
+    if 'ArchivedEmailMessageRecipient' not in tables:
+        op.create_table('ArchivedEmailMessageRecipient',
+            sa.Column('messageSendRequestId', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('MessageId', sa.Integer(), nullable=False),
+            sa.Column('email', sa.Unicode(), nullable=False),
+            sa.Column('sent', sa.Boolean(), nullable=False),
+            sa.Column('sendAttemptTime', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['MessageId'], ['ArchivedMessage.messageId'],
+                ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('messageSendRequestId')
+        )
+        op.create_index('ix_ArchivedEmailMessageRecipient_MessageId',
+            'ArchivedEmailMessageRecipient', ['MessageId'])
+
+    # built without blocking the writes to Message, which holds every sent message so far
+    if 'ix_Message_lastSentTime_sent' not in message_indexes:
+        create_index_concurrently('ix_Message_lastSentTime_sent', 'Message', ['lastSentTime'],
+            postgresql_where=sa.text('sent'),
+            sqlite_where=sa.text('sent = 1'))
+
+
+def downgrade():
+    # archived messages are lost, restore them to Message before downgrading if they are needed
+    drop_index_concurrently('ix_Message_lastSentTime_sent', 'Message')
+    op.drop_index('ix_ArchivedEmailMessageRecipient_MessageId',
+        table_name='ArchivedEmailMessageRecipient')
+    op.drop_table('ArchivedEmailMessageRecipient')
+    op.drop_index('ix_ArchivedMessage_userId_messageId', table_name='ArchivedMessage')
+    op.drop_table('ArchivedMessage')
@@ -1,32 +1,227 @@
 '''
-/mibs GET POST PUT DELETE endpoints
+/mibs GET POST PUT PATCH DELETE endpoints
 '''
 
-from typing import Any, Dict, List, Tuple, Union
-from flask import Blueprint, json, request
+import hashlib
+import math
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Tuple, Union
+from flask import Blueprint, Response, current_app, json, request, stream_with_context
 from flask.helpers import url_for
-from dateutil.parser import parse as datetimeParse
 from http import HTTPStatus
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 
-from lib.mibs.python.openapi.swagger_server.models import MessageInABottle, EmailRecipient
-from lib.mibs.python.openapi.swagger_server.models.any_of_message_in_a_bottle_recipients_items \
-    import AnyOfMessageInABottleRecipientsItems
-from lib.mibs.python.openapi.swagger_server.models.sms_recipient import SmsRecipient
-from lib.mibs.python.openapi.swagger_server.models.user_recipient import UserRecipient
-from models import Message, EmailMessageRecipient, db
+from auth import get_claims
+from auth.exceptions import InvalidTokenError
+from api.validation import ParsedMib, ValidationError, parse_mib, parse_mib_patch
+from models import ArchivedMessage, IdempotencyKey, Message, db
+from models.repository import MessageRepository
+from models.routing import replica_engines, use_read_replica
 
 mibs_blueprint = Blueprint('mibs', __name__, url_prefix='/mibs')
 
-TEMP_USER_ID = 'temp-user-id'
+# The largest page that can be requested with the "limit" query parameter
+MAX_PAGE_LIMIT = 1000
+# The number of messages loaded from the database at a time while streaming GET /mibs
+STREAM_PAGE_SIZE = 500
+# The most messages that can be deleted at once with the "messageIds" query parameter
+MAX_DELETE_MESSAGE_IDS = 1000
+# The most messages that can be created with one POST /mibs/batch request
+MAX_BATCH_SIZE = 1000
+# The longest Idempotency-Key header of POST /mibs
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+# How long a retry of POST /mibs with the same Idempotency-Key returns the original message
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+# How long GET /mibs reads from the primary database instead of a read replica after a
+# write of the same user, unless the app config has a REPLICA_STICKY_SECONDS
+DEFAULT_REPLICA_STICKY_SECONDS = 5
+# The cookie holding the time until which GET /mibs reads from the primary database
+READ_PRIMARY_COOKIE = 'mibs_read_primary_until'
+
+
+@mibs_blueprint.before_request
+def authenticate():
+    '''
+    Requires an access token for every /mibs request, verified by the
+    Authenticator of the app. The messages of a request are those of the user
+    the token was issued to.
+    '''
+    if current_app.extensions['auth'].authenticate().user_id is None:
+        raise InvalidTokenError('Token has no subject')
+
+
+@mibs_blueprint.after_request
+def remember_write(response: Response) -> Response:
+    '''
+    Sets the READ_PRIMARY_COOKIE after every successful write of a user when
+    the app has read replicas, so that the GET requests of the user in the
+    next REPLICA_STICKY_SECONDS read their own writes from the primary
+    database instead of a replica that may not have them yet.
+    '''
+    if request.method != 'GET' and response.status_code < HTTPStatus.BAD_REQUEST \
+        and len(replica_engines(current_app)) > 0:
+        sticky_seconds = _replica_sticky_seconds()
+        response.set_cookie(READ_PRIMARY_COOKIE, f'{time.time() + sticky_seconds:.3f}',
+            max_age=math.ceil(sticky_seconds), path=mibs_blueprint.url_prefix,
+            httponly=True, samesite='Lax')
+    return response
+
+
+def _replica_sticky_seconds() -> float:
+    '''
+    Returns how long the GET requests of a user read from the primary database after a write.
+    '''
+    return current_app.config.get('REPLICA_STICKY_SECONDS', DEFAULT_REPLICA_STICKY_SECONDS)
+
+
+def _wrote_recently() -> bool:
+    '''
+    Returns whether the READ_PRIMARY_COOKIE of the global request says the
+    user wrote in the last REPLICA_STICKY_SECONDS.
+    '''
+    try:
+        until = float(request.cookies.get(READ_PRIMARY_COOKIE, ''))
+    except ValueError:
+        return False
+    now = time.time()
+    # a cookie further in the future than a write could set is ignored
+    return now < until <= now + _replica_sticky_seconds()
+
+
+def _user_messages(archived: bool = False) -> MessageRepository:
+    '''
+    Returns the messages of the user of the current request's access token,
+    the archived ones if archived.
+    '''
+    return MessageRepository(get_claims().user_id, archived=archived)
+
 
 @mibs_blueprint.route('', methods=['GET'])
 def get():
     '''
-    TODO implement GET endpoint here
+    /mibs GET endpoint. See openapi file.
+
+    Messages are returned in messageId order as a JSON array that is streamed
+    one page of messages at a time. If "limit" is present at most limit messages
+    with a messageId greater than "after" are returned, and if there are more
+    messages a Link header with rel="next" holds the URL of the next page.
+
+    With "archived=true" the sent messages that were moved to the archive are
+    returned instead, see models.archive.
+
+    Messages are read from a read replica of the database if the app has
+    any, unless the user wrote in the last REPLICA_STICKY_SECONDS.
+    '''
+    assert request is not None
+    if not _wrote_recently():
+        # the whole request reads one replica, including the streamed pages
+        use_read_replica(db.session)
+
+    try:
+        message_id = _parse_int_arg('messageId')
+        after = _parse_int_arg('after')
+        limit = _parse_int_arg('limit')
+        archived = _parse_bool_arg('archived')
+    except ValueError as error:
+        return str(error), HTTPStatus.BAD_REQUEST
+    messages = _user_messages(archived)
+
+    if message_id is not None:
+        message = messages.get(message_id)
+        if message is None:
+            return f'a message with messageId={message_id} could not be found', \
+                HTTPStatus.NOT_FOUND
+        return Response(json.dumps([_message_to_dict(message)]), mimetype='application/json')
+
+    if limit is not None and not 1 <= limit <= MAX_PAGE_LIMIT:
+        return f'"limit" must be between 1 and {MAX_PAGE_LIMIT}', HTTPStatus.BAD_REQUEST
+
+    until = None
+    headers = {}
+    if limit is not None:
+        until = messages.last_message_id_of_page(after, limit)
+        if until is not None:
+            next_page = url_for('.get', after=until, limit=limit,
+                archived='true' if archived else None)
+            headers['Link'] = f'<{next_page}>; rel="next"'
+
+    return Response(stream_with_context(_stream_messages(messages, after, until, limit)),
+        mimetype='application/json', headers=headers)
+
+
+def _parse_int_arg(name: str) -> Union[int, None]:
+    '''
+    Parses the integer query parameter name of the global request.
+
+    Postconditions:
+        returns None if the parameter is absent
+        raises ValueError with a message for the client if it is not an integer
+    '''
+    value = request.args.get(name, None)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError as error:
+        raise ValueError(f'"{name}" is not an integer') from error
+
+
+def _parse_bool_arg(name: str) -> bool:
+    '''
+    Parses the boolean query parameter name of the global request, "true" or
+    "false".
+
+    Postconditions:
+        returns False if the parameter is absent
+        raises ValueError with a message for the client if it is not a boolean
+    '''
+    value = request.args.get(name, 'false')
+    if value not in ('true', 'false'):
+        raise ValueError(f'"{name}" must be true or false')
+    return value == 'true'
+
+
+def _stream_messages(messages: MessageRepository, after: Union[int, None],
+    until: Union[int, None], limit: Union[int, None]) -> Iterator[str]:
+    '''
+    Generates a JSON array of the messages of a user with a messageId greater
+    than after and at most until, limited to limit messages. Messages are loaded
+    STREAM_PAGE_SIZE at a time, with the recipients of a page loaded in one query.
+    '''
+    yield '['
+    separator = ''
+    remaining = limit
+    while remaining is None or remaining > 0:
+        page_size = STREAM_PAGE_SIZE if remaining is None else min(remaining, STREAM_PAGE_SIZE)
+        page = messages.page(after, until, page_size)
+
+        if len(page) > 0:
+            yield separator + ','.join(json.dumps(_message_to_dict(message)) for message in page)
+            separator = ','
+        if len(page) < page_size:
+            break
+
+        after = page[-1].message_id
+        if remaining is not None:
+            remaining -= len(page)
+    yield ']'
+
+
+def _message_to_dict(message: Union[Message, ArchivedMessage]) -> Dict[str, Any]:
+    '''
+    Converts a message to a MessageInABottle JSON object, see openapi file.
     '''
     return {
-      'success': json.dumps(True),
-      'message': 'Hello from GET /mibs',
+        'messageId': message.message_id,
+        'message': message.message,
+        'recipients': [
+            {'email': email_recipient.email}
+            for email_recipient in message.email_recipients
+        ],
+        'sendTime': message.send_time.isoformat(timespec='milliseconds') + 'Z',
+        'version': message.version,
     }
 
 
@@ -51,123 +246,143 @@ def _handle_post_put(is_put=False):
         see openapi file for /mibs PUT and POST endpoints
     '''
 
-    def validate() -> Tuple[bool, Tuple[str, HTTPStatus], Message]:
+    def validate() -> Tuple[bool, Tuple[str, HTTPStatus], ParsedMib, Message]:
         if not request.is_json:
-            return False, ('Request is not JSON', HTTPStatus.BAD_REQUEST), None
-
-        body = request.get_json()
-
-        if is_put and not 'messageId' in body:
-            return False, ('"messageId" missing from request body', HTTPStatus.BAD_REQUEST), None
-
-        if not 'message' in body:
-            return False, ('"message" missing from request body', HTTPStatus.BAD_REQUEST), None
-
-        if not 'recipients' in body:
-            return False, ('"recipients" missing from request body', HTTPStatus.BAD_REQUEST), None
-
-        email_recipients, sms_recipients, user_recipients, unknown_recipients = \
-            _parse_recipients(body['recipients'])
-        if len(unknown_recipients) > 0:
-            return False, (f'Unknown recipient types: {json.dumps(unknown_recipients)}', \
-                HTTPStatus.BAD_REQUEST), None
-
-        if len(email_recipients + sms_recipients + user_recipients) <= 0:
-            return False, ('Must have atleast 1 recipient', HTTPStatus.BAD_REQUEST), None
-
-        if not 'sendTime' in body:
-            return False, ('"sendTime" missing from request body', HTTPStatus.BAD_REQUEST), None
+            return False, ('Request is not JSON', HTTPStatus.BAD_REQUEST), None, None
 
         try:
-            datetimeParse(body['sendTime'])
-        except ValueError:
-            return False, ('"sendTime" is not an ISO-8601 UTC date time string', \
-                HTTPStatus.BAD_REQUEST), None
+            mib = parse_mib(request.get_json(), require_message_id=is_put)
+        except ValidationError as error:
+            return False, (str(error), HTTPStatus.BAD_REQUEST), None, None
 
         message = None
         if is_put:
-            message = Message.query \
-                .filter_by(message_id=int(body['messageId']), user_id=TEMP_USER_ID).first()
+            message = messages.get(mib.message_id)
             if message is None:
                 return False, \
-                    (f'a message with messageId={body["messageId"]} could not be found',
-                    HTTPStatus.BAD_REQUEST), None
+                    (f'a message with messageId={mib.message_id} could not be found',
+                    HTTPStatus.BAD_REQUEST), None, None
 
             if message.sent or message.last_sent_time is not None:
-                return False, ('message already sent', HTTPStatus.BAD_REQUEST), None
+                return False, ('message already sent', HTTPStatus.BAD_REQUEST), None, None
 
-        return True, (None, None), message
+        return True, (None, None), mib, message
 
     assert request is not None
     assert isinstance(is_put, bool)
+    messages = _user_messages()
+
+    idempotency_key = None if is_put else request.headers.get('Idempotency-Key', None)
+    if idempotency_key is not None:
+        if not 1 <= len(idempotency_key) <= MAX_IDEMPOTENCY_KEY_LENGTH:
+            return f'"Idempotency-Key" must have between 1 and {MAX_IDEMPOTENCY_KEY_LENGTH} ' \
+                'characters', HTTPStatus.BAD_REQUEST
+        request_hash = _request_hash()
+        now = datetime.utcnow()
+        used_key = messages.get_idempotency_key(idempotency_key)
+        if used_key is not None and now - used_key.created_at < IDEMPOTENCY_KEY_TTL:
+            return _replay_post(used_key, request_hash)
 
-    is_valid_request, error_response, message = validate()
+    is_valid_request, error_response, mib, message = validate()
 
     if not is_valid_request:
         return error_response
 
-    # Note: the request recipients is not converted to a
-    # AnyOfMessageInABottleRecipients and is instead just a dict
-    mib = MessageInABottle.from_dict(request.get_json())
-    parsed_email_recipients, *_ = _parse_recipients(mib.recipients)
-    email_recipients = [
-        EmailMessageRecipient(email=email_recipient.email)
-        for email_recipient in parsed_email_recipients
-    ]
-
     if is_put:
-        message.message = mib.message
-        message.send_time = mib.send_time
-        message.email_recipients = email_recipients
-
-        db.session.commit()
+        messages.update(message, mib)
+        try:
+            db.session.commit()
+        except StaleDataError:
+            # a dispatcher claimed or sent the message, or another request changed it
+            db.session.rollback()
+            return 'the message was changed while it was updated', HTTPStatus.CONFLICT
 
         return 'MessageInABottle was successfully updated', HTTPStatus.OK
 
-    message = Message(
-        user_id=TEMP_USER_ID,
-        message=mib.message,
-        send_time=mib.send_time,
-        email_recipients=email_recipients
-    )
-    db.session.add(message)
-    db.session.commit()
+    message = messages.add(mib)
+    if idempotency_key is not None:
+        messages.add_idempotency_key(idempotency_key, request_hash, message, now,
+            expired=used_key)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        if idempotency_key is None:
+            raise
+        # a concurrent retry with the same key committed first, its message is the one created
+        db.session.rollback()
+        used_key = messages.get_idempotency_key(idempotency_key)
+        if used_key is None:
+            raise
+        return _replay_post(used_key, request_hash)
 
     return 'MessageInABottle was successfully created', HTTPStatus.CREATED, \
         {'Location': url_for('.get', messageId=message.message_id)}
 
 
-def _parse_recipients(recipients: List[Union[AnyOfMessageInABottleRecipientsItems, \
-    Dict[str, Any]]]) -> Tuple[EmailRecipient, SmsRecipient, UserRecipient, Dict[str, Any]]:
+def _request_hash() -> str:
+    '''
+    Returns a hash of the body of the global request that is the same for
+    retries of the request, however their JSON is formatted.
     '''
-    Parse a list recipeints in to their respective categories.
+    body = request.get_json(silent=True)
+    data = request.get_data() if body is None \
+        else json.dumps(body, sort_keys=True, separators=(',', ':')).encode()
+    return hashlib.sha256(data).hexdigest()
 
-    Preconditions:
-        recipients is not None
-        recipients is a list
 
-    Postconditions:
-        returns a tuple of (email_recipients, sms_recipients, user_recipients, unknown_recipients)
-            where each element of the tuple is a list of recipients corresponding to that
-            category
-        Note: sms_recipients and user_recipients will always be empty lists and their entries
-            will be in unknown_recipients since sms and user recipients are not implemented.
-    '''
-
-    assert recipients is not None
-    assert isinstance(recipients, List)
-
-    email_recipients = []
-    sms_recipients = []
-    user_recipients = []
-    unknown_recipients = []
-    for recipient in recipients:
-        if 'email' in recipient:
-            email_recipients.append(EmailRecipient.from_dict(recipient))
-        else:
-            unknown_recipients.append(recipient)
+def _replay_post(used_key: IdempotencyKey, request_hash: str):
+    '''
+    Returns the response of the POST /mibs request that used an Idempotency-Key,
+    without creating another message, for a retry of the request with request_hash.
+    '''
+    if used_key.request_hash != request_hash:
+        return '"Idempotency-Key" was already used with a different request', \
+            HTTPStatus.UNPROCESSABLE_ENTITY
+    return 'MessageInABottle was successfully created', HTTPStatus.CREATED, {
+        'Location': url_for('.get', messageId=used_key.message_id),
+        'Idempotent-Replayed': 'true',
+    }
+
+
+@mibs_blueprint.route('/batch', methods=['POST'])
+def post_batch():
+    '''
+    /mibs/batch POST endpoint. See openapi file.
+
+    Every MessageInABottle of the request is validated before any is created,
+    then all of them are created in one transaction, see MessageRepository.add_many.
+    '''
+    assert request is not None
+
+    if not request.is_json:
+        return 'Request is not JSON', HTTPStatus.BAD_REQUEST
+
+    bodies = request.get_json()
+    if not isinstance(bodies, list):
+        return 'Request body is not a JSON array', HTTPStatus.BAD_REQUEST
+    if not 1 <= len(bodies) <= MAX_BATCH_SIZE:
+        return f'Request body must have between 1 and {MAX_BATCH_SIZE} MessageInABottle', \
+            HTTPStatus.BAD_REQUEST
+
+    mibs = []
+    errors = []
+    for index, body in enumerate(bodies):
+        try:
+            mibs.append(parse_mib(body))
+        except ValidationError as error:
+            errors.append({'index': index, 'error': str(error)})
+    if len(errors) > 0:
+        return Response(json.dumps(errors), status=HTTPStatus.BAD_REQUEST,
+            mimetype='application/json')
+
+    message_ids = _user_messages().add_many(mibs)
+    db.session.commit()
 
-    return (email_recipients, sms_recipients, user_recipients, unknown_recipients)
+    location = url_for('.get')
+    return Response(json.dumps([
+        {'messageId': message_id, 'location': f'{location}?messageId={message_id}'}
+        for message_id in message_ids
+    ]), status=HTTPStatus.CREATED, mimetype='application/json')
 
 
 @mibs_blueprint.route('', methods=['PUT'])
@@ -178,6 +393,74 @@ def put():
     return _handle_post_put(is_put=True)
 
 
+@mibs_blueprint.route('', methods=['PATCH'])
+def patch():
+    '''
+    /mibs PATCH endpoint. See openapi file.
+
+    Applies a JSON Merge Patch of the message and sendTime of the message with
+    the "messageId" query parameter with a single UPDATE, without loading or
+    rewriting its recipients. With an If-Match header of the version of the
+    message the update is only applied if the message still has that version.
+    '''
+    try:
+        message_id = _parse_int_arg('messageId')
+        version = _parse_if_match_version()
+    except ValueError as error:
+        return str(error), HTTPStatus.BAD_REQUEST
+    if message_id is None:
+        return '"messageId" missing from query parameters', HTTPStatus.BAD_REQUEST
+
+    if not request.is_json:
+        return 'Request is not JSON', HTTPStatus.BAD_REQUEST
+    try:
+        mib_patch = parse_mib_patch(request.get_json(), message_id)
+    except ValidationError as error:
+        return str(error), HTTPStatus.BAD_REQUEST
+
+    values = {}
+    if mib_patch.message is not None:
+        values[Message.message] = mib_patch.message
+    if mib_patch.send_time is not None:
+        values[Message.send_time] = mib_patch.send_time
+
+    messages = _user_messages()
+    if len(values) > 0 and messages.patch(message_id, values, version):
+        db.session.commit()
+        headers = {} if version is None else {'ETag': f'"{version + 1}"'}
+        return 'MessageInABottle was successfully updated', HTTPStatus.OK, headers
+
+    # only an empty patch or a patch that was not applied reads the message
+    message = messages.query().filter(Message.message_id == message_id) \
+        .with_entities(Message.sent, Message.last_sent_time, Message.version).first()
+    if message is None:
+        return f'a message with messageId={message_id} could not be found', HTTPStatus.NOT_FOUND
+    if version is not None and message.version != version:
+        return f'the message has version {message.version}', HTTPStatus.PRECONDITION_FAILED
+    if message.sent or message.last_sent_time is not None:
+        return 'message already sent', HTTPStatus.BAD_REQUEST
+    return 'MessageInABottle was successfully updated', HTTPStatus.OK, \
+        {'ETag': f'"{message.version}"'}
+
+
+def _parse_if_match_version() -> Union[int, None]:
+    '''
+    Parses the message version of the If-Match header of the global request,
+    the version of a message is its ETag.
+
+    Postconditions:
+        returns None if the header is absent or *
+        raises ValueError with a message for the client if it is not one version
+    '''
+    if_match = request.if_match
+    if not if_match or if_match.star_tag:
+        return None
+    tags = if_match.as_set()
+    if len(tags) != 1 or not next(iter(tags)).isdigit():
+        raise ValueError('"If-Match" must be the version of the message')
+    return int(next(iter(tags)))
+
+
 @mibs_blueprint.route('', methods=['DELETE'])
 # TODO: add decorator
 def delete():
@@ -185,58 +468,97 @@ def delete():
     /mibs DELETE endpoint. See openapi file.
     '''
     assert request is not None
-    message_id_unparsed = request.args.get('messageId', None)
+    user_id = get_claims().user_id
 
-    message_id = None if message_id_unparsed is None else int(message_id_unparsed)
-    user_id = TEMP_USER_ID
+    try:
+        message_id = _parse_int_arg('messageId')
+        message_ids = _parse_int_list_arg('messageIds')
+    except ValueError as error:
+        return str(error), HTTPStatus.BAD_REQUEST
 
-    status_code = HTTPStatus.OK
+    if message_id is not None and message_ids is not None:
+        return '"messageId" and "messageIds" cannot both be present', HTTPStatus.BAD_REQUEST
+    if message_ids is not None and not 1 <= len(message_ids) <= MAX_DELETE_MESSAGE_IDS:
+        return f'"messageIds" must have between 1 and {MAX_DELETE_MESSAGE_IDS} ids', \
+            HTTPStatus.BAD_REQUEST
 
-    if delete_mibs_for_user(user_id, message_id):
-        if message_id is None:
-            message = 'Successfully deleted all mibs'
-        else:
+    if message_id is not None:
+        message_ids = [message_id]
+    deleted = delete_mibs_for_user(user_id, message_ids=message_ids)
+
+    if deleted > 0:
+        if message_id is not None:
             message = f'Successfully deleted mib with message id {message_id}'
-    else:
-        status_code = HTTPStatus.NOT_FOUND
-        if message_id is None:
-            message = 'Failed to delete all mibs: User does not have any mibs'
+        elif message_ids is not None:
+            message = f'Successfully deleted {deleted} mibs'
         else:
-            message = f'Failed to delete mib with message id {message_id}'
+            message = 'Successfully deleted all mibs'
+        return message, HTTPStatus.OK, {'X-Deleted-Count': str(deleted)}
 
-    return message, status_code
+    if message_id is not None:
+        message = f'Failed to delete mib with message id {message_id}'
+    elif message_ids is not None:
+        message = 'Failed to delete mibs: User does not have any mibs with the message ids'
+    else:
+        message = 'Failed to delete all mibs: User does not have any mibs'
+    return message, HTTPStatus.NOT_FOUND
 
 
-def delete_mibs_for_user(user_id: str, message_id: Union[None, str] = None) -> bool:
+def _parse_int_list_arg(name: str) -> Union[List[int], None]:
     '''
-    Deletes one or more messages in a bottle for a user from the database
+    Parses the comma separated list of integers query parameter name of the
+    global request.
+
+    Postconditions:
+        returns None if the parameter is absent
+        raises ValueError with a message for the client if an element is not an integer
+    '''
+    value = request.args.get(name, None)
+    if value is None:
+        return None
+    try:
+        return [int(element) for element in value.split(',') if element.strip() != '']
+    except ValueError as error:
+        raise ValueError(f'"{name}" is not a comma separated list of integers') from error
+
+
+def delete_mibs_for_user(user_id: str, message_id: Union[None, int] = None,
+    message_ids: Union[None, List[int]] = None) -> int:
+    '''
+    Deletes one or more messages in a bottle for a user, archived or not, from
+    the database with a single DELETE statement per table. The recipients of the
+    messages are deleted by the database through the ON DELETE CASCADE of their
+    foreign key.
     Arguments:
         user_id - the id of the user to delete the mibs for
         message_id - an optional parameter for the id of the message
+        message_ids - an optional parameter for the ids of several messages
     Preconditions:
         message_id is None or an integer
+        message_ids is None or a list of integers
+        message_id and message_ids are not both present
         user_id is not None,
         user_id is a string
         user_id is not an empty string
     Postconditions:
         If message_id is present, the message with that id will be deleted if it is present and
         belongs to the user with user_id.
-        If message_id is absent, all messages for the the user with user_id will be deleted
+        If message_ids is present, every message with one of those ids that belongs to the user
+        with user_id will be deleted.
+        If both are absent, all messages for the the user with user_id will be deleted
     Returns:
-        True if any messages were deleted, false otherwise
+        The number of messages deleted
     '''
     assert message_id is None or isinstance(message_id, int)
+    assert message_ids is None or all(isinstance(element, int) for element in message_ids)
+    assert message_id is None or message_ids is None
     assert user_id != ''
     assert isinstance(user_id, str)
     assert user_id is not None
 
-    query = Message.query.filter(Message.user_id == user_id)
     if message_id is not None:
-        query = query.filter(Message.message_id == message_id)
-    count = query.count()
-    if count > 0:
-        query.delete()
-        db.session.commit()
-        return True
-    return False
+        message_ids = [message_id]
 
+    deleted = MessageRepository(user_id).delete(message_ids)
+    db.session.commit()
+    return deleted
@@ -0,0 +1,191 @@
+'''
+Single pass validation of MessageInABottle request bodies.
+
+parse_mib follows the MessageInABottle schema of src/tools/api/openapi.yml and
+turns a JSON request body into a ParsedMib in one pass, so a request body is
+never parsed twice and the swagger models are not needed to read it.
+parse_mib_patch does the same for the JSON Merge Patch bodies of PATCH /mibs.
+'''
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, List, Union
+
+from flask import json
+
+# RFC 3339 / ISO-8601 date time, e.g. 2021-10-26T03:14:51.657Z. Seconds, the fraction of a
+# second and the UTC offset are optional, a missing offset is UTC.
+_DATE_TIME_PATTERN = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})[Tt ](\d{2}):(\d{2})'
+    r'(?::(\d{2})(?:[.,](\d+))?)?'
+    r'\s*(?:([Zz])|([+-])(\d{2}):?(\d{2}))?')
+# ASCII control characters, e.g. the CR LF that would inject headers or SMTP commands
+_CONTROL_CHARACTER_PATTERN = re.compile(r'[\x00-\x1f\x7f]')
+
+
+class ValidationError(ValueError):
+    '''
+    Raised when a request body is not a valid MessageInABottle. The message is
+    meant for the client.
+    '''
+
+
+@dataclass
+class ParsedMib:
+    '''
+    A validated MessageInABottle request body.
+
+    Attributes:
+        message_id: The messageId of the body, None if it had none
+        message: The message
+        send_time: The sendTime, as a naive UTC datetime like the Message model stores
+        emails: The emails of the email recipients, in request order
+    '''
+    message_id: Union[int, None]
+    message: str
+    send_time: datetime
+    emails: List[str]
+
+
+def parse_mib(body: Any, require_message_id: bool = False) -> ParsedMib:
+    '''
+    Validates and parses the JSON object of a MessageInABottle, see openapi file.
+
+    Preconditions:
+        require_message_id is a not None boolean
+
+    Postconditions:
+        returns the ParsedMib of body
+        raises ValidationError with the first reason body is not valid, for the client
+    '''
+    assert isinstance(require_message_id, bool)
+
+    if not isinstance(body, dict):
+        raise ValidationError('MessageInABottle is not a JSON object')
+
+    message_id = body.get('messageId', None)
+    if message_id is None:
+        if require_message_id:
+            raise ValidationError('"messageId" missing from request body')
+    elif not _is_integer(message_id):
+        raise ValidationError('"messageId" is not an integer')
+
+    if not 'message' in body:
+        raise ValidationError('"message" missing from request body')
+    message = body['message']
+    if not isinstance(message, str):
+        raise ValidationError('"message" is not a string')
+
+    if not 'recipients' in body:
+        raise ValidationError('"recipients" missing from request body')
+    recipients = body['recipients']
+    if not isinstance(recipients, list):
+        raise ValidationError('"recipients" is not a JSON array')
+
+    emails = []
+    unknown_recipients = []
+    for recipient in recipients:
+        email = recipient.get('email', None) if isinstance(recipient, dict) else None
+        if isinstance(email, str):
+            if _CONTROL_CHARACTER_PATTERN.search(email):
+                raise ValidationError(f'"email" {json.dumps(email)} contains a control character')
+            emails.append(email)
+        else:
+            # sms and user recipients are not implemented yet
+            unknown_recipients.append(recipient)
+    if len(unknown_recipients) > 0:
+        raise ValidationError(f'Unknown recipient types: {json.dumps(unknown_recipients)}')
+
+    if len(emails) <= 0:
+        raise ValidationError('Must have atleast 1 recipient')
+
+    if not 'sendTime' in body:
+        raise ValidationError('"sendTime" missing from request body')
+    try:
+        send_time = parse_date_time(body['sendTime'])
+    except ValueError as error:
+        raise ValidationError('"sendTime" is not an ISO-8601 UTC date time string') from error
+
+    return ParsedMib(message_id=message_id, message=message, send_time=send_time, emails=emails)
+
+
+@dataclass
+class ParsedMibPatch:
+    '''
+    A validated JSON Merge Patch (RFC 7396) of a MessageInABottle. Only the
+    message and sendTime can be patched, None fields are left unchanged.
+
+    Attributes:
+        message: The new message, None if the patch does not change it
+        send_time: The new sendTime, as a naive UTC datetime, None if the patch does not change it
+    '''
+    message: Union[str, None]
+    send_time: Union[datetime, None]
+
+
+def parse_mib_patch(body: Any, message_id: int) -> ParsedMibPatch:
+    '''
+    Validates and parses the JSON Merge Patch of the MessageInABottle with
+    message_id, see openapi file. Every member of the MessageInABottle is
+    required, so none of them can be removed with null.
+
+    Postconditions:
+        returns the ParsedMibPatch of body
+        raises ValidationError with the first reason body is not valid, for the client
+    '''
+    if not isinstance(body, dict):
+        raise ValidationError('Merge patch is not a JSON object')
+
+    if 'messageId' in body and body['messageId'] != message_id:
+        raise ValidationError('"messageId" cannot be changed')
+    if 'recipients' in body:
+        raise ValidationError('"recipients" cannot be patched, use PUT /mibs')
+    unknown_members = sorted(set(body) - {'messageId', 'message', 'sendTime'})
+    if len(unknown_members) > 0:
+        raise ValidationError(f'Unknown members: {json.dumps(unknown_members)}')
+
+    message = body.get('message', None)
+    if 'message' in body and not isinstance(message, str):
+        raise ValidationError('"message" is not a string')
+
+    send_time = None
+    if 'sendTime' in body:
+        try:
+            send_time = parse_date_time(body['sendTime'])
+        except ValueError as error:
+            raise ValidationError('"sendTime" is not an ISO-8601 UTC date time string') \
+                from error
+
+    return ParsedMibPatch(message=message, send_time=send_time)
+
+
+def parse_date_time(value: Any) -> datetime:
+    '''
+    Parses an RFC 3339 / ISO-8601 date time string such as
+    2021-10-26T03:14:51.657Z. Much faster than dateutil, which guesses at many
+    more formats.
+
+    Postconditions:
+        returns value as a naive UTC datetime
+        raises ValueError if value is not a date time string
+    '''
+    if not isinstance(value, str):
+        raise ValueError(f'{value!r} is not a string')
+    match = _DATE_TIME_PATTERN.fullmatch(value.strip())
+    if match is None:
+        raise ValueError(f'{value!r} is not an ISO-8601 date time')
+
+    year, month, day, hour, minute, second, fraction, utc, sign, offset_hours, offset_minutes = \
+        match.groups()
+    date_time = datetime(int(year), int(month), int(day), int(hour), int(minute),
+        int(second or 0), int((fraction or '0')[:6].ljust(6, '0')))
+
+    if sign is None or utc is not None:
+        return date_time
+    offset = timedelta(hours=int(offset_hours), minutes=int(offset_minutes))
+    return date_time - offset if sign == '+' else date_time + offset
+
+
+def _is_integer(value: Any) -> bool:
+    # JSON true and false are bools, which are ints in python
+    return isinstance(value, int) and not isinstance(value, bool)
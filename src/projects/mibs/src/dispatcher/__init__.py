@@ -0,0 +1,8 @@
+'''
+Sends messages in a bottle once their send time has passed.
+'''
+from dispatcher.backends import DeliveryBackend, OutgoingMessage, OutgoingRecipient, \
+    PooledSmtpBackend, SmtpBackend
+from dispatcher.smtp_pool import SmtpConnectionPool
+from dispatcher.async_backend import AsyncSmtpBackend, DomainRateLimiter
+from dispatcher.dispatcher import Dispatcher
@@ -0,0 +1,290 @@
+'''
+An asyncio delivery backend that keeps many SMTP transactions in flight at once.
+'''
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Set, Tuple, Union
+
+import aiosmtplib
+
+from dispatcher.backends import DEFAULT_SUBJECT, DeliveryBackend, OutgoingMessage, \
+    OutgoingRecipient, build_email
+
+logger = logging.getLogger(__name__)
+
+# A message and the recipients, all at one domain, it is sent to in one SMTP transaction
+Transaction = Tuple[OutgoingMessage, List[OutgoingRecipient]]
+
+
+class DomainRateLimiter:
+    '''
+    Token bucket rate limiter keyed by recipient domain.
+
+    Attributes:
+        rates: The maximum emails per second for a domain
+        default_rate: The maximum emails per second for domains missing from
+            rates, None for no limit
+    '''
+
+    def __init__(self, rates: Dict[str, float] = None, default_rate: float = None,
+        clock: Callable[[], float] = time.monotonic):
+        self.rates = {} if rates is None else dict(rates)
+        self.default_rate = default_rate
+        self.clock = clock
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    def rate(self, domain: str) -> float:
+        '''
+        Returns the emails per second allowed for domain, None if unlimited.
+        '''
+        return self.rates.get(domain, self.default_rate)
+
+    def reserve(self, domain: str, emails: int = 1) -> float:
+        '''
+        Takes tokens for emails sent to domain from its bucket.
+
+        Returns:
+            the number of seconds the caller must wait before sending
+        '''
+        rate = self.rate(domain)
+        if not rate:
+            return 0.0
+
+        now = self.clock()
+        tokens, updated = self._buckets.get(domain, (rate, now))
+        # a domain's bucket holds at most one second worth of tokens
+        tokens = min(rate, tokens + (now - updated) * rate) - emails
+        self._buckets[domain] = (tokens, now)
+        return 0.0 if tokens >= 0 else -tokens / rate
+
+    async def acquire(self, domain: str, emails: int = 1):
+        '''
+        Waits until emails may be sent to domain.
+        '''
+        delay = self.reserve(domain, emails)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class AsyncSmtpBackend(DeliveryBackend):
+    '''
+    Delivers emails with up to concurrency SMTP transactions in flight, each on
+    its own persistent aiosmtplib connection. Recipients of a message are
+    grouped by domain, one transaction per domain, so that sends can be rate
+    limited per domain. A domain with more than max_recipients_per_message
+    recipients gets several transactions.
+
+    The backend runs its own event loop in a background thread, so deliver can
+    be called from synchronous code such as the Dispatcher and connections stay
+    open between batches.
+
+    Attributes:
+        sender: The envelope and From address of sent emails
+        subject: The subject of sent emails
+        concurrency: The maximum number of SMTP transactions in flight
+        rate_limiter: Limits the emails sent per second to each domain
+        max_messages_per_connection: The number of messages sent over a
+            connection before it is reopened
+        max_recipients_per_message: The maximum number of RCPT TO in one SMTP
+            transaction
+    '''
+
+    def __init__(self, host: str, port: int, sender: str, subject: str = DEFAULT_SUBJECT,
+        concurrency: int = 100, rate_limiter: DomainRateLimiter = None,
+        max_messages_per_connection: int = 100, max_recipients_per_message: int = 100,
+        timeout: float = 30, smtp_factory: Callable[..., aiosmtplib.SMTP] = aiosmtplib.SMTP):
+        assert host
+        assert sender
+        assert concurrency > 0
+        assert max_messages_per_connection > 0
+        assert max_recipients_per_message > 0
+
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.subject = subject
+        self.concurrency = concurrency
+        self.rate_limiter = DomainRateLimiter() if rate_limiter is None else rate_limiter
+        self.max_messages_per_connection = max_messages_per_connection
+        self.max_recipients_per_message = max_recipients_per_message
+        self.timeout = timeout
+        self.smtp_factory = smtp_factory
+
+        self._connections: List['_AsyncConnection'] = []
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+            name='async-smtp-delivery', daemon=True)
+        self._thread.start()
+
+    def deliver(self, messages: List[OutgoingMessage],
+        delivered: Union[Set[int], None] = None) -> Set[int]:
+        assert messages is not None
+        return asyncio.run_coroutine_threadsafe(self.deliver_async(messages, delivered),
+            self._loop).result()
+
+    async def deliver_async(self, messages: List[OutgoingMessage],
+        delivered: Union[Set[int], None] = None) -> Set[int]:
+        '''
+        Delivers messages from within the backend's event loop, see deliver.
+        Transactions are fed to concurrency workers through a bounded queue, so
+        the producer waits whenever 2 * concurrency transactions are already
+        queued.
+        '''
+        queue: asyncio.Queue = asyncio.Queue(maxsize=2 * self.concurrency)
+        delivered = set() if delivered is None else delivered
+
+        while len(self._connections) < self.concurrency:
+            self._connections.append(_AsyncConnection(self._connect,
+                self.max_messages_per_connection))
+
+        async def produce():
+            for transaction in _transactions(messages, self.max_recipients_per_message):
+                await queue.put(transaction)
+            for _ in self._connections:
+                await queue.put(None)
+
+        tasks = [asyncio.ensure_future(produce())] + [
+            asyncio.ensure_future(self._worker(connection, queue, delivered))
+            for connection in self._connections
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        return delivered
+
+    async def _worker(self, connection: '_AsyncConnection', queue: asyncio.Queue,
+        delivered: Set[int]):
+        '''
+        Sends queued transactions over connection until it takes None from queue.
+        '''
+        while True:
+            transaction = await queue.get()
+            if transaction is None:
+                return
+            delivered.update(await self._send(connection, *transaction))
+
+    async def _send(self, connection: '_AsyncConnection', message: OutgoingMessage,
+        recipients: List[OutgoingRecipient]) -> Set[int]:
+        await self.rate_limiter.acquire(_domain(recipients[0].email), len(recipients))
+
+        try:
+            email = build_email(self.sender, self.subject, message, recipients)
+            refused = await connection.send(email, self.sender,
+                [recipient.email for recipient in recipients])
+        except (aiosmtplib.SMTPException, OSError):
+            return set()
+        except Exception: # pylint: disable=broad-except
+            # e.g. a malformed address, refused like the server would. The transaction
+            # may have been started, so the connection is reopened
+            logger.exception('Could not send message %d to %d recipients',
+                message.message_id, len(recipients))
+            await connection.close()
+            return set()
+
+        return {
+            recipient.recipient_id
+            for recipient in recipients
+            if recipient.email not in refused
+        }
+
+    def _connect(self) -> aiosmtplib.SMTP:
+        return self.smtp_factory(hostname=self.host, port=self.port, timeout=self.timeout)
+
+    def close(self):
+        '''
+        Closes every SMTP connection and stops the backend's event loop.
+        '''
+        async def close_connections():
+            await asyncio.gather(*(connection.close() for connection in self._connections))
+
+        asyncio.run_coroutine_threadsafe(close_connections(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+class _AsyncConnection:
+    '''
+    An aiosmtplib connection that is opened on first use, reopened once if the
+    server dropped it, and closed after max_messages messages.
+    '''
+
+    def __init__(self, connect: Callable[[], aiosmtplib.SMTP], max_messages: int):
+        self.connect = connect
+        self.max_messages = max_messages
+        self.smtp = None
+        self.messages_sent = 0
+
+    async def send(self, email, sender: str, recipients: List[str]) -> Dict[str, object]:
+        '''
+        Sends email to recipients in one SMTP transaction.
+
+        Returns:
+            the refused recipients
+        '''
+        try:
+            refused, _ = await (await self._connected()).send_message(email,
+                sender=sender, recipients=recipients)
+        except OSError:
+            # the server may have dropped an idle connection, retry once on a new one
+            await self.close()
+            try:
+                refused, _ = await (await self._connected()).send_message(email,
+                    sender=sender, recipients=recipients)
+            except OSError:
+                await self.close()
+                raise
+
+        self.messages_sent += 1
+        if self.messages_sent >= self.max_messages:
+            await self.close()
+        return refused
+
+    async def _connected(self) -> aiosmtplib.SMTP:
+        if self.smtp is None:
+            smtp = self.connect()
+            await smtp.connect()
+            self.smtp = smtp
+            self.messages_sent = 0
+        return self.smtp
+
+    async def close(self):
+        '''
+        Closes the connection if it is open.
+        '''
+        if self.smtp is None:
+            return
+
+        smtp, self.smtp = self.smtp, None
+        try:
+            await smtp.quit()
+        except (aiosmtplib.SMTPException, OSError):
+            smtp.close()
+
+
+def _transactions(messages: List[OutgoingMessage], max_recipients: int) -> List[Transaction]:
+    '''
+    Splits the recipients of each message by domain, one transaction per domain
+    and max_recipients of its recipients, which MTAs refuse beyond some limit.
+    '''
+    transactions = []
+    for message in messages:
+        recipients_by_domain: Dict[str, List[OutgoingRecipient]] = defaultdict(list)
+        for recipient in message.recipients:
+            recipients_by_domain[_domain(recipient.email)].append(recipient)
+        transactions.extend(
+            (message, recipients[start:start + max_recipients])
+            for recipients in recipients_by_domain.values()
+            for start in range(0, len(recipients), max_recipients)
+        )
+    return transactions
+
+
+def _domain(email: str) -> str:
+    return email.rpartition('@')[2].lower()
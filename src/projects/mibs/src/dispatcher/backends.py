@@ -0,0 +1,213 @@
+'''
+Delivery backends used by the dispatcher to send claimed messages in a bottle.
+'''
+import logging
+import smtplib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from email.message import EmailMessage
+from typing import List, Set, Tuple, Union
+
+from dispatcher.smtp_pool import SmtpConnectionPool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SUBJECT = 'You have a message in a bottle'
+
+
+@dataclass
+class OutgoingRecipient:
+    '''An email recipient of a claimed message that has not been sent to yet.'''
+    recipient_id: int
+    email: str
+
+
+@dataclass
+class OutgoingMessage:
+    '''A claimed message in a bottle and the recipients still waiting for it.'''
+    message_id: int
+    user_id: str
+    message: str
+    send_time: datetime
+    recipients: List[OutgoingRecipient] = field(default_factory=list)
+
+
+class DeliveryBackend:
+    '''
+    Base class for delivery backends. A backend is given a batch of claimed
+    messages and reports which recipients the messages were delivered to.
+    '''
+
+    def deliver(self, messages: List[OutgoingMessage],
+        delivered: Union[Set[int], None] = None) -> Set[int]:
+        '''
+        Delivers a batch of messages to their recipients. A message that
+        cannot be sent, e.g. because an email address is malformed, is not
+        delivered to, like a recipient the server refused, and does not keep
+        the other messages of the batch from being delivered.
+
+        Preconditions:
+            messages is not None
+
+        Postconditions:
+            returns delivered, or a new set if it is None, with the recipient_id
+            of every recipient that the message was delivered to added. Each
+            recipient is added as soon as it was delivered to, so the dispatcher
+            records the deliveries made before deliver raised. Recipients missing
+            from the result are retried by the dispatcher once the message's
+            claim times out.
+        '''
+        raise NotImplementedError
+
+    def close(self):
+        '''
+        Releases the connections and threads of the backend once it is no
+        longer used. Backends that hold none need not override it.
+        '''
+
+
+class SmtpBackend(DeliveryBackend):
+    '''
+    Delivers every email over its own SMTP connection.
+
+    Attributes:
+        host: The SMTP server host
+        port: The SMTP server port
+        sender: The envelope and From address of sent emails
+        subject: The subject of sent emails
+    '''
+
+    def __init__(self, host: str, port: int, sender: str, subject: str = DEFAULT_SUBJECT):
+        assert host
+        assert sender
+
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.subject = subject
+
+    def deliver(self, messages: List[OutgoingMessage],
+        delivered: Union[Set[int], None] = None) -> Set[int]:
+        assert messages is not None
+
+        delivered = set() if delivered is None else delivered
+        for message in messages:
+            for recipient in message.recipients:
+                try:
+                    email = build_email(self.sender, self.subject, message, [recipient])
+                    with smtplib.SMTP(self.host, self.port) as server:
+                        server.send_message(email)
+                except (smtplib.SMTPException, OSError):
+                    continue
+                except Exception: # pylint: disable=broad-except
+                    # e.g. a malformed address, refused like the server would
+                    logger.exception('Could not send message %d to recipient %d',
+                        message.message_id, recipient.recipient_id)
+                    continue
+                delivered.add(recipient.recipient_id)
+
+        return delivered
+
+
+class PooledSmtpBackend(DeliveryBackend):
+    '''
+    Delivers emails over a bounded pool of persistent SMTP connections. Each
+    message is sent to all of its recipients in one SMTP transaction (one
+    RCPT TO per recipient), and the messages of a batch are sent over the
+    pool's connections in parallel.
+
+    Attributes:
+        sender: The envelope and From address of sent emails
+        subject: The subject of sent emails
+        max_recipients_per_message: The maximum number of RCPT TO in one SMTP
+            transaction, recipients beyond it are sent a copy in a new transaction
+        pool: The SMTP connection pool
+    '''
+
+    def __init__(self, host: str, port: int, sender: str, subject: str = DEFAULT_SUBJECT,
+        pool_size: int = 4, max_messages_per_connection: int = 100,
+        max_recipients_per_message: int = 100, **pool_options):
+        assert sender
+        assert max_recipients_per_message > 0
+
+        self.sender = sender
+        self.subject = subject
+        self.max_recipients_per_message = max_recipients_per_message
+        self.pool = SmtpConnectionPool(host, port, size=pool_size,
+            max_messages_per_connection=max_messages_per_connection, **pool_options)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size,
+            thread_name_prefix='smtp-delivery')
+
+    def deliver(self, messages: List[OutgoingMessage],
+        delivered: Union[Set[int], None] = None) -> Set[int]:
+        assert messages is not None
+
+        transactions = [
+            (message, message.recipients[start:start + self.max_recipients_per_message])
+            for message in messages
+            for start in range(0, len(message.recipients), self.max_recipients_per_message)
+        ]
+
+        delivered = set() if delivered is None else delivered
+        for recipient_ids in self._executor.map(self._send, transactions):
+            delivered.update(recipient_ids)
+        return delivered
+
+    def _send(self, transaction: Tuple[OutgoingMessage, List[OutgoingRecipient]]) -> Set[int]:
+        '''
+        Sends a message to some of its recipients in one SMTP transaction and
+        returns the recipient_ids it was delivered to.
+        '''
+        message, recipients = transaction
+
+        with self.pool.connection() as connection:
+            try:
+                email = build_email(self.sender, self.subject, message, recipients)
+                refused = connection.send(email, self.sender,
+                    [recipient.email for recipient in recipients])
+            except (smtplib.SMTPException, OSError):
+                return set()
+            except Exception: # pylint: disable=broad-except
+                # e.g. a malformed address, refused like the server would. smtplib
+                # may have started the transaction, so the connection is reopened
+                logger.exception('Could not send message %d to %d recipients',
+                    message.message_id, len(recipients))
+                connection.close()
+                return set()
+
+        return {
+            recipient.recipient_id
+            for recipient in recipients
+            if recipient.email not in refused
+        }
+
+    def close(self):
+        '''
+        Waits for pending deliveries and closes every SMTP connection.
+        '''
+        self._executor.shutdown()
+        self.pool.close()
+
+
+def build_email(sender: str, subject: str, message: OutgoingMessage,
+    recipients: List[OutgoingRecipient]) -> EmailMessage:
+    '''
+    Builds the email sent to one or more recipients of a message in a bottle.
+
+    Preconditions:
+        sender is not empty
+        message is not None
+        recipients is not empty
+    '''
+    assert sender
+    assert message is not None
+    assert len(recipients) > 0
+
+    email = EmailMessage()
+    email['From'] = sender
+    # recipients batched in to one transaction must not see each other's address
+    email['To'] = recipients[0].email if len(recipients) == 1 else 'undisclosed-recipients:;'
+    email['Subject'] = subject
+    email.set_content(message.message)
+    return email
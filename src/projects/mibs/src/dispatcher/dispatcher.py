@@ -0,0 +1,331 @@
+'''
+Claims messages in a bottle whose send time has passed and hands them to a
+delivery backend.
+
+A message is claimed by setting its lastSentTime. Claiming is done with
+SELECT ... FOR UPDATE SKIP LOCKED on databases that support it, and with one
+conditional UPDATE per message elsewhere (e.g. SQLite), so several dispatcher
+processes can drain the same table without sending a message twice. The scan for
+due messages reads a read replica if the app has any, see models.routing.
+
+A claimed batch is delivered group_size messages at a time. The results of a
+group are recorded as soon as it is delivered, and the claims of the messages
+still waiting are renewed, so a claim only has to outlast the delivery of one
+group, however long the whole batch takes. A message whose claim timed out
+anyway is left to the dispatcher that claimed it next. A message is claimed at
+most max_attempts times. If recipients are still not delivered to after the last
+attempt, the message is marked as sent and failed, so it is never scanned again
+and gets archived like any other sent message.
+
+Every change of a message increments its version, so that an edit of a message
+that was loaded before the dispatcher claimed or sent it fails instead of
+silently overwriting it, see models.Message.
+'''
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Sequence, Set
+
+from sqlalchemy import and_, bindparam, not_, or_, select, update
+from sqlalchemy.orm import Session
+
+from dispatcher.backends import DeliveryBackend, OutgoingMessage, OutgoingRecipient
+from models import EmailMessageRecipient, Message
+from models.routing import read_replica
+
+logger = logging.getLogger(__name__)
+
+message_table = Message.__table__
+recipient_table = EmailMessageRecipient.__table__
+
+# Upper bound on the number of parameters in one IN (...) clause
+MAX_IN_CLAUSE_SIZE = 500
+
+
+class Dispatcher:
+    '''
+    Sends due messages in a bottle in batches.
+
+    Attributes:
+        session: The database session used to claim and update messages
+        backend: The backend that delivers claimed messages
+        batch_size: The maximum number of messages claimed at once
+        claim_timeout: How long a claimed message that is not completely sent
+            waits before it is claimed again, longer than delivering
+            group_size messages can take
+        group_size: The number of messages delivered between claim renewals
+        max_attempts: The number of times a message is claimed before it is
+            given up on
+        clock: Returns the seconds elapsed since some fixed time, for renewals
+    '''
+
+    def __init__(self, session: Session, backend: DeliveryBackend, batch_size: int = 500,
+        claim_timeout: timedelta = timedelta(minutes=10), group_size: int = 50,
+        max_attempts: int = 5, clock: Callable[[], float] = time.monotonic):
+        assert session is not None
+        assert backend is not None
+        assert batch_size > 0
+        assert group_size > 0
+        assert max_attempts > 0
+
+        self.session = session
+        self.backend = backend
+        self.batch_size = batch_size
+        self.claim_timeout = claim_timeout
+        self.group_size = group_size
+        self.max_attempts = max_attempts
+        self.clock = clock
+
+    def run(self, poll_interval: float = 1.0, should_stop: Callable[[], bool] = lambda: False):
+        '''
+        Dispatches batches until should_stop returns True. Sleeps for
+        poll_interval seconds whenever there are no more due messages, or a
+        batch failed, which is logged, so that the worker keeps running.
+        '''
+        while not should_stop():
+            try:
+                dispatched = self.dispatch_batch()
+            except Exception: # pylint: disable=broad-except
+                logger.exception('Dispatching a batch failed')
+                self.session.rollback()
+                dispatched = 0
+            if dispatched < self.batch_size:
+                time.sleep(poll_interval)
+
+    def dispatch_batch(self, now: datetime = None) -> int:
+        '''
+        Claims, delivers and updates one batch of due messages, group_size
+        messages at a time.
+
+        Arguments:
+            now - the current UTC time, defaults to datetime.utcnow()
+
+        Postconditions:
+            Recipients the backend delivered to are marked as sent. Every
+            recipient of the batch has its sendAttemptTime set.
+            Messages whose recipients have all been sent to are marked as sent.
+            Messages that were not, on their max_attempts-th claim, are marked as
+            sent and failed.
+            This is recorded even if the backend raises, which is then raised.
+            Messages another dispatcher claimed after their claim timed out
+            are not delivered.
+
+        Returns:
+            the number of messages that were claimed
+        '''
+        now = datetime.utcnow() if now is None else now
+        started = self.clock()
+
+        message_ids = self.claim(now)
+        if len(message_ids) == 0:
+            return 0
+
+        pending = self._load(message_ids)
+        claimed_at = now
+        while len(pending) > 0:
+            group, pending = pending[:self.group_size], pending[self.group_size:]
+            # filled in by the backend as it delivers, see DeliveryBackend.deliver
+            delivered: Set[int] = set()
+            try:
+                delivered.update(self.backend.deliver(group, delivered))
+            finally:
+                self._record(group, delivered, now)
+
+            if len(pending) > 0:
+                renewed_at = now + timedelta(seconds=self.clock() - started)
+                pending = self._renew(pending, claimed_at, renewed_at)
+                claimed_at = renewed_at
+
+        return len(message_ids)
+
+    def claim(self, now: datetime) -> List[int]:
+        '''
+        Claims up to batch_size due messages by setting their lastSentTime to now
+        and counting the attempt in their sendAttempts. A message is due if it is
+        not sent, its sendTime has passed, it is not claimed or its claim is older
+        than claim_timeout, and it was claimed fewer than max_attempts times.
+
+        Returns:
+            the messageIds of the claimed messages, in sendTime order
+        '''
+        due = and_(
+            not_(message_table.c.sent),
+            message_table.c.sendTime <= now,
+            or_(
+                message_table.c.lastSentTime.is_(None),
+                message_table.c.lastSentTime <= now - self.claim_timeout,
+            ),
+            message_table.c.sendAttempts < self.max_attempts,
+        )
+        claimed = {
+            'lastSentTime': now,
+            'sendAttempts': message_table.c.sendAttempts + 1,
+            'version': message_table.c.version + 1,
+        }
+        candidates = select(message_table.c.messageId) \
+            .where(due) \
+            .order_by(message_table.c.sendTime) \
+            .limit(self.batch_size)
+
+        # The scan for due messages reads a replica if there is one. Replicas lag
+        # behind, so the candidates are claimed on the primary only if still due.
+        scanned = None
+        with read_replica(self.session) as from_replica:
+            if from_replica:
+                scanned = self.session.execute(candidates).scalars().all()
+
+        if self.session.connection().dialect.name == 'postgresql':
+            if scanned is not None:
+                candidates = select(message_table.c.messageId) \
+                    .where(and_(message_table.c.messageId.in_(scanned), due)) \
+                    .order_by(message_table.c.sendTime)
+            message_ids = self.session.execute(
+                candidates.with_for_update(skip_locked=True)).scalars().all()
+            for chunk in _chunks(message_ids):
+                self.session.execute(update(message_table)
+                    .where(message_table.c.messageId.in_(chunk))
+                    .values(claimed))
+        else:
+            # Without row locks another dispatcher may claim a candidate first, so
+            # each candidate is re-checked by a conditional UPDATE.
+            claim_one = update(message_table) \
+                .where(and_(message_table.c.messageId == bindparam('candidate_id'), due)) \
+                .values(claimed)
+            message_ids = [
+                message_id
+                for message_id in (scanned if scanned is not None
+                    else self.session.execute(candidates).scalars().all())
+                if self.session.execute(claim_one, {'candidate_id': message_id}).rowcount == 1
+            ]
+
+        self.session.commit()
+        return message_ids
+
+    def _renew(self, messages: List[OutgoingMessage], claimed_at: datetime,
+        renewed_at: datetime) -> List[OutgoingMessage]:
+        '''
+        Renews the claims of messages that were made at claimed_at by setting
+        their lastSentTime to renewed_at.
+
+        Returns:
+            the messages that are still claimed by this dispatcher, without
+            those whose claim timed out and that another dispatcher claimed
+        '''
+        message_ids = [message.message_id for message in messages]
+        renewal = {'lastSentTime': renewed_at, 'version': message_table.c.version + 1}
+        if self.session.connection().dialect.name == 'postgresql':
+            renewed = set()
+            for chunk in _chunks(message_ids):
+                renewed.update(self.session.execute(select(message_table.c.messageId)
+                    .where(and_(message_table.c.messageId.in_(chunk),
+                        message_table.c.lastSentTime == claimed_at))
+                    .with_for_update()).scalars())
+            for chunk in _chunks(list(renewed)):
+                self.session.execute(update(message_table)
+                    .where(message_table.c.messageId.in_(chunk))
+                    .values(renewal))
+        else:
+            # another dispatcher may have claimed a message at renewed_at too, so
+            # each claim is renewed by a conditional UPDATE that reports whether it matched
+            renew_one = update(message_table) \
+                .where(and_(message_table.c.messageId == bindparam('renewed_id'),
+                    message_table.c.lastSentTime == claimed_at)) \
+                .values(renewal)
+            renewed = {
+                message_id
+                for message_id in message_ids
+                if self.session.execute(renew_one, {'renewed_id': message_id}).rowcount == 1
+            }
+        self.session.commit()
+
+        if len(renewed) < len(messages):
+            logger.warning('%d claims timed out before their messages were sent, '
+                'the claim timeout is too short', len(messages) - len(renewed))
+        return [message for message in messages if message.message_id in renewed]
+
+    def _load(self, message_ids: List[int]) -> List[OutgoingMessage]:
+        '''
+        Loads claimed messages and their unsent email recipients with one query
+        per table.
+        '''
+        messages: Dict[int, OutgoingMessage] = {}
+        for chunk in _chunks(message_ids):
+            for row in self.session.execute(
+                select(message_table.c.messageId, message_table.c.userId,
+                    message_table.c.message, message_table.c.sendTime)
+                .where(message_table.c.messageId.in_(chunk))):
+                messages[row.messageId] = OutgoingMessage(
+                    message_id=row.messageId,
+                    user_id=row.userId,
+                    message=row.message,
+                    send_time=row.sendTime,
+                )
+
+            for row in self.session.execute(
+                select(recipient_table.c.messageSendRequestId, recipient_table.c.MessageId,
+                    recipient_table.c.email)
+                .where(and_(recipient_table.c.MessageId.in_(chunk),
+                    not_(recipient_table.c.sent)))
+                .order_by(recipient_table.c.messageSendRequestId)):
+                messages[row.MessageId].recipients.append(OutgoingRecipient(
+                    recipient_id=row.messageSendRequestId,
+                    email=row.email,
+                ))
+
+        self.session.commit()
+        return [messages[message_id] for message_id in message_ids if message_id in messages]
+
+    def _record(self, messages: List[OutgoingMessage], delivered: Set[int], now: datetime):
+        '''
+        Records the result of delivering a batch with one bulk UPDATE per outcome.
+        '''
+        attempted = [
+            recipient.recipient_id
+            for message in messages
+            for recipient in message.recipients
+        ]
+        failed = [recipient_id for recipient_id in attempted if recipient_id not in delivered]
+        completed = {
+            message.message_id
+            for message in messages
+            if all(recipient.recipient_id in delivered for recipient in message.recipients)
+        }
+        # given up on if this was their last attempt
+        incomplete = [
+            message.message_id
+            for message in messages
+            if message.message_id not in completed
+        ]
+
+        for chunk in _chunks([recipient_id for recipient_id in attempted
+            if recipient_id in delivered]):
+            self.session.execute(update(recipient_table)
+                .where(recipient_table.c.messageSendRequestId.in_(chunk))
+                .values(sent=True, sendAttemptTime=now))
+        for chunk in _chunks(failed):
+            self.session.execute(update(recipient_table)
+                .where(recipient_table.c.messageSendRequestId.in_(chunk))
+                .values(sendAttemptTime=now))
+        for chunk in _chunks(sorted(completed)):
+            self.session.execute(update(message_table)
+                .where(message_table.c.messageId.in_(chunk))
+                .values(sent=True, version=message_table.c.version + 1))
+        given_up = 0
+        for chunk in _chunks(incomplete):
+            given_up += self.session.execute(update(message_table)
+                .where(and_(message_table.c.messageId.in_(chunk),
+                    message_table.c.sendAttempts >= self.max_attempts))
+                .values(sent=True, failed=True, version=message_table.c.version + 1)).rowcount
+
+        self.session.commit()
+        if given_up > 0:
+            logger.warning('Gave up on %d messages after %d attempts', given_up,
+                self.max_attempts)
+
+
+def _chunks(values: Sequence, size: int = MAX_IN_CLAUSE_SIZE) -> Iterator[Sequence]:
+    '''
+    Splits values in to consecutive chunks of at most size elements.
+    '''
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
@@ -0,0 +1,148 @@
+'''
+A bounded pool of persistent SMTP connections.
+'''
+import queue
+import smtplib
+from contextlib import contextmanager
+from email.message import EmailMessage
+from typing import Callable, Dict, Iterator, List, Tuple
+
+
+
+class PooledSmtpConnection:
+    '''
+    An SMTP connection that is opened on first use, reopened once if the server
+    dropped it, and closed after max_messages messages.
+
+    Attributes:
+        smtp: The open smtplib.SMTP connection, None if not connected
+        messages_sent: The number of messages sent over the open connection
+    '''
+
+    def __init__(self, connect: Callable[[], smtplib.SMTP], max_messages: int):
+        assert connect is not None
+        assert max_messages > 0
+
+        self.connect = connect
+        self.max_messages = max_messages
+        self.smtp = None
+        self.messages_sent = 0
+
+    def send(self, email: EmailMessage, sender: str, to_addrs: List[str]) \
+        -> Dict[str, Tuple[int, bytes]]:
+        '''
+        Sends email to every address in to_addrs in one SMTP transaction.
+
+        Postconditions:
+            Raises smtplib.SMTPRecipientsRefused if every recipient was refused
+            and other smtplib.SMTPExceptions if the email was not accepted.
+
+        Returns:
+            the refused recipients, see smtplib.SMTP.sendmail
+        '''
+        assert len(to_addrs) > 0
+
+        try:
+            refused = self._connected().send_message(email, sender, to_addrs)
+        except OSError as error:
+            if not _is_connection_error(error):
+                raise
+            # the server may have dropped an idle connection, retry once on a new one
+            self.close()
+            try:
+                refused = self._connected().send_message(email, sender, to_addrs)
+            except OSError as retry_error:
+                if _is_connection_error(retry_error):
+                    self.close()
+                raise
+
+        self.messages_sent += 1
+        if self.messages_sent >= self.max_messages:
+            self.close()
+        return refused
+
+    def _connected(self) -> smtplib.SMTP:
+        if self.smtp is None:
+            self.smtp = self.connect()
+            self.messages_sent = 0
+        return self.smtp
+
+    def close(self):
+        '''
+        Closes the connection if it is open.
+        '''
+        if self.smtp is None:
+            return
+
+        try:
+            self.smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self.smtp.close()
+        self.smtp = None
+
+
+class SmtpConnectionPool:
+    '''
+    A pool of at most size SMTP connections to one server. Connections are
+    opened lazily and reused until they have sent max_messages_per_connection
+    messages.
+
+        with pool.connection() as connection:
+            connection.send(email, sender, ['a@email.com', 'b@email.com'])
+    '''
+
+    def __init__(self, host: str, port: int, size: int = 4,
+        max_messages_per_connection: int = 100, timeout: float = 30,
+        smtp_factory: Callable[..., smtplib.SMTP] = smtplib.SMTP):
+        assert host
+        assert size > 0
+
+        self.host = host
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        self.smtp_factory = smtp_factory
+
+        self._idle = queue.LifoQueue(maxsize=size)
+        for _ in range(size):
+            self._idle.put(PooledSmtpConnection(self._connect, max_messages_per_connection))
+
+    def _connect(self) -> smtplib.SMTP:
+        return self.smtp_factory(self.host, self.port, timeout=self.timeout)
+
+    @contextmanager
+    def connection(self) -> Iterator[PooledSmtpConnection]:
+        '''
+        Borrows a connection from the pool, waiting for one to be returned if
+        all size connections are in use.
+        '''
+        connection = self._idle.get()
+        try:
+            yield connection
+        finally:
+            self._idle.put(connection)
+
+    def close(self):
+        '''
+        Closes every idle connection. Closed connections reopen on their next use.
+        '''
+        connections = []
+        while True:
+            try:
+                connections.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+        for connection in connections:
+            connection.close()
+            self._idle.put(connection)
+
+
+def _is_connection_error(error: OSError) -> bool:
+    '''
+    Returns True if error means the SMTP connection can no longer be used.
+    smtplib.SMTPException is an OSError, but only some SMTPExceptions are
+    connection errors, e.g. a refused recipient is not.
+    '''
+    return isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)) \
+        or not isinstance(error, smtplib.SMTPException)
@@ -1,30 +1,70 @@
 """
 DB Model
 """
-from flask_sqlalchemy import SQLAlchemy
+from models.routing import RoutingSQLAlchemy
 
-db = SQLAlchemy()
+# read only requests and scans can read from replicas, see models.routing
+db = RoutingSQLAlchemy()
 
 
 class Message(db.Model):
     '''Database model representing a message in a bottle.'''
     __tablename__ = "Message"
+    __table_args__ = (
+        # every MIBS query is scoped to a user, GET /mibs pages through a user's messageIds
+        db.Index("ix_Message_userId_messageId", "userId", "messageId"),
+        # the dispatcher only scans unsent messages in sendTime order
+        db.Index("ix_Message_sendTime_unsent", "sendTime",
+            postgresql_where=db.text("NOT sent"),
+            sqlite_where=db.text("NOT sent")),
+        # models.archive moves sent messages to ArchivedMessage in lastSentTime order, SQLite
+        # only uses a partial index if its condition is written like the query's
+        db.Index("ix_Message_lastSentTime_sent", "lastSentTime",
+            postgresql_where=db.text("sent"),
+            sqlite_where=db.text("sent = 1")),
+        # archived messages keep their messageId, SQLite must not reuse the ids of
+        # the last messages once they are archived, like a Postgres sequence never does
+        {"sqlite_autoincrement": True},
+    )
     message_id = db.Column("messageId", db.Integer, primary_key=True)
     user_id = db.Column("userId", db.Unicode, nullable=False)
     message = db.Column("message", db.UnicodeText, nullable=False)
     send_time = db.Column("sendTime", db.DateTime, nullable=False)
     sent = db.Column("sent", db.Boolean, nullable=False, default=False)
     last_sent_time = db.Column("lastSentTime", db.DateTime, default=None)
+    # the number of times a dispatcher claimed the message, see dispatcher.Dispatcher
+    send_attempts = db.Column("sendAttempts", db.Integer, nullable=False, default=0,
+        server_default="0")
+    # the dispatcher gave up on the recipients that were not sent to, the message is marked
+    # sent too, so that it leaves ix_Message_sendTime_unsent and is archived
+    failed = db.Column("failed", db.Boolean, nullable=False, default=False,
+        server_default=db.false())
+    # incremented by every update of the message, for optimistic concurrency checks
+    version = db.Column("version", db.Integer, nullable=False, default=1, server_default="1")
+    # loaded on access, queries that list messages load the recipients of every message
+    # at once with the strategies of models.loading
     email_recipients = db.relationship("EmailMessageRecipient",
         backref="message",
         cascade="all,delete,delete-orphan",
         lazy=True,
+        order_by="EmailMessageRecipient.message_send_request_id",
         passive_deletes=True)
 
+    # ORM updates are UPDATE ... WHERE version = ?, and raise StaleDataError if another
+    # transaction, e.g. a dispatcher, changed the message since it was loaded. The version is
+    # incremented explicitly, also when only the recipients of a message change.
+    __mapper_args__ = {
+        "version_id_col": version,
+        "version_id_generator": False,
+    }
+
 
 class EmailMessageRecipient(db.Model):
     '''Database model for a recipient of a message in a bottle via email.'''
     __tablename__ = "EmailMessageRecipient"
+    __table_args__ = (
+        db.Index("ix_EmailMessageRecipient_MessageId", "MessageId"),
+    )
     message_send_request_id = db.Column("messageSendRequestId",
         db.Integer, primary_key=True)
     message_id = db.Column("MessageId", db.Integer,
@@ -34,6 +74,65 @@ class EmailMessageRecipient(db.Model):
     send_attempt_time = db.Column("sendAttemptTime", db.DateTime, default=None)
 
 
+class ArchivedMessage(db.Model):
+    '''
+    Database model of a sent message in a bottle that models.archive moved out
+    of Message, so that the tables the dispatcher and GET /mibs scan only grow
+    with the messages that are yet to be sent or were sent recently. Archived
+    messages keep their messageId and are read only.
+    '''
+    __tablename__ = "ArchivedMessage"
+    __table_args__ = (
+        db.Index("ix_ArchivedMessage_userId_messageId", "userId", "messageId"),
+    )
+    message_id = db.Column("messageId", db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column("userId", db.Unicode, nullable=False)
+    message = db.Column("message", db.UnicodeText, nullable=False)
+    send_time = db.Column("sendTime", db.DateTime, nullable=False)
+    sent = db.Column("sent", db.Boolean, nullable=False)
+    last_sent_time = db.Column("lastSentTime", db.DateTime)
+    failed = db.Column("failed", db.Boolean, nullable=False, default=False,
+        server_default=db.false())
+    version = db.Column("version", db.Integer, nullable=False)
+    archived_at = db.Column("archivedAt", db.DateTime, nullable=False)
+    email_recipients = db.relationship("ArchivedEmailMessageRecipient",
+        backref="message",
+        cascade="all,delete,delete-orphan",
+        lazy=True,
+        order_by="ArchivedEmailMessageRecipient.message_send_request_id",
+        passive_deletes=True)
+
 
+class ArchivedEmailMessageRecipient(db.Model):
+    '''Database model for a recipient of an archived message in a bottle.'''
+    __tablename__ = "ArchivedEmailMessageRecipient"
+    __table_args__ = (
+        db.Index("ix_ArchivedEmailMessageRecipient_MessageId", "MessageId"),
+    )
+    message_send_request_id = db.Column("messageSendRequestId",
+        db.Integer, primary_key=True, autoincrement=False)
+    message_id = db.Column("MessageId", db.Integer,
+        db.ForeignKey("ArchivedMessage.messageId", ondelete="CASCADE"), nullable=False)
+    email = db.Column("email", db.Unicode, nullable=False)
+    sent = db.Column("sent", db.Boolean, nullable=False)
+    send_attempt_time = db.Column("sendAttemptTime", db.DateTime)
 
 
+class IdempotencyKey(db.Model):
+    '''
+    Database model for the Idempotency-Key of a request that created a message
+    in a bottle, so that retries of the request return the same message.
+    '''
+    __tablename__ = "IdempotencyKey"
+    __table_args__ = (
+        # expired keys are purged in createdAt order
+        db.Index("ix_IdempotencyKey_createdAt", "createdAt"),
+    )
+    # keys are only unique per user, the primary key is the unique index that
+    # makes concurrent retries with the same key create one message
+    user_id = db.Column("userId", db.Unicode, primary_key=True)
+    key = db.Column("key", db.Unicode(255), primary_key=True)
+    request_hash = db.Column("requestHash", db.Unicode(64), nullable=False)
+    # not a foreign key, retries get the original response even after the message is deleted
+    message_id = db.Column("messageId", db.Integer, nullable=False)
+    created_at = db.Column("createdAt", db.DateTime, nullable=False)
@@ -0,0 +1,108 @@
+"""
+Archival of sent messages in a bottle, see README
+"""
+import logging
+import time
+from datetime import datetime
+from typing import List
+
+from sqlalchemy import and_, delete, insert, literal, select
+from sqlalchemy.orm import Session
+
+from models import ArchivedEmailMessageRecipient, ArchivedMessage, EmailMessageRecipient, Message
+
+logger = logging.getLogger(__name__)
+
+message_table = Message.__table__
+recipient_table = EmailMessageRecipient.__table__
+archived_message_table = ArchivedMessage.__table__
+archived_recipient_table = ArchivedEmailMessageRecipient.__table__
+
+# The most messages moved to the archive in one transaction
+DEFAULT_ARCHIVE_BATCH_SIZE = 1000
+# The largest batch, the messageIds of a batch are bound in one IN clause
+MAX_ARCHIVE_BATCH_SIZE = 10000
+
+
+def archive_sent_messages(session: Session, sent_before: datetime,
+    batch_size: int = DEFAULT_ARCHIVE_BATCH_SIZE, pause: float = 0,
+    now: datetime = None) -> int:
+    '''
+    Moves the sent messages whose lastSentTime is before sent_before, and
+    their recipients, from Message and EmailMessageRecipient to ArchivedMessage
+    and ArchivedEmailMessageRecipient, in batches of at most batch_size
+    messages that are each committed in their own transaction, pausing pause
+    seconds between batches. A batch only locks the rows it moves while it
+    runs, so the dispatcher and requests keep going while messages are
+    archived. Archived messages keep their messageId and record now, the
+    current time if None, as their archivedAt.
+
+    Any number of archivers may run at once, on Postgres a batch skips the
+    messages another archiver is moving.
+
+    Returns:
+        the number of messages archived
+
+    Preconditions:
+        0 < batch_size <= MAX_ARCHIVE_BATCH_SIZE and pause >= 0
+    '''
+    assert 0 < batch_size <= MAX_ARCHIVE_BATCH_SIZE
+    assert pause >= 0
+    if now is None:
+        now = datetime.utcnow()
+
+    archived = 0
+    batches = 0
+    while True:
+        message_ids = _archive_batch(session, sent_before, batch_size, now)
+        archived += len(message_ids)
+        batches += 1
+        if len(message_ids) < batch_size:
+            break
+        time.sleep(pause)
+
+    logger.info('Archived %d messages sent before %s in %d batches',
+        archived, sent_before.isoformat(), batches)
+    return archived
+
+
+def _archive_batch(session: Session, sent_before: datetime, batch_size: int,
+    now: datetime) -> List[int]:
+    '''
+    Moves up to batch_size of the oldest sent messages whose lastSentTime is
+    before sent_before to the archive in one transaction.
+
+    Returns:
+        the messageIds of the archived messages
+    '''
+    # the scan reads ix_Message_lastSentTime_sent, it never touches unsent messages
+    archivable = select(message_table.c.messageId) \
+        .where(and_(message_table.c.sent, message_table.c.lastSentTime < sent_before)) \
+        .order_by(message_table.c.lastSentTime) \
+        .limit(batch_size)
+    if session.connection().dialect.name == 'postgresql':
+        # a user deleting one of the messages waits for the batch instead of racing it
+        archivable = archivable.with_for_update(skip_locked=True)
+    message_ids = session.execute(archivable).scalars().all()
+    if len(message_ids) == 0:
+        session.commit()
+        return message_ids
+
+    session.execute(insert(archived_message_table).from_select(
+        [column.name for column in archived_message_table.columns],
+        select(*[
+            literal(now, ArchivedMessage.archived_at.type).label(column.name)
+            if column is archived_message_table.c.archivedAt
+            else message_table.c[column.name]
+            for column in archived_message_table.columns
+        ]).where(message_table.c.messageId.in_(message_ids))))
+    session.execute(insert(archived_recipient_table).from_select(
+        [column.name for column in archived_recipient_table.columns],
+        select(*[recipient_table.c[column.name] for column in archived_recipient_table.columns])
+            .where(recipient_table.c.MessageId.in_(message_ids))))
+
+    # the recipients first, without relying on the ON DELETE CASCADE
+    session.execute(delete(recipient_table).where(recipient_table.c.MessageId.in_(message_ids)))
+    session.execute(delete(message_table).where(message_table.c.messageId.in_(message_ids)))
+    session.commit()
+    return message_ids
@@ -0,0 +1,60 @@
+"""
+Engine and connection pool options of the MIBS database
+"""
+import logging
+from typing import Any, Dict
+
+from sqlalchemy.pool import NullPool
+
+logger = logging.getLogger(__name__)
+
+
+def engine_options(pool_size: int = 5, max_overflow: int = 10, pool_timeout: float = 30,
+    pool_recycle: int = 1800, pool_pre_ping: bool = True, statement_timeout: int = 0,
+    pgbouncer: bool = False) -> Dict[str, Any]:
+    '''
+    Returns the SQLALCHEMY_ENGINE_OPTIONS of a Postgres database.
+
+    Every process keeps up to pool_size connections open and opens up to
+    max_overflow more under load, waiting at most pool_timeout seconds for a
+    connection once all of them are in use. A pool_size of 0 opens a
+    connection for every transaction instead, e.g. behind PgBouncer.
+    Connections older than pool_recycle seconds are replaced, -1 keeps them,
+    and with pool_pre_ping connections the server closed are replaced when
+    they are checked out. statement_timeout is the longest a statement may
+    run in milliseconds, 0 for no limit.
+
+    With pgbouncer the options are compatible with PgBouncer in transaction
+    pooling mode, where consecutive transactions of a connection may run on
+    different server connections: no session state is set with startup
+    parameters, which PgBouncer rejects, so statement_timeout must be set on
+    the database role instead. psycopg2 never prepares statements on the
+    server, which would not survive a change of server connection either.
+
+    Preconditions:
+        pool_size >= 0, max_overflow >= 0, pool_timeout > 0 and statement_timeout >= 0
+    '''
+    assert pool_size >= 0
+    assert max_overflow >= 0
+    assert pool_timeout > 0
+    assert statement_timeout >= 0
+
+    options: Dict[str, Any] = {'pool_pre_ping': pool_pre_ping}
+    if pool_size == 0:
+        options['poolclass'] = NullPool
+    else:
+        options.update({
+            'pool_size': pool_size,
+            'max_overflow': max_overflow,
+            'pool_timeout': pool_timeout,
+            'pool_recycle': pool_recycle,
+        })
+
+    if statement_timeout > 0:
+        if pgbouncer:
+            logger.warning('statement_timeout is ignored with pgbouncer, set it on the database '
+                'role with ALTER ROLE ... SET statement_timeout = %d', statement_timeout)
+        else:
+            options['connect_args'] = {'options': f'-c statement_timeout={statement_timeout}'}
+    return options
+
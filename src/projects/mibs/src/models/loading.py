@@ -0,0 +1,28 @@
+"""
+Loading strategies for MIBS queries
+"""
+from typing import Type, Union
+
+from sqlalchemy.orm import Query, joinedload, selectinload
+
+from models import ArchivedMessage, Message
+
+
+def load_for_list(query: Query, model: Type[Union[Message, ArchivedMessage]] = Message) \
+    -> Query:
+    '''
+    Loads the email recipients of every message returned by query, a query of
+    model, with one extra SELECT ... WHERE MessageId IN (...), instead of one
+    SELECT per message.
+    '''
+    return query.options(selectinload(model.email_recipients))
+
+
+def load_for_single(query: Query, model: Type[Union[Message, ArchivedMessage]] = Message) \
+    -> Query:
+    '''
+    Loads the email recipients of the message returned by query, a query of
+    model, in the same SELECT with a JOIN. Use for queries that return a
+    single message.
+    '''
+    return query.options(joinedload(model.email_recipients))
@@ -0,0 +1,152 @@
+"""
+Helpers for Alembic migrations that change the MIBS tables while MIBS serves
+traffic, see migrations/README
+"""
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+logger = logging.getLogger(__name__)
+
+# The defaults of the -x arguments that tune online migrations, e.g.
+# alembic -x lock_timeout=5000 -x backfill_batch_size=5000 upgrade head
+# the longest a migration waits for a table lock in milliseconds, on Postgres
+DEFAULT_LOCK_TIMEOUT = 2000
+# the most rows a backfill updates in one transaction
+DEFAULT_BACKFILL_BATCH_SIZE = 1000
+# the seconds a backfill pauses between batches, so that it leaves room for traffic
+DEFAULT_BACKFILL_PAUSE = 0.05
+
+
+def _x_argument(name: str, default: float) -> float:
+    '''
+    Returns the -x argument name of the alembic command, or default if it is
+    not given or the migration does not run from the alembic command.
+    '''
+    environment = op.get_context().environment_context
+    if environment is None:
+        return default
+    return type(default)(environment.get_x_argument(as_dictionary=True).get(name, default))
+
+
+@contextmanager
+def lock_timeout(milliseconds: int = None) -> Iterator[None]:
+    '''
+    Fails the statements of the with block that wait longer than milliseconds
+    for a lock, the lock_timeout -x argument if None, instead of queueing
+    behind a long transaction. A statement waiting for an ACCESS EXCLUSIVE
+    lock, e.g. ALTER TABLE, blocks every query of the table that comes after
+    it, so waiting is worse than failing the migration and running it again.
+    Only Postgres has lock timeouts.
+
+    Preconditions:
+        milliseconds is None or milliseconds > 0
+    '''
+    if milliseconds is None:
+        milliseconds = _x_argument('lock_timeout', DEFAULT_LOCK_TIMEOUT)
+    assert milliseconds > 0
+
+    if op.get_context().dialect.name != 'postgresql':
+        yield
+        return
+    op.execute(f'SET lock_timeout = {int(milliseconds)}')
+    yield
+    # a failed statement rolls the SET back with the transaction
+    op.execute('RESET lock_timeout')
+
+
+def create_index_concurrently(index_name: str, table_name: str, columns: Sequence[str],
+    **kw: Any):
+    '''
+    Creates an index without blocking writes to the table while it is built.
+
+    On Postgres the index is built with CREATE INDEX CONCURRENTLY, outside of
+    the migration's transaction, which commits the statements of the migration
+    before it. An invalid index left behind by a failed earlier build is dropped
+    first. Other databases create the index like op.create_index.
+    '''
+    if op.get_context().dialect.name != 'postgresql':
+        op.create_index(index_name, table_name, columns, **kw)
+        return
+
+    with op.get_context().autocommit_block():
+        if not op.get_context().as_sql and op.get_bind().execute(sa.text(
+            'SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid '
+            'WHERE pg_class.relname = :name AND NOT pg_index.indisvalid'),
+            {'name': index_name}).first() is not None:
+            op.drop_index(index_name, table_name=table_name, postgresql_concurrently=True)
+        op.create_index(index_name, table_name, columns, postgresql_concurrently=True, **kw)
+
+
+def drop_index_concurrently(index_name: str, table_name: str):
+    '''
+    Drops an index without blocking queries of the table on Postgres, like
+    op.drop_index elsewhere.
+    '''
+    if op.get_context().dialect.name != 'postgresql':
+        op.drop_index(index_name, table_name=table_name)
+        return
+
+    with op.get_context().autocommit_block():
+        op.drop_index(index_name, table_name=table_name, postgresql_concurrently=True)
+
+
+def backfill(table_name: str, key: str, values: Dict[str, Any], where: str,
+    batch_size: int = None, pause: float = None) -> List[float]:
+    '''
+    Sets the columns of values in the rows of table_name that match the SQL
+    condition where, in batches of at most batch_size consecutive integer keys
+    that are each committed in their own transaction, pausing pause seconds
+    between batches. The rows of a batch are only locked while it runs, where
+    one UPDATE of the whole table would lock every row it changed until it
+    committed. batch_size and pause are the backfill_batch_size and
+    backfill_pause -x arguments if None.
+
+    The migration's transaction is committed first. The batches already
+    committed stay if a batch fails, so where must not match updated rows and
+    the migration can run again.
+
+    Returns:
+        the seconds each batch ran for, which is how long it held its row locks.
+        An offline migration is a single UPDATE, and returns no batches.
+
+    Preconditions:
+        key is an integer column, batch_size > 0 and pause >= 0
+    '''
+    if batch_size is None:
+        batch_size = _x_argument('backfill_batch_size', DEFAULT_BACKFILL_BATCH_SIZE)
+    if pause is None:
+        pause = _x_argument('backfill_pause', DEFAULT_BACKFILL_PAUSE)
+    assert batch_size > 0
+    assert pause >= 0
+
+    table = sa.table(table_name, sa.column(key), *[sa.column(column) for column in values])
+    update = table.update().where(sa.text(where)).values(values)
+    if op.get_context().as_sql:
+        op.execute(update)
+        return []
+
+    durations = []
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        first, last = bind.execute(
+            sa.select(sa.func.min(table.c[key]), sa.func.max(table.c[key]))
+            .where(sa.text(where))).first()
+        start = first
+        while start is not None and start <= last:
+            began = time.perf_counter()
+            bind.execute(update.where(table.c[key] >= start)
+                .where(table.c[key] < start + batch_size))
+            durations.append(time.perf_counter() - began)
+            start += batch_size
+            if start <= last:
+                time.sleep(pause)
+
+    if len(durations) > 0:
+        logger.info('Backfilled %s in %d batches, the longest held its locks for %.1f ms',
+            table_name, len(durations), max(durations) * 1000)
+    return durations
@@ -0,0 +1,245 @@
+"""
+User scoped access to messages in a bottle
+"""
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Sequence, Type, Union
+
+from sqlalchemy.orm import Query
+
+from models import ArchivedMessage, EmailMessageRecipient, IdempotencyKey, Message, db
+from models.loading import load_for_list, load_for_single
+
+
+class MessageRepository(object):
+    '''
+    The messages in a bottle of one user. Every query starts from the user's
+    rows, filtered by the leading userId column of ix_Message_userId_messageId,
+    so no method reads or changes the messages of another user and the cost of
+    a query depends on the user's messages, not on every message.
+
+    Changes are added to the session of db, committing them is up to the caller.
+
+    With archived=True the read methods, query, get, after,
+    last_message_id_of_page and page, read the user's sent messages that
+    models.archive moved to ArchivedMessage instead, which are read only.
+
+    Attributes:
+        user_id: The id of the user whose messages are accessed
+        model: Message, or ArchivedMessage if the archived messages are read
+    '''
+    def __init__(self, user_id: str, archived: bool = False):
+        '''
+        Preconditions:
+            user_id is a non empty string
+        '''
+        assert isinstance(user_id, str)
+        assert user_id != ''
+
+        self.user_id = user_id
+        self.model: Type[Union[Message, ArchivedMessage]] = \
+            ArchivedMessage if archived else Message
+
+    def query(self) -> Query:
+        '''
+        Returns a query for all of the user's messages.
+        '''
+        return self.model.query.filter(self.model.user_id == self.user_id)
+
+    def get(self, message_id: int) -> Union[Message, ArchivedMessage, None]:
+        '''
+        Returns the user's message with message_id and its recipients, or None
+        if the user has no such message.
+        '''
+        return load_for_single(self.query(), self.model) \
+            .filter(self.model.message_id == message_id).first()
+
+    def after(self, after: Union[int, None]) -> Query:
+        '''
+        Returns a query for the user's messages with a messageId greater than
+        after, or all of them if after is None, in messageId order.
+        '''
+        query = self.query()
+        if after is not None:
+            query = query.filter(self.model.message_id > after)
+        return query.order_by(self.model.message_id)
+
+    def last_message_id_of_page(self, after: Union[int, None], limit: int) -> Union[int, None]:
+        '''
+        Returns the messageId of the last message of the page of limit messages
+        after the messageId after, or None if there are no messages after that
+        page.
+
+        Preconditions:
+            limit >= 1
+        '''
+        assert limit >= 1
+
+        message_ids = self.after(after) \
+            .with_entities(self.model.message_id) \
+            .offset(limit - 1).limit(2).all()
+        return message_ids[0].message_id if len(message_ids) == 2 else None
+
+    def page(self, after: Union[int, None], until: Union[int, None], limit: int) \
+        -> List[Union[Message, ArchivedMessage]]:
+        '''
+        Returns at most limit of the user's messages with a messageId greater
+        than after and at most until, in messageId order, with the recipients
+        of the page loaded in one query.
+        '''
+        query = load_for_list(self.after(after), self.model)
+        if until is not None:
+            query = query.filter(self.model.message_id <= until)
+        return query.limit(limit).all()
+
+    def add(self, mib) -> Message:
+        '''
+        Adds a new message of the user with a recipient for each of its emails.
+        mib has the message, send_time and emails of the new message, e.g. an
+        api.validation.ParsedMib.
+        '''
+        message = Message(
+            user_id=self.user_id,
+            message=mib.message,
+            send_time=mib.send_time,
+            email_recipients=[EmailMessageRecipient(email=email) for email in mib.emails],
+        )
+        db.session.add(message)
+        return message
+
+    def update(self, message: Message, mib) -> None:
+        '''
+        Updates the user's message to the message, send_time and emails of mib.
+        Only the recipients whose emails were removed are deleted and only the
+        added emails are inserted, the other recipients keep their rows, and so
+        their messageSendRequestId and send state, however their emails are
+        ordered in mib. Duplicate emails are matched one recipient each.
+
+        The version of the message is incremented, committing raises
+        sqlalchemy.orm.exc.StaleDataError if the message no longer has the
+        version it was loaded with.
+
+        Preconditions:
+            message is one of the user's messages, e.g. returned by get
+        '''
+        assert message.user_id == self.user_id
+
+        message.message = mib.message
+        message.send_time = mib.send_time
+
+        unmatched = Counter(mib.emails)
+        kept = []
+        for recipient in message.email_recipients:
+            if unmatched[recipient.email] > 0:
+                unmatched[recipient.email] -= 1
+                kept.append(recipient)
+
+        added = []
+        for email in mib.emails:
+            if unmatched[email] > 0:
+                unmatched[email] -= 1
+                added.append(EmailMessageRecipient(email=email))
+
+        if len(added) > 0 or len(kept) < len(message.email_recipients):
+            # the delete-orphan cascade only deletes the recipients left out of kept
+            message.email_recipients = kept + added
+
+        # the UPDATE of the message checks the version it was loaded with
+        message.version = message.version + 1
+
+    def patch(self, message_id: int, values: Dict[str, Any],
+        version: Union[int, None] = None) -> bool:
+        '''
+        Sets the columns of values, a dict of Message attributes, of the user's
+        message with message_id and increments its version, with a single
+        UPDATE that is only applied if the message has not been sent and, if
+        version is given, still has that version. Recipients are not loaded.
+        Returns whether the message was updated.
+
+        Preconditions:
+            values has at least one attribute
+            the repository does not read the archived messages
+        '''
+        assert len(values) > 0
+        assert self.model is Message
+
+        query = self.query().filter(Message.message_id == message_id,
+            Message.sent.is_(False), Message.last_sent_time.is_(None))
+        if version is not None:
+            query = query.filter(Message.version == version)
+        values = dict(values, version=Message.version + 1)
+        return query.update(values, synchronize_session=False) == 1
+
+    def add_many(self, mibs: Sequence) -> List[int]:
+        '''
+        Adds new messages of the user, see add, with one flush, which the ORM
+        batches into multi-row INSERTs where the database driver supports it,
+        and the recipients of all of them with a single executemany INSERT.
+        Returns the messageIds of the new messages, in the order of mibs.
+        '''
+        messages = [
+            Message(user_id=self.user_id, message=mib.message, send_time=mib.send_time)
+            for mib in mibs
+        ]
+        db.session.add_all(messages)
+        db.session.flush()
+        # read before the commit expires the messages, which would reload them one at a time
+        message_ids = [message.message_id for message in messages]
+
+        db.session.execute(EmailMessageRecipient.__table__.insert(), [
+            {'MessageId': message_id, 'email': email, 'sent': False}
+            for message_id, mib in zip(message_ids, mibs)
+            for email in mib.emails
+        ])
+        return message_ids
+
+    def delete(self, message_ids: Union[Sequence[int], None] = None) -> int:
+        '''
+        Deletes the user's messages with one of message_ids, or all of them if
+        message_ids is None, whether they are archived or not, with a single
+        DELETE statement per table. The recipients of the messages are deleted
+        by the database through the ON DELETE CASCADE of their foreign key.
+        Returns the number of messages deleted.
+        '''
+        deleted = 0
+        for model in (Message, ArchivedMessage):
+            query = model.query.filter(model.user_id == self.user_id)
+            if message_ids is not None:
+                query = query.filter(model.message_id.in_(message_ids))
+            deleted += query.delete(synchronize_session=False)
+        return deleted
+
+    def get_idempotency_key(self, key: str) -> Union[IdempotencyKey, None]:
+        '''
+        Returns the user's Idempotency-Key key, or None if the user has not
+        used it.
+        '''
+        return IdempotencyKey.query.get((self.user_id, key))
+
+    def add_idempotency_key(self, key: str, request_hash: str, message: Message,
+        created_at: datetime, expired: Union[IdempotencyKey, None] = None) -> IdempotencyKey:
+        '''
+        Adds the user's Idempotency-Key key of the request with request_hash that
+        created message, replacing the row expired of the key if it has expired.
+        The message is flushed to get its messageId.
+
+        Postconditions:
+            committing raises sqlalchemy.exc.IntegrityError if another
+            transaction added the key first, also if it replaced the same
+            expired row
+        '''
+        db.session.flush()
+        if expired is not None:
+            # the expired row is deleted and a new one inserted instead of updating it, so
+            # that of two retries that reuse the key concurrently, the one that commits
+            # second fails on the primary key. The delete only matches the row that expired,
+            # not a row that a concurrent retry inserted since.
+            IdempotencyKey.query.filter(IdempotencyKey.user_id == self.user_id,
+                IdempotencyKey.key == key,
+                IdempotencyKey.created_at == expired.created_at) \
+                .delete(synchronize_session=False)
+            db.session.expunge(expired)
+        row = IdempotencyKey(user_id=self.user_id, key=key, request_hash=request_hash,
+            message_id=message.message_id, created_at=created_at)
+        db.session.add(row)
+        return row
@@ -0,0 +1,82 @@
+"""
+Routing of read only statements to read replicas of the MIBS database
+"""
+import random
+from contextlib import contextmanager
+from typing import Iterator, List
+
+from flask import Flask, current_app, has_app_context
+from flask_sqlalchemy import SignallingSession, SQLAlchemy, get_state
+from sqlalchemy import orm
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.dml import UpdateBase
+
+# SQLALCHEMY_BINDS keys of read replicas start with this, e.g. replica_0
+REPLICA_BIND_PREFIX = 'replica'
+# the Session.info key of the replica engine the session reads from
+_READ_REPLICA = 'read_replica'
+
+
+class RoutingSession(SignallingSession):
+    '''
+    A session that runs the statements of read_replica blocks on a read
+    replica. Flushes and INSERT, UPDATE and DELETE statements always run on
+    the primary database.
+    '''
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get(_READ_REPLICA, None)
+        if replica is not None and not self._flushing and not isinstance(clause, UpdateBase):
+            return replica
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    '''
+    Flask-SQLAlchemy with RoutingSession sessions.
+    '''
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def replica_engines(app: Flask) -> List[Engine]:
+    '''
+    Returns the engines of the read replica binds of app, see REPLICA_BIND_PREFIX.
+    '''
+    binds = app.config.get('SQLALCHEMY_BINDS', None) or {}
+    db = get_state(app).db
+    return [db.get_engine(app, bind=key) for key in sorted(binds)
+        if key.startswith(REPLICA_BIND_PREFIX)]
+
+
+def use_read_replica(session) -> bool:
+    '''
+    Runs the statements session executes from now on on a random read
+    replica of the current app, or on the primary database if it has none
+    or there is no app context.
+    Returns whether a replica is used. Replicas lag behind the primary, so
+    only sessions whose statements tolerate stale rows should use one, e.g.
+    the session of a read only request.
+
+    Preconditions:
+        session is a RoutingSession, or a scoped session of them
+    '''
+    if not has_app_context():
+        return False
+    replicas = replica_engines(current_app)
+    if len(replicas) == 0:
+        return False
+    session.info[_READ_REPLICA] = random.choice(replicas)
+    return True
+
+
+@contextmanager
+def read_replica(session) -> Iterator[bool]:
+    '''
+    Runs the statements session executes in the with block on a random read
+    replica, see use_read_replica, and yields whether a replica is used.
+    '''
+    previous = session.info.get(_READ_REPLICA, None)
+    try:
+        yield use_read_replica(session)
+    finally:
+        session.info[_READ_REPLICA] = previous
@@ -4,14 +4,34 @@
 
 import unittest
 
+import json
 import re
+import shutil
+import tempfile
+import threading
+import time
+import jwt
+from contextlib import contextmanager
+from unittest.mock import patch
 from urllib.parse import urlparse, parse_qs
 from dateutil.parser import parse as datetimeParse
 from datetime import  datetime
-from api.mibs import mibs_blueprint, delete_mibs_for_user, TEMP_USER_ID
-from models import Message, EmailMessageRecipient, db
+from api.mibs import mibs_blueprint, delete_mibs_for_user, MAX_PAGE_LIMIT, \
+    STREAM_PAGE_SIZE, MAX_DELETE_MESSAGE_IDS, MAX_BATCH_SIZE, MAX_IDEMPOTENCY_KEY_LENGTH, \
+    IDEMPOTENCY_KEY_TTL, DEFAULT_REPLICA_STICKY_SECONDS, READ_PRIMARY_COOKIE
+from auth import Authenticator
+from dispatcher import DeliveryBackend, Dispatcher
+from models import ArchivedEmailMessageRecipient, IdempotencyKey, Message, \
+    EmailMessageRecipient, db
+from models.archive import archive_sent_messages
+from models.repository import MessageRepository
 from flask import Flask
 from http import HTTPStatus
+from jwt.algorithms import RSAAlgorithm
+from cryptography.hazmat.primitives.asymmetric import rsa
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
 
 test_email = 'test@email.com'
 test_user_id = 'temp-user-id'
@@ -19,6 +39,43 @@ test_other_user = 'other_user'
 test_message_id = 1
 test_message_id2 = 2
 
+# signs the access tokens of the test requests
+signing_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+test_jwks = {'keys': [
+    dict(json.loads(RSAAlgorithm.to_jwk(signing_key.public_key())), kid='test-key', use='sig')
+]}
+
+
+def create_access_token(user_id: str) -> str:
+    '''
+    Creates an access token for user_id that the test app accepts.
+    '''
+    return jwt.encode({
+        'iss': 'test_issuer',
+        'aud': 'test',
+        'sub': user_id,
+        'exp': int(time.time()) + 3600,
+    }, signing_key, algorithm='RS256', headers={'kid': 'test-key'})
+
+
+@contextmanager
+def count_queries(engine):
+    '''
+    Counts the SQL statements executed on engine inside a with statement. The
+    yielded list holds the executed statements.
+    '''
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # pylint: disable=unused-argument,too-many-arguments
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
 
 class TestMibsApi(unittest.TestCase):
     '''
@@ -26,7 +83,13 @@ class TestMibsApi(unittest.TestCase):
     '''
     def setUp(self):
         self.app = Flask(__name__)
-        self.app.config['TESTING'] = True
+        self.app.config.update({
+            'TESTING': True,
+            'AUTH_ISSUER': 'test_issuer',
+            'AUTH_AUDIENCE': 'test',
+            'AUTH_JWKS': test_jwks,
+        })
+        Authenticator(self.app)
         db.init_app(self.app)
         with self.app.app_context():
             db.create_all()
@@ -34,6 +97,8 @@ class TestMibsApi(unittest.TestCase):
         self.app.register_blueprint(mibs_blueprint)
 
         self.client = self.app.test_client()
+        self.client.environ_base['HTTP_AUTHORIZATION'] = \
+            'Bearer ' + create_access_token(test_user_id)
 
         self.test_post_message = {
             'message': 'test message',
@@ -62,6 +127,341 @@ class TestMibsApi(unittest.TestCase):
             db.drop_all()
 
 
+    def test_requires_access_token(self):
+        '''
+        Test that every /mibs endpoint requires a valid access token
+        '''
+        self.create_message()
+        for method, url, body in [
+            ('GET', '/mibs', None),
+            ('POST', '/mibs', self.test_post_message),
+            ('POST', '/mibs/batch', [self.test_post_message]),
+            ('PUT', '/mibs', self.test_put_message),
+            ('DELETE', '/mibs', None),
+        ]:
+            for authorization in [None, 'Bearer not-a-token']:
+                with self.subTest(method=method, url=url, authorization=authorization):
+                    headers = {} if authorization is None else {'Authorization': authorization}
+                    response = self.client.open(url, method=method, json=body,
+                        environ_base={'HTTP_AUTHORIZATION': ''}, headers=headers)
+                    self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+        self.assertEqual(1, self.get_num_user_messages(test_user_id))
+
+    def test_user_of_access_token(self):
+        '''
+        Test that the mibs of a request are those of the user of its access token
+        '''
+        self.create_message(user_id=test_other_user)
+        self.client.environ_base['HTTP_AUTHORIZATION'] = \
+            'Bearer ' + create_access_token(test_other_user)
+
+        response = self.client.get('/mibs')
+        self.assertEqual([mib['messageId'] for mib in response.get_json()], [test_message_id])
+
+        response = self.client.post('/mibs', json=self.test_post_message)
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertEqual(2, self.get_num_user_messages(test_other_user))
+        self.assertEqual(0, self.get_num_user_messages(test_user_id))
+
+    def test_get_no_mibs(self):
+        '''
+        Test GET /mibs when the user has no mibs
+        '''
+        self.create_message(user_id=test_other_user)
+
+        response = self.client.get('/mibs')
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertEqual(response.get_json(), [])
+        self.assertNotIn('Link', response.headers)
+
+    def test_get_all(self):
+        '''
+        Test GET /mibs returns all of the user's mibs, with their recipients, in messageId order
+        '''
+        self.create_message(message_id=test_message_id2,
+            send_time=datetime(2021, 10, 27, 23, 22, 19, 911000))
+        self.create_message(message_id=test_message_id)
+        self.create_message(message_id=3, user_id=test_other_user)
+        self.create_email_recipient(message_send_request_id=1, message_id=test_message_id2,
+            email='a@email.com')
+        self.create_email_recipient(message_send_request_id=2, message_id=test_message_id2,
+            email='b@email.com')
+
+        response = self.client.get('/mibs')
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertTrue(response.is_streamed)
+        messages = response.get_json()
+        self.assertEqual([message['messageId'] for message in messages],
+            [test_message_id, test_message_id2])
+        self.assertEqual(messages[0]['recipients'], [])
+        self.assertEqual(messages[1], {
+            'messageId': test_message_id2,
+            'message': 'test',
+            'recipients': [{'email': 'a@email.com'}, {'email': 'b@email.com'}],
+            'sendTime': '2021-10-27T23:22:19.911Z',
+            'version': 1,
+        })
+
+    def test_get_all_many_pages(self):
+        '''
+        Test GET /mibs returns every mib when the user has more than STREAM_PAGE_SIZE mibs
+        '''
+        count = STREAM_PAGE_SIZE * 2 + 1
+        with self.app.app_context():
+            db.session.add_all(
+                Message(message_id=message_id, user_id=test_user_id, message='test',
+                    send_time=datetime.now(),
+                    email_recipients=[EmailMessageRecipient(email=test_email)])
+                for message_id in range(1, count + 1))
+            db.session.commit()
+
+        messages = self.client.get('/mibs').get_json()
+
+        self.assertEqual([message['messageId'] for message in messages],
+            list(range(1, count + 1)))
+        self.assertTrue(all(message['recipients'] == [{'email': test_email}]
+            for message in messages))
+
+    def test_get_pages(self):
+        '''
+        Test GET /mibs with limit returns pages linked by the Link header
+        '''
+        for message_id in range(1, 6):
+            self.create_message(message_id=message_id)
+
+        pages = []
+        url = '/mibs?limit=2'
+        while url is not None:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            pages.append([message['messageId'] for message in response.get_json()])
+
+            url = None
+            if 'Link' in response.headers:
+                match = re.fullmatch(r'<(.*)>; rel="next"', response.headers['Link'])
+                url = match.group(1)
+
+        self.assertEqual(pages, [[1, 2], [3, 4], [5]])
+
+    def test_get_page_after(self):
+        '''
+        Test GET /mibs with after returns the mibs with a greater messageId
+        '''
+        for message_id in range(1, 4):
+            self.create_message(message_id=message_id)
+
+        response = self.client.get('/mibs?after=1&limit=2')
+
+        self.assertEqual([message['messageId'] for message in response.get_json()], [2, 3])
+        self.assertNotIn('Link', response.headers)
+
+    def test_get_invalid_limit(self):
+        '''
+        Test GET /mibs when limit is out of range or not an integer
+        '''
+        for limit in ['0', str(MAX_PAGE_LIMIT + 1), 'a']:
+            response = self.client.get(f'/mibs?limit={limit}')
+            self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_get_specific(self):
+        '''
+        Test GET /mibs with messageId returns a list of only that mib
+        '''
+        self.create_message()
+        self.create_message(message_id=test_message_id2)
+        self.create_email_recipient()
+
+        response = self.client.get(f'/mibs?messageId={test_message_id}')
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        messages = response.get_json()
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0]['messageId'], test_message_id)
+        self.assertEqual(messages[0]['recipients'], [{'email': test_email}])
+
+    def test_get_specific_other_user(self):
+        '''
+        Test GET /mibs with the messageId of another user's mib
+        '''
+        self.create_message(user_id=test_other_user)
+
+        response = self.client.get(f'/mibs?messageId={test_message_id}')
+
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        self.assertEqual(response.data, b'a message with messageId=1 could not be found')
+
+    def test_get_specific_invalid_message_id(self):
+        '''
+        Test GET /mibs when messageId is not an integer
+        '''
+        response = self.client.get('/mibs?messageId=a')
+
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertEqual(response.data, b'"messageId" is not an integer')
+
+    def archive_sent_messages(self, count):
+        '''
+        Helper function to insert count sent messages with a recipient and
+        archive them, then an unsent message with messageId count + 1
+        '''
+        with self.app.app_context():
+            db.session.add_all(
+                Message(message_id=message_id, user_id=test_user_id, message='sent',
+                    send_time=datetime(2021, 10, 1), sent=True,
+                    last_sent_time=datetime(2021, 10, 1),
+                    email_recipients=[EmailMessageRecipient(email=test_email, sent=True)])
+                for message_id in range(1, count + 1))
+            db.session.commit()
+            self.assertEqual(archive_sent_messages(db.session, datetime(2021, 11, 1)), count)
+        self.create_message(message_id=count + 1)
+
+    def test_get_archived(self):
+        '''
+        Test GET /mibs with archived=true returns the archived mibs instead, in linked pages
+        '''
+        self.archive_sent_messages(3)
+
+        response = self.client.get('/mibs')
+        self.assertEqual([message['messageId'] for message in response.get_json()], [4])
+
+        response = self.client.get('/mibs?archived=true')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        messages = response.get_json()
+        self.assertEqual([message['messageId'] for message in messages], [1, 2, 3])
+        self.assertEqual(messages[0]['recipients'], [{'email': test_email}])
+        self.assertEqual(messages[0]['sendTime'], '2021-10-01T00:00:00.000Z')
+
+        response = self.client.get('/mibs?archived=true&limit=2')
+        self.assertEqual(response.headers['Link'],
+            '</mibs?after=2&limit=2&archived=true>; rel="next"')
+
+        response = self.client.get('/mibs?archived=true&messageId=2')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.get_json()[0]['message'], 'sent')
+        for url in ['/mibs?archived=true&messageId=4', '/mibs?archived=false&messageId=2']:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, HTTPStatus.NOT_FOUND)
+
+    def test_get_invalid_archived(self):
+        '''
+        Test GET /mibs when archived is not a boolean
+        '''
+        response = self.client.get('/mibs?archived=yes')
+
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertEqual(response.data, b'"archived" must be true or false')
+
+    def test_delete_archived(self):
+        '''
+        Test DELETE /mibs deletes archived mibs too
+        '''
+        self.archive_sent_messages(3)
+
+        response = self.client.delete('/mibs?messageIds=2,4')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.headers['X-Deleted-Count'], '2')
+
+        response = self.client.get('/mibs?archived=true')
+        self.assertEqual([message['messageId'] for message in response.get_json()], [1, 3])
+
+        response = self.client.delete('/mibs')
+        self.assertEqual(response.headers['X-Deleted-Count'], '2')
+        with self.app.app_context():
+            self.assertEqual(ArchivedEmailMessageRecipient.query.count(), 0)
+
+    @contextmanager
+    def assert_query_count(self, expected):
+        '''
+        Asserts that the body of a with statement executes exactly expected SQL statements, so
+        that N+1 loading of recipients fails the test
+        '''
+        with self.app.app_context():
+            engine = db.engine
+        with count_queries(engine) as statements:
+            yield statements
+        self.assertEqual(len(statements), expected,
+            'unexpected number of SQL statements:\n' + '\n'.join(statements))
+
+    def create_messages_with_recipients(self, count, recipients_per_message=2):
+        '''
+        Helper function to insert count messages with recipients_per_message recipients each
+        '''
+        with self.app.app_context():
+            db.session.add_all(
+                Message(message_id=message_id, user_id=test_user_id, message='test',
+                    send_time=datetime.now(),
+                    email_recipients=[
+                        EmailMessageRecipient(email=f'{index}@email.com')
+                        for index in range(recipients_per_message)
+                    ])
+                for message_id in range(1, count + 1))
+            db.session.commit()
+
+    def test_get_all_recipients_loaded_in_one_query(self):
+        '''
+        Test GET /mibs loads the recipients of all mibs with one query, not one query per mib
+        '''
+        self.create_messages_with_recipients(50)
+
+        with self.assert_query_count(2):
+            messages = self.client.get('/mibs').get_json()
+
+        self.assertEqual(len(messages), 50)
+        self.assertTrue(all(len(message['recipients']) == 2 for message in messages))
+
+    def test_get_many_pages_recipients_loaded_per_page(self):
+        '''
+        Test GET /mibs streaming more than STREAM_PAGE_SIZE mibs uses one query for the mibs
+        and one for their recipients per page
+        '''
+        self.create_messages_with_recipients(STREAM_PAGE_SIZE * 2 + 1)
+
+        with self.assert_query_count(6):
+            messages = self.client.get('/mibs').get_json()
+
+        self.assertEqual(len(messages), STREAM_PAGE_SIZE * 2 + 1)
+        self.assertTrue(all(len(message['recipients']) == 2 for message in messages))
+
+    def test_get_archived_recipients_loaded_in_one_query(self):
+        '''
+        Test GET /mibs with archived=true loads the recipients of all archived mibs with one
+        query
+        '''
+        self.archive_sent_messages(20)
+
+        with self.assert_query_count(2):
+            messages = self.client.get('/mibs?archived=true').get_json()
+
+        self.assertEqual(len(messages), 20)
+        self.assertTrue(all(message['recipients'] == [{'email': test_email}]
+            for message in messages))
+
+    def test_get_page_recipients_loaded_in_one_query(self):
+        '''
+        Test GET /mibs with limit uses one query for the next page, one for the mibs and one for
+        their recipients
+        '''
+        self.create_messages_with_recipients(50)
+
+        with self.assert_query_count(3):
+            messages = self.client.get('/mibs?limit=20').get_json()
+
+        self.assertEqual(len(messages), 20)
+
+    def test_get_specific_one_query(self):
+        '''
+        Test GET /mibs with messageId loads the mib and its recipients with one query
+        '''
+        self.create_messages_with_recipients(2)
+
+        with self.assert_query_count(1):
+            messages = self.client.get(f'/mibs?messageId={test_message_id}').get_json()
+
+        self.assertEqual(len(messages[0]['recipients']), 2)
+
     def test_post_not_json(self):
         '''
         Test POST /mibs when content type is not application/json
@@ -176,6 +576,8 @@ class TestMibsApi(unittest.TestCase):
         self.assertIn('Location', response.headers)
         self.assertRegex(response.headers['Location'], re.compile(r'^.*/mibs\?messageId=\d+$'))
         self.assertEqual(response.data, b'MessageInABottle was successfully created')
+        # without read replicas every read is from the primary
+        self.assertNotIn('Set-Cookie', response.headers)
 
         message_id = int(parse_qs(urlparse(response.headers['Location']).query)['messageId'][0])
 
@@ -183,7 +585,7 @@ class TestMibsApi(unittest.TestCase):
             message = Message.query.get(message_id)
 
             self.assertEqual(message.message_id, message_id)
-            self.assertEqual(message.user_id, TEMP_USER_ID)
+            self.assertEqual(message.user_id, test_user_id)
             self.assertEqual(message.message, self.test_post_message['message'])
             self.assertFalse(message.sent)
             self.assertIsNone(message.last_sent_time)
@@ -225,6 +627,216 @@ class TestMibsApi(unittest.TestCase):
                 self.test_post_message['recipients'][1]['email'])
             self.assertFalse(message.email_recipients[1].sent)
 
+    def test_post_idempotency_key(self):
+        '''
+        Test that retries of POST /mibs with the same Idempotency-Key return the original
+        message without touching the message tables
+        '''
+        headers = {'Idempotency-Key': 'test-key'}
+        response = self.client.post('/mibs', json=self.test_post_message, headers=headers)
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertNotIn('Idempotent-Replayed', response.headers)
+        location = response.headers['Location']
+
+        reordered = dict(reversed(list(self.test_post_message.items())))
+        with self.assert_query_count(1) as statements:
+            response = self.client.post('/mibs', json=reordered, headers=headers)
+        self.assertNotIn('"Message"', statements[0])
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertEqual(response.headers['Location'], location)
+        self.assertEqual(response.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(1, self.get_num_user_messages())
+
+        response = self.client.post('/mibs', json=self.test_post_message,
+            headers={'Idempotency-Key': 'other-key'})
+        self.assertNotEqual(response.headers['Location'], location)
+        self.assertEqual(2, self.get_num_user_messages())
+
+    def test_post_idempotency_key_different_request(self):
+        '''
+        Test that an Idempotency-Key cannot be reused for a different request
+        '''
+        headers = {'Idempotency-Key': 'test-key'}
+        self.client.post('/mibs', json=self.test_post_message, headers=headers)
+
+        changed = dict(self.test_post_message, message='changed')
+        response = self.client.post('/mibs', json=changed, headers=headers)
+        self.assertEqual(response.status_code, HTTPStatus.UNPROCESSABLE_ENTITY)
+        self.assertEqual(1, self.get_num_user_messages())
+
+    def test_post_idempotency_key_per_user(self):
+        '''
+        Test that users have their own Idempotency-Keys
+        '''
+        headers = {'Idempotency-Key': 'test-key'}
+        self.client.post('/mibs', json=self.test_post_message, headers=headers)
+
+        self.client.environ_base['HTTP_AUTHORIZATION'] = \
+            'Bearer ' + create_access_token(test_other_user)
+        response = self.client.post('/mibs', json=self.test_post_message, headers=headers)
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertNotIn('Idempotent-Replayed', response.headers)
+        self.assertEqual(1, self.get_num_user_messages(test_other_user))
+
+    def test_post_idempotency_key_expired(self):
+        '''
+        Test that an expired Idempotency-Key creates a new message
+        '''
+        headers = {'Idempotency-Key': 'test-key'}
+        self.client.post('/mibs', json=self.test_post_message, headers=headers)
+        with self.app.app_context():
+            used_key = IdempotencyKey.query.one()
+            used_key.created_at -= IDEMPOTENCY_KEY_TTL
+            db.session.commit()
+
+        response = self.client.post('/mibs', json=self.test_post_message, headers=headers)
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertNotIn('Idempotent-Replayed', response.headers)
+        self.assertEqual(2, self.get_num_user_messages())
+        with self.app.app_context():
+            self.assertEqual(IdempotencyKey.query.count(), 1)
+
+    def test_post_idempotency_key_invalid(self):
+        '''
+        Test that an Idempotency-Key must not be empty or too long
+        '''
+        for key in ['', 'k' * (MAX_IDEMPOTENCY_KEY_LENGTH + 1)]:
+            with self.subTest(length=len(key)):
+                response = self.client.post('/mibs', json=self.test_post_message,
+                    headers={'Idempotency-Key': key})
+                self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertEqual(0, self.get_num_user_messages())
+
+    def test_post_idempotency_key_committed_concurrently(self):
+        '''
+        Test that a request whose Idempotency-Key is committed by a concurrent retry
+        after it looked the key up returns the message of the retry
+        '''
+        headers = {'Idempotency-Key': 'test-key'}
+        response = self.client.post('/mibs', json=self.test_post_message, headers=headers)
+        location = response.headers['Location']
+
+        lookup = MessageRepository.get_idempotency_key
+        lookups = []
+        def missed_first_lookup(repository, key):
+            lookups.append(key)
+            return None if len(lookups) == 1 else lookup(repository, key)
+
+        with patch.object(MessageRepository, 'get_idempotency_key', missed_first_lookup):
+            response = self.client.post('/mibs', json=self.test_post_message, headers=headers)
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertEqual(response.headers['Location'], location)
+        self.assertEqual(response.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(1, self.get_num_user_messages())
+
+    def test_post_idempotency_key_expired_reused_concurrently(self):
+        '''
+        Test that of two retries that reuse an expired Idempotency-Key concurrently, the
+        second returns the message of the first instead of creating another one
+        '''
+        headers = {'Idempotency-Key': 'test-key'}
+        self.client.post('/mibs', json=self.test_post_message, headers=headers)
+        with self.app.app_context():
+            used_key = IdempotencyKey.query.one()
+            used_key.created_at -= IDEMPOTENCY_KEY_TTL
+            expired_at = used_key.created_at
+            db.session.commit()
+        location = self.client.post('/mibs', json=self.test_post_message,
+            headers=headers).headers['Location']
+
+        lookup = MessageRepository.get_idempotency_key
+        lookups = []
+        def read_before_concurrent_retry(repository, key):
+            lookups.append(key)
+            used_key = lookup(repository, key)
+            if len(lookups) == 1:
+                set_committed_value(used_key, 'created_at', expired_at)
+            return used_key
+
+        with patch.object(MessageRepository, 'get_idempotency_key',
+            read_before_concurrent_retry):
+            response = self.client.post('/mibs', json=self.test_post_message, headers=headers)
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertEqual(response.headers['Location'], location)
+        self.assertEqual(response.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(2, self.get_num_user_messages())
+
+    def test_post_batch_success(self):
+        '''
+        Test POST /mibs/batch creates every message with its recipients and returns their
+        messageIds and locations in request order
+        '''
+        bodies = [
+            {
+                'message': f'test message {index}',
+                'recipients': [{'email': f'test{index}-{recipient}@email.com'}
+                    for recipient in range(index + 1)],
+                'sendTime': self.test_post_message['sendTime'],
+            }
+            for index in range(3)
+        ]
+        response = self.client.post('/mibs/batch', json=bodies)
+
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        results = response.get_json()
+        self.assertEqual(len(results), 3)
+
+        with self.app.app_context():
+            for body, result in zip(bodies, results):
+                self.assertRegex(result['location'],
+                    re.compile(rf'^.*/mibs\?messageId={result["messageId"]}$'))
+                message = Message.query.get(result['messageId'])
+
+                self.assertEqual(message.user_id, test_user_id)
+                self.assertEqual(message.message, body['message'])
+                self.assertFalse(message.sent)
+                self.assertIsNone(message.last_sent_time)
+                self.assertEqual(message.send_time,
+                    datetimeParse(body['sendTime']).replace(tzinfo=None))
+                self.assertEqual([recipient.email for recipient in message.email_recipients],
+                    [recipient['email'] for recipient in body['recipients']])
+                self.assertFalse(any(recipient.sent for recipient in message.email_recipients))
+
+    def test_post_batch_invalid_items(self):
+        '''
+        Test POST /mibs/batch reports every invalid item and creates no message when any item
+        is invalid
+        '''
+        missing_message = dict(self.test_post_message)
+        missing_message.pop('message')
+        bad_send_time = dict(self.test_post_message, sendTime='tomorrow at noon')
+        response = self.client.post('/mibs/batch',
+            json=[self.test_post_message, missing_message, 'not a mib', bad_send_time])
+
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertEqual(response.get_json(), [
+            {'index': 1, 'error': '"message" missing from request body'},
+            {'index': 2, 'error': 'MessageInABottle is not a JSON object'},
+            {'index': 3, 'error': '"sendTime" is not an ISO-8601 UTC date time string'},
+        ])
+        self.assertEqual(0, self.get_num_user_messages())
+
+    def test_post_batch_bad_request_body(self):
+        '''
+        Test POST /mibs/batch when the request body is not JSON, not an array, empty or too large
+        '''
+        size_error = f'Request body must have between 1 and {MAX_BATCH_SIZE} MessageInABottle'
+        for body, error in [
+            (self.test_post_message, 'Request body is not a JSON array'),
+            ([], size_error),
+            ([self.test_post_message] * (MAX_BATCH_SIZE + 1), size_error),
+        ]:
+            with self.subTest(error=error, size=len(body)):
+                response = self.client.post('/mibs/batch', json=body)
+                self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+                self.assertEqual(response.get_data(as_text=True), error)
+
+        response = self.client.post('/mibs/batch',
+            content_type='application/x-www-form-urlencoded', data='[]')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertEqual(response.data, b'Request is not JSON')
+        self.assertEqual(0, self.get_num_user_messages())
+
     def test_put_not_json(self):
         '''
         Test PUT /mibs when content type is not application/json
@@ -416,7 +1028,7 @@ class TestMibsApi(unittest.TestCase):
             message = Message.query.get(self.test_put_message['messageId'])
 
             self.assertEqual(message.message_id, self.test_put_message['messageId'])
-            self.assertEqual(message.user_id, TEMP_USER_ID)
+            self.assertEqual(message.user_id, test_user_id)
             self.assertEqual(message.message, self.test_put_message['message'])
             self.assertFalse(message.sent)
             self.assertIsNone(message.last_sent_time)
@@ -430,6 +1042,40 @@ class TestMibsApi(unittest.TestCase):
             self.assertFalse(message.email_recipients[0].sent)
             self.assertIsNone(message.email_recipients[0].send_attempt_time)
 
+    def test_put_keeps_unchanged_recipients(self):
+        '''
+        Test that PUT /mibs only deletes and inserts the recipients whose emails changed
+        '''
+        self.create_message()
+        with self.app.app_context():
+            db.session.add_all([EmailMessageRecipient(message_id=test_message_id,
+                email=f'{index}@email.com', send_attempt_time=datetime(2021, 11, 1))
+                for index in range(3)])
+            db.session.commit()
+            recipient_ids = {r.email: r.message_send_request_id
+                for r in EmailMessageRecipient.query}
+            engine = db.engine
+
+        self.test_put_message['recipients'] = [{'email': f'{index}@email.com'}
+            for index in range(3)]
+        with count_queries(engine) as statements:
+            response = self.client.put('/mibs', json=self.test_put_message)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertFalse([s for s in statements if 'INTO "EmailMessageRecipient"' in s
+            or 'DELETE FROM "EmailMessageRecipient"' in s])
+
+        self.test_put_message['recipients'][1] = {'email': 'new@email.com'}
+        response = self.client.put('/mibs', json=self.test_put_message)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+        with self.app.app_context():
+            recipients = Message.query.get(test_message_id).email_recipients
+            self.assertEqual([r.email for r in recipients],
+                ['0@email.com', '2@email.com', 'new@email.com'])
+            self.assertEqual([r.message_send_request_id for r in recipients[:2]],
+                [recipient_ids['0@email.com'], recipient_ids['2@email.com']])
+            self.assertEqual(recipients[0].send_attempt_time, datetime(2021, 11, 1))
+
     def test_put_success_add_recipients(self):
         '''
         Test POST /mibs when request is successful when adding a recipient
@@ -486,6 +1132,111 @@ class TestMibsApi(unittest.TestCase):
                 self.test_put_message['recipients'][0]['email'])
             self.assertFalse(message.email_recipients[0].sent)
 
+    def test_patch_success(self):
+        '''
+        Test PATCH /mibs updates only the patched fields with a single UPDATE
+        '''
+        self.create_message()
+        self.create_email_recipient()
+
+        with self.assert_query_count(1) as statements:
+            response = self.client.patch('/mibs?messageId=1',
+                content_type='application/merge-patch+json',
+                data=json.dumps({'sendTime': '2030-01-01T12:00:00.000Z'}))
+        self.assertTrue(statements[0].startswith('UPDATE "Message"'))
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.data, b'MessageInABottle was successfully updated')
+        self.assertNotIn('ETag', response.headers)
+
+        with self.app.app_context():
+            message = Message.query.get(test_message_id)
+            self.assertEqual(message.message, 'test')
+            self.assertEqual(message.send_time, datetime(2030, 1, 1, 12))
+            self.assertEqual(message.version, 2)
+            self.assertEqual([r.email for r in message.email_recipients], [test_email])
+
+    def test_patch_if_match(self):
+        '''
+        Test PATCH /mibs only applies a patch with an If-Match of the current version
+        '''
+        self.create_message()
+
+        response = self.client.patch('/mibs?messageId=1', json={'message': 'new'},
+            headers={'If-Match': '"1"'})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.headers['ETag'], '"2"')
+
+        response = self.client.patch('/mibs?messageId=1', json={'message': 'stale'},
+            headers={'If-Match': '"1"'})
+        self.assertEqual(response.status_code, HTTPStatus.PRECONDITION_FAILED)
+        self.assertEqual(response.data, b'the message has version 2')
+
+        response = self.client.patch('/mibs?messageId=1', json={'message': 'any'},
+            headers={'If-Match': '*'})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        with self.app.app_context():
+            self.assertEqual(Message.query.get(test_message_id).message, 'any')
+
+    def test_patch_empty(self):
+        '''
+        Test that an empty PATCH /mibs changes nothing
+        '''
+        self.create_message()
+
+        response = self.client.patch('/mibs?messageId=1', json={})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.headers['ETag'], '"1"')
+        with self.app.app_context():
+            self.assertEqual(Message.query.get(test_message_id).version, 1)
+
+    def test_patch_not_applied(self):
+        '''
+        Test PATCH /mibs of a message that is missing, another user's or already sent
+        '''
+        self.create_message(message_id=2, user_id=test_other_user)
+        with self.app.app_context():
+            db.session.add(Message(message_id=3, user_id=test_user_id, message='test',
+                send_time=datetime.now(), last_sent_time=datetime.now()))
+            db.session.commit()
+
+        for message_id, status, error in [
+            (1, HTTPStatus.NOT_FOUND, b'a message with messageId=1 could not be found'),
+            (2, HTTPStatus.NOT_FOUND, b'a message with messageId=2 could not be found'),
+            (3, HTTPStatus.BAD_REQUEST, b'message already sent'),
+        ]:
+            with self.subTest(message_id=message_id):
+                response = self.client.patch(f'/mibs?messageId={message_id}',
+                    json={'message': 'new'})
+                self.assertEqual(response.status_code, status)
+                self.assertEqual(response.data, error)
+        with self.app.app_context():
+            self.assertEqual(Message.query.filter(Message.message == 'new').count(), 0)
+
+    def test_patch_bad_request(self):
+        '''
+        Test PATCH /mibs with invalid query parameters, headers or bodies
+        '''
+        self.create_message()
+        for url, headers, body, error in [
+            ('/mibs', {}, {'message': 'new'}, '"messageId" missing from query parameters'),
+            ('/mibs?messageId=a', {}, {'message': 'new'}, '"messageId" is not an integer'),
+            ('/mibs?messageId=1', {'If-Match': '"1", "2"'}, {'message': 'new'},
+                '"If-Match" must be the version of the message'),
+            ('/mibs?messageId=1', {'If-Match': 'W/"1"'}, {'message': 'new'},
+                '"If-Match" must be the version of the message'),
+            ('/mibs?messageId=1', {}, {'recipients': []},
+                '"recipients" cannot be patched, use PUT /mibs'),
+        ]:
+            with self.subTest(url=url, headers=headers, body=body):
+                response = self.client.patch(url, json=body, headers=headers)
+                self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+                self.assertEqual(response.get_data(as_text=True), error)
+
+        response = self.client.patch('/mibs?messageId=1',
+            content_type='application/x-www-form-urlencoded', data='message=new')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertEqual(response.data, b'Request is not JSON')
+
     def test_delete_mibs_for_user_all_no_mibs(self):
         '''
         Test delete_mibs_for_user when its used to delete all mibs when the user has no mibs
@@ -674,6 +1425,94 @@ class TestMibsApi(unittest.TestCase):
             self.assertEqual(None, EmailMessageRecipient.query.get(1))
             self.assertEqual(None, EmailMessageRecipient.query.get(2))
 
+    def test_delete_mibs_for_user_returns_number_deleted(self):
+        '''
+        Test that delete_mibs_for_user returns the number of messages it deleted
+        '''
+        self.create_message()
+        self.create_message(message_id=test_message_id2)
+        self.create_message(message_id=3, user_id=test_other_user)
+        with self.app.app_context():
+            self.assertEqual(2, delete_mibs_for_user(test_user_id))
+            self.assertEqual(0, delete_mibs_for_user(test_user_id))
+        self.assertEqual(1, self.get_num_user_messages(test_other_user))
+
+    def test_delete_mibs_for_user_message_ids(self):
+        '''
+        Test delete_mibs_for_user when its used to delete several mibs, ignoring mibs of other
+        users and ids that do not exist
+        '''
+        self.create_message()
+        self.create_message(message_id=test_message_id2)
+        self.create_message(message_id=3)
+        self.create_message(message_id=4, user_id=test_other_user)
+        with self.app.app_context():
+            self.assertEqual(2, delete_mibs_for_user(test_user_id,
+                message_ids=[test_message_id, 3, 4, 5]))
+            self.assertIsNone(Message.query.get(test_message_id))
+            self.assertIsNotNone(Message.query.get(test_message_id2))
+            self.assertIsNone(Message.query.get(3))
+            self.assertIsNotNone(Message.query.get(4))
+
+    def test_delete_mibs_for_user_one_statement_per_table(self):
+        '''
+        Test that delete_mibs_for_user deletes messages and their recipients with a single
+        statement per table of messages, Message and ArchivedMessage, leaving the
+        recipients to the database cascade
+        '''
+        self.create_messages_with_recipients(5)
+        with self.app.app_context():
+            with self.assert_query_count(2):
+                self.assertEqual(5, delete_mibs_for_user(test_user_id))
+            self.assertEqual(0, EmailMessageRecipient.query.count())
+
+    def test_delete_message_ids(self):
+        '''
+        Test DELETE /mibs to delete several mibs
+        '''
+        self.create_message()
+        self.create_message(message_id=test_message_id2)
+        self.create_message(message_id=3)
+        with self.app.app_context():
+            response = self.client.delete(f'/mibs?messageIds={test_message_id},3,7')
+        self.assertEqual(HTTPStatus.OK, response.status_code)
+        self.assertEqual('Successfully deleted 2 mibs', response.get_data(as_text=True))
+        self.assertEqual('2', response.headers['X-Deleted-Count'])
+        self.assertEqual(1, self.get_num_user_messages())
+
+    def test_delete_message_ids_no_mibs(self):
+        '''
+        Test DELETE /mibs to delete several mibs when the user has none of them
+        '''
+        self.create_message(user_id=test_other_user)
+        with self.app.app_context():
+            response = self.client.delete(f'/mibs?messageIds={test_message_id},2')
+        self.assertEqual(HTTPStatus.NOT_FOUND, response.status_code)
+        self.assertEqual('Failed to delete mibs: User does not have any mibs with the message ids',
+                         response.get_data(as_text=True))
+        self.assertEqual(1, self.get_num_user_messages(test_other_user))
+
+    def test_delete_bad_query_parameters(self):
+        '''
+        Test DELETE /mibs with query parameters that are not integers, too many messageIds or
+        both messageId and messageIds
+        '''
+        self.create_message()
+        too_many_ids = ','.join(str(message_id) for message_id in range(MAX_DELETE_MESSAGE_IDS + 1))
+        for query, error in [
+            ('messageId=one', '"messageId" is not an integer'),
+            ('messageIds=1,two', '"messageIds" is not a comma separated list of integers'),
+            ('messageIds=', f'"messageIds" must have between 1 and {MAX_DELETE_MESSAGE_IDS} ids'),
+            (f'messageIds={too_many_ids}',
+                f'"messageIds" must have between 1 and {MAX_DELETE_MESSAGE_IDS} ids'),
+            ('messageId=1&messageIds=1', '"messageId" and "messageIds" cannot both be present'),
+        ]:
+            with self.subTest(query=query):
+                response = self.client.delete(f'/mibs?{query}')
+                self.assertEqual(HTTPStatus.BAD_REQUEST, response.status_code)
+                self.assertEqual(error, response.get_data(as_text=True))
+        self.assertEqual(1, self.get_num_user_messages())
+
     def create_email_recipient(self,
         message_send_request_id=1,
         message_id=test_message_id,
@@ -713,5 +1552,275 @@ class TestMibsApi(unittest.TestCase):
             return db.session.query(Message).filter(Message.user_id == user_id).count()
 
 
+class DeliveredMessages(DeliveryBackend):
+    '''
+    Delivery backend that records the text of every message it delivers
+    '''
+    def __init__(self):
+        self.messages = {}
+
+    def deliver(self, messages, delivered=None):
+        self.messages.update((message.message_id, message.message) for message in messages)
+        return {recipient.recipient_id for message in messages for recipient in message.recipients}
+
+
+class TestConcurrentRequests(unittest.TestCase):
+    '''
+    /mibs tests with concurrent requests, which need a database file that
+    every request thread connects to
+    '''
+    num_requests = 8
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.app = Flask(__name__)
+        self.app.config.update({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{self.directory}/mibs.db',
+            # wait for the write lock of the other requests instead of failing
+            'SQLALCHEMY_ENGINE_OPTIONS': {'connect_args': {'timeout': 30}},
+            'AUTH_ISSUER': 'test_issuer',
+            'AUTH_AUDIENCE': 'test',
+            'AUTH_JWKS': test_jwks,
+        })
+        Authenticator(self.app)
+        db.init_app(self.app)
+        with self.app.app_context():
+            db.create_all()
+        self.app.register_blueprint(mibs_blueprint)
+        self.access_token = create_access_token(test_user_id)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        shutil.rmtree(self.directory)
+
+    def create_due_messages(self, count):
+        '''
+        Inserts count messages of the test user that are due, with one recipient each, and
+        returns their messageIds
+        '''
+        with self.app.app_context():
+            messages = [Message(user_id=test_user_id, message='original',
+                send_time=datetime(2021, 11, 1),
+                email_recipients=[EmailMessageRecipient(email=test_email)])
+                for _ in range(count)]
+            db.session.add_all(messages)
+            db.session.commit()
+            return [message.message_id for message in messages]
+
+    def put(self, client, message_id, message):
+        '''
+        PUT /mibs the message of message_id
+        '''
+        return client.put('/mibs', json={
+            'messageId': message_id,
+            'message': message,
+            'recipients': [{'email': test_email}],
+            'sendTime': '2021-11-01T00:00:00.000Z',
+        }, headers={'Authorization': 'Bearer ' + self.access_token})
+
+    def test_put_of_message_claimed_while_updating(self):
+        '''
+        Test that a PUT /mibs of a message that a dispatcher claims after the PUT loaded it
+        is a conflict and does not change the claimed message
+        '''
+        message_id, = self.create_due_messages(1)
+
+        def claim():
+            with self.app.app_context():
+                Dispatcher(db.session, DeliveredMessages()).claim(datetime(2021, 11, 2))
+                db.session.remove()
+
+        update = MessageRepository.update
+        def claimed_update(repository, message, mib):
+            # the dispatcher has its own session and connection in another thread
+            thread = threading.Thread(target=claim)
+            thread.start()
+            thread.join()
+            update(repository, message, mib)
+
+        with patch.object(MessageRepository, 'update', claimed_update):
+            response = self.put(self.app.test_client(), message_id, 'edited')
+        self.assertEqual(response.status_code, HTTPStatus.CONFLICT)
+
+        with self.app.app_context():
+            message = Message.query.get(message_id)
+            self.assertEqual(message.message, 'original')
+            self.assertIsNotNone(message.last_sent_time)
+            self.assertEqual(message.version, 2)
+
+    def test_concurrent_puts_and_dispatcher(self):
+        '''
+        Test that PUT /mibs requests racing a dispatcher never change a message after the
+        dispatcher loaded it to send it
+        '''
+        message_ids = self.create_due_messages(20)
+        backend = DeliveredMessages()
+        statuses = []
+
+        def edit(editor):
+            client = self.app.test_client()
+            for message_id in message_ids:
+                statuses.append(self.put(client, message_id, f'edit {editor}').status_code)
+
+        def dispatch():
+            with self.app.app_context():
+                dispatcher = Dispatcher(db.session, backend, batch_size=2)
+                while len(backend.messages) < len(message_ids):
+                    dispatcher.dispatch_batch()
+                db.session.remove()
+
+        threads = [threading.Thread(target=edit, args=(editor,))
+            for editor in range(self.num_requests - 1)]
+        threads.append(threading.Thread(target=dispatch))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertLessEqual(set(statuses),
+            {HTTPStatus.OK, HTTPStatus.BAD_REQUEST, HTTPStatus.CONFLICT})
+        with self.app.app_context():
+            for message in Message.query.all():
+                self.assertTrue(message.sent)
+                self.assertEqual(message.message, backend.messages[message.message_id])
+
+    def test_concurrent_duplicate_posts(self):
+        '''
+        Test that concurrent retries of a POST /mibs with the same Idempotency-Key
+        create a single message and all return it
+        '''
+        barrier = threading.Barrier(self.num_requests)
+        responses = []
+
+        def post():
+            client = self.app.test_client()
+            barrier.wait()
+            response = client.post('/mibs', json={
+                'message': 'test message',
+                'recipients': [{'email': test_email}],
+                'sendTime': '2021-10-27T23:22:19.911Z',
+            }, headers={
+                'Authorization': 'Bearer ' + self.access_token,
+                'Idempotency-Key': 'test-key',
+            })
+            responses.append(response)
+
+        threads = [threading.Thread(target=post) for _ in range(self.num_requests)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([r.status_code for r in responses],
+            [HTTPStatus.CREATED] * self.num_requests)
+        self.assertEqual(len({r.headers['Location'] for r in responses}), 1)
+        self.assertEqual(len([r for r in responses if 'Idempotent-Replayed' in r.headers]),
+            self.num_requests - 1)
+        with self.app.app_context():
+            self.assertEqual(Message.query.count(), 1)
+            self.assertEqual(EmailMessageRecipient.query.count(), 1)
+            self.assertEqual(IdempotencyKey.query.count(), 1)
+
+
+class TestReadReplicas(unittest.TestCase):
+    '''
+    /mibs tests with a primary and a read replica database file
+    '''
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.app = Flask(__name__)
+        self.app.config.update({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{self.directory}/primary.db',
+            'SQLALCHEMY_BINDS': {'replica_0': f'sqlite:///{self.directory}/replica.db'},
+            'AUTH_ISSUER': 'test_issuer',
+            'AUTH_AUDIENCE': 'test',
+            'AUTH_JWKS': test_jwks,
+        })
+        Authenticator(self.app)
+        db.init_app(self.app)
+        with self.app.app_context():
+            db.create_all()
+            self.replica = db.get_engine(self.app, bind='replica_0')
+            db.Model.metadata.create_all(self.replica)
+        self.app.register_blueprint(mibs_blueprint)
+
+        self.client = self.app.test_client()
+        self.client.environ_base['HTTP_AUTHORIZATION'] = \
+            'Bearer ' + create_access_token(test_user_id)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+            self.replica.dispose()
+        shutil.rmtree(self.directory)
+
+    def add_replica_message(self, text):
+        '''
+        Inserts a message of the test user with text into the replica only, like a write
+        the replica has but the primary lost, so that reads of the replica can be told apart
+        '''
+        with Session(self.replica) as session:
+            session.add(Message(user_id=test_user_id, message=text,
+                send_time=datetime(2021, 11, 1)))
+            session.commit()
+
+    def get_texts(self):
+        '''
+        GET /mibs and return the texts of the messages
+        '''
+        response = self.client.get('/mibs')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return [message['message'] for message in response.json]
+
+    def test_get_reads_replica(self):
+        '''
+        Test that GET /mibs reads the replica, including a message looked up by messageId
+        '''
+        self.add_replica_message('replica')
+        self.assertEqual(self.get_texts(), ['replica'])
+        response = self.client.get('/mibs?messageId=1')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.json[0]['message'], 'replica')
+
+    def test_get_after_write_reads_primary(self):
+        '''
+        Test that GET /mibs reads the primary right after a write of the user, and a
+        failed write does not change where it reads
+        '''
+        response = self.client.post('/mibs', json={'message': 'invalid'})
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertNotIn('Set-Cookie', response.headers)
+        self.assertEqual(self.get_texts(), [])
+
+        response = self.client.post('/mibs', json={
+            'message': 'primary',
+            'recipients': [{'email': test_email}],
+            'sendTime': '2021-10-27T23:22:19.911Z',
+        })
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        cookie = response.headers['Set-Cookie']
+        self.assertIn(f'{READ_PRIMARY_COOKIE}=', cookie)
+        self.assertIn('Path=/mibs', cookie)
+        self.assertIn('HttpOnly', cookie)
+        self.assertEqual(self.get_texts(), ['primary'])
+
+    def test_get_after_sticky_window_reads_replica(self):
+        '''
+        Test that GET /mibs reads the replica once the cookie of a write has expired,
+        and ignores cookies further in the future than the sticky window
+        '''
+        self.add_replica_message('replica')
+        now = time.time()
+        for until in [now - 1, now + DEFAULT_REPLICA_STICKY_SECONDS + 60, 'invalid']:
+            with self.subTest(until=until):
+                self.client.set_cookie('localhost', READ_PRIMARY_COOKIE, str(until), path='/mibs')
+                self.assertEqual(self.get_texts(), ['replica'])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,187 @@
+'''
+MessageInABottle request body validation unit tests
+'''
+
+import unittest
+
+from datetime import datetime
+from pathlib import Path
+import yaml
+from api.validation import ParsedMib, ParsedMibPatch, ValidationError, parse_date_time, \
+    parse_mib, parse_mib_patch
+
+# the openapi file is only in the repository, not in the docker image
+openapi_path = Path(__file__).resolve().parents[4] / 'tools' / 'api' / 'openapi.yml'
+
+
+class TestParseDateTime(unittest.TestCase):
+    '''
+    parse_date_time unit tests
+    '''
+    def test_valid(self):
+        '''
+        Test ISO-8601 date times are parsed to naive UTC datetimes
+        '''
+        for value, expected in [
+            ('2021-10-27T23:22:19.911Z', datetime(2021, 10, 27, 23, 22, 19, 911000)),
+            ('2021-10-27T23:22:19Z', datetime(2021, 10, 27, 23, 22, 19)),
+            ('2021-10-27t23:22z', datetime(2021, 10, 27, 23, 22)),
+            ('2021-10-27 23:22:19.123456789Z', datetime(2021, 10, 27, 23, 22, 19, 123456)),
+            ('2021-10-27T23:22:19.5', datetime(2021, 10, 27, 23, 22, 19, 500000)),
+            ('2021-10-27T23:22:19+05:30', datetime(2021, 10, 27, 17, 52, 19)),
+            ('2021-10-27T23:22:19-0100', datetime(2021, 10, 28, 0, 22, 19)),
+        ]:
+            with self.subTest(value=value):
+                self.assertEqual(parse_date_time(value), expected)
+
+    def test_invalid(self):
+        '''
+        Test that anything but an ISO-8601 date time string raises ValueError
+        '''
+        for value in ['2021-10-27T23:22:19.911Za', 'tomorrow at noon', '2021-10-27',
+            '2021-13-01T00:00:00Z', '2021-02-30T00:00:00Z', '2021-10-27T24:00:00Z', '', None,
+            1635376939]:
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    parse_date_time(value)
+
+
+class TestParseMib(unittest.TestCase):
+    '''
+    parse_mib unit tests
+    '''
+    def setUp(self):
+        self.body = {
+            'message': 'test message',
+            'recipients': [{'email': 'test1@email.com'}, {'email': 'test2@email.com'}],
+            'sendTime': '2021-10-27T23:22:19.911Z'
+        }
+
+    def assert_invalid(self, body, error, require_message_id=False):
+        '''
+        Asserts that parse_mib rejects body with error
+        '''
+        with self.assertRaises(ValidationError) as context:
+            parse_mib(body, require_message_id=require_message_id)
+        self.assertEqual(str(context.exception), error)
+
+    def test_valid(self):
+        '''
+        Test that a valid body is parsed into a ParsedMib
+        '''
+        self.assertEqual(parse_mib(self.body), ParsedMib(
+            message_id=None,
+            message='test message',
+            send_time=datetime(2021, 10, 27, 23, 22, 19, 911000),
+            emails=['test1@email.com', 'test2@email.com']))
+
+        self.body['messageId'] = 5
+        self.assertEqual(parse_mib(self.body, require_message_id=True).message_id, 5)
+
+    def test_message_id(self):
+        '''
+        Test that messageId must be present when required and must be an integer
+        '''
+        self.assert_invalid(self.body, '"messageId" missing from request body',
+            require_message_id=True)
+        for message_id in ['5', 5.5, True]:
+            with self.subTest(message_id=message_id):
+                self.body['messageId'] = message_id
+                self.assert_invalid(self.body, '"messageId" is not an integer')
+
+    def test_invalid(self):
+        '''
+        Test the reason given for each kind of invalid body
+        '''
+        for change, error in [
+            ({'message': None}, '"message" missing from request body'),
+            ({'message': 5}, '"message" is not a string'),
+            ({'recipients': None}, '"recipients" missing from request body'),
+            ({'recipients': {'email': 'test@email.com'}}, '"recipients" is not a JSON array'),
+            ({'recipients': []}, 'Must have atleast 1 recipient'),
+            ({'recipients': [{'email': 'test@email.com'}, {'phoneNumber': '555-5555'}]},
+                'Unknown recipient types: [{"phoneNumber": "555-5555"}]'),
+            ({'recipients': ['test@email.com']},
+                'Unknown recipient types: ["test@email.com"]'),
+            ({'recipients': [{'email': 'test@email.com\r\nBcc: evil@email.com'}]},
+                '"email" "test@email.com\\r\\nBcc: evil@email.com" contains a control character'),
+            ({'recipients': [{'email': 'test@email.com'}, {'email': 'test\x00@email.com'}]},
+                '"email" "test\\u0000@email.com" contains a control character'),
+            ({'recipients': [{'email': 'test@email.com\t'}]},
+                '"email" "test@email.com\\t" contains a control character'),
+            ({'sendTime': None}, '"sendTime" missing from request body'),
+            ({'sendTime': 'tomorrow'}, '"sendTime" is not an ISO-8601 UTC date time string'),
+        ]:
+            with self.subTest(change=change):
+                body = dict(self.body, **change)
+                for key, value in change.items():
+                    if value is None:
+                        body.pop(key)
+                self.assert_invalid(body, error)
+
+        self.assert_invalid([self.body], 'MessageInABottle is not a JSON object')
+
+    @unittest.skipUnless(openapi_path.exists(), 'openapi.yml is not available')
+    def test_matches_openapi_schema(self):
+        '''
+        Test that the MessageInABottle schema of the openapi file still has the properties and
+        types parse_mib validates
+        '''
+        with open(openapi_path, encoding='utf-8') as openapi_file:
+            schemas = yaml.safe_load(openapi_file)['components']['schemas']
+        properties = schemas['MessageInABottle']['properties']
+
+        self.assertEqual(set(properties),
+            {'messageId', 'message', 'recipients', 'sendTime', 'version'})
+        self.assertTrue(properties['version']['readOnly'])
+        self.assertEqual(properties['messageId']['type'], 'integer')
+        self.assertEqual(properties['message']['type'], 'string')
+        self.assertEqual(properties['recipients']['type'], 'array')
+        self.assertEqual(properties['sendTime']['format'], 'date-time')
+        self.assertLessEqual(set(schemas['MessageInABottle']['required']),
+            {'message', 'recipients'})
+        self.assertEqual(schemas['EmailRecipient']['properties'], {'email': {'type': 'string'}})
+
+        patch_properties = schemas['MessageInABottlePatch']['properties']
+        self.assertEqual(set(patch_properties), {'messageId', 'message', 'sendTime'})
+        self.assertFalse(schemas['MessageInABottlePatch']['additionalProperties'])
+
+
+class TestParseMibPatch(unittest.TestCase):
+    '''
+    parse_mib_patch unit tests
+    '''
+    def test_valid(self):
+        '''
+        Test that only the members present in a patch are changed
+        '''
+        for body, expected in [
+            ({}, ParsedMibPatch(message=None, send_time=None)),
+            ({'message': 'new'}, ParsedMibPatch(message='new', send_time=None)),
+            ({'messageId': 5, 'sendTime': '2021-10-27T23:22:19.911Z'},
+                ParsedMibPatch(message=None, send_time=datetime(2021, 10, 27, 23, 22, 19, 911000))),
+        ]:
+            with self.subTest(body=body):
+                self.assertEqual(parse_mib_patch(body, 5), expected)
+
+    def test_invalid(self):
+        '''
+        Test the reason given for each kind of invalid patch
+        '''
+        for body, error in [
+            ([], 'Merge patch is not a JSON object'),
+            ({'messageId': 6}, '"messageId" cannot be changed'),
+            ({'recipients': []}, '"recipients" cannot be patched, use PUT /mibs'),
+            ({'sent': True, 'version': 2}, 'Unknown members: ["sent", "version"]'),
+            ({'message': None}, '"message" is not a string'),
+            ({'message': 5}, '"message" is not a string'),
+            ({'sendTime': None}, '"sendTime" is not an ISO-8601 UTC date time string'),
+        ]:
+            with self.subTest(body=body):
+                with self.assertRaises(ValidationError) as context:
+                    parse_mib_patch(body, 5)
+                self.assertEqual(str(context.exception), error)
+
+
+if __name__ == '__main__':
+    unittest.main()
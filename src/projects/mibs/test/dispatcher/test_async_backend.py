@@ -0,0 +1,261 @@
+'''
+Asyncio SMTP backend unit tests
+'''
+
+import asyncio
+import time
+import unittest
+
+from datetime import datetime
+import aiosmtplib
+from dispatcher import AsyncSmtpBackend, DomainRateLimiter, OutgoingMessage, OutgoingRecipient
+
+test_sender = 'sender@email.com'
+
+
+class FakeSmtpServer:
+    '''
+    Records the transactions sent to it by FakeAsyncSmtp connections and the
+    maximum number of transactions that were in flight at once. send_effects are
+    used, in order, instead of accepting a transaction: an exception is raised and
+    a dict is returned as the refused recipients.
+    '''
+    def __init__(self, *send_effects):
+        self.send_effects = list(send_effects)
+        self.connections = 0
+        self.transactions = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def factory(self, **_options):
+        '''
+        Creates a connection to this server, used as the smtp_factory of the backend
+        '''
+        return FakeAsyncSmtp(self)
+
+
+class FakeAsyncSmtp:
+    '''
+    Fake aiosmtplib.SMTP connection to a FakeSmtpServer
+    '''
+    def __init__(self, server):
+        self.server = server
+
+    async def connect(self):
+        self.server.connections += 1
+
+    async def send_message(self, email, sender=None, recipients=None):
+        # pylint: disable=unused-argument
+        server = self.server
+        server.in_flight += 1
+        server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            await asyncio.sleep(0.001)
+        finally:
+            server.in_flight -= 1
+
+        effect = server.send_effects.pop(0) if server.send_effects else {}
+        if isinstance(effect, BaseException):
+            raise effect
+        server.transactions.append((sender, recipients))
+        return effect, 'OK'
+
+    async def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def create_message(message_id=1, emails=('test@email.com',)):
+    '''
+    Helper function to create an outgoing message
+    '''
+    return OutgoingMessage(
+        message_id=message_id,
+        user_id='temp-user-id',
+        message='test',
+        send_time=datetime.now(),
+        recipients=[
+            OutgoingRecipient(recipient_id=message_id * 100 + index, email=email)
+            for index, email in enumerate(emails)
+        ])
+
+
+class TestDomainRateLimiter(unittest.TestCase):
+    '''
+    DomainRateLimiter unit tests
+    '''
+    def setUp(self):
+        self.now = 0.0
+        self.limiter = DomainRateLimiter({'limited.com': 2}, clock=lambda: self.now)
+
+    def test_unlimited_domain(self):
+        '''
+        Test that a domain without a rate never waits
+        '''
+        for _ in range(100):
+            self.assertEqual(self.limiter.reserve('email.com'), 0)
+
+    def test_limited_domain(self):
+        '''
+        Test that a limited domain waits once its bucket is empty and refills over time
+        '''
+        self.assertEqual(self.limiter.reserve('limited.com'), 0)
+        self.assertEqual(self.limiter.reserve('limited.com'), 0)
+        self.assertAlmostEqual(self.limiter.reserve('limited.com'), 0.5)
+        self.assertAlmostEqual(self.limiter.reserve('limited.com'), 1.0)
+
+        self.now = 2.0
+        self.assertEqual(self.limiter.reserve('limited.com'), 0)
+
+    def test_default_rate(self):
+        '''
+        Test that default_rate limits domains without their own rate
+        '''
+        limiter = DomainRateLimiter(default_rate=1, clock=lambda: self.now)
+        self.assertEqual(limiter.reserve('email.com', 1), 0)
+        self.assertAlmostEqual(limiter.reserve('email.com', 2), 2.0)
+        self.assertEqual(limiter.reserve('other.com', 1), 0)
+
+
+class TestAsyncSmtpBackend(unittest.TestCase):
+    '''
+    AsyncSmtpBackend unit tests
+    '''
+    def create_backend(self, server, **options):
+        '''
+        Helper function to create a backend connected to server
+        '''
+        backend = AsyncSmtpBackend('localhost', 25, test_sender,
+            smtp_factory=server.factory, **options)
+        self.addCleanup(backend.close)
+        return backend
+
+    def test_deliver_one_transaction_per_domain(self):
+        '''
+        Test that the recipients of a message are sent to in one transaction per domain
+        '''
+        server = FakeSmtpServer()
+        backend = self.create_backend(server, concurrency=1)
+        message = create_message(emails=['a@one.com', 'b@two.com', 'c@one.com'])
+
+        self.assertEqual(backend.deliver([message]), {100, 101, 102})
+        self.assertEqual(server.transactions, [
+            (test_sender, ['a@one.com', 'c@one.com']),
+            (test_sender, ['b@two.com']),
+        ])
+
+    def test_deliver_max_recipients_per_message(self):
+        '''
+        Test that recipients at one domain beyond max_recipients_per_message are sent to in
+        another transaction
+        '''
+        server = FakeSmtpServer()
+        backend = self.create_backend(server, concurrency=1)
+        emails = [f'{index}@email.com' for index in range(250)] + ['a@other.com']
+        message = create_message(emails=emails)
+
+        self.assertEqual(len(backend.deliver([message])), 251)
+        self.assertEqual([recipients for _, recipients in server.transactions],
+            [emails[:100], emails[100:200], emails[200:250], ['a@other.com']])
+
+    def test_deliver_concurrency(self):
+        '''
+        Test that transactions are sent concurrently, but never more than concurrency at once
+        '''
+        server = FakeSmtpServer()
+        backend = self.create_backend(server, concurrency=5)
+        messages = [create_message(message_id=message_id) for message_id in range(1, 51)]
+
+        delivered = backend.deliver(messages)
+
+        self.assertEqual(delivered, {message_id * 100 for message_id in range(1, 51)})
+        self.assertEqual(server.max_in_flight, 5)
+        self.assertEqual(server.connections, 5)
+
+    def test_connections_reused_between_batches(self):
+        '''
+        Test that connections stay open between calls to deliver
+        '''
+        server = FakeSmtpServer()
+        backend = self.create_backend(server, concurrency=2)
+
+        backend.deliver([create_message(message_id=1), create_message(message_id=2)])
+        backend.deliver([create_message(message_id=3), create_message(message_id=4)])
+
+        self.assertEqual(server.connections, 2)
+        self.assertEqual(len(server.transactions), 4)
+
+    def test_deliver_refused_recipient(self):
+        '''
+        Test that a recipient refused by the server is not reported as delivered
+        '''
+        server = FakeSmtpServer({'b@email.com': 'No such user'})
+        backend = self.create_backend(server, concurrency=1)
+        message = create_message(emails=['a@email.com', 'b@email.com'])
+
+        self.assertEqual(backend.deliver([message]), {100})
+
+    def test_deliver_all_recipients_refused(self):
+        '''
+        Test that no recipient is delivered to when the server refuses all of them
+        '''
+        server = FakeSmtpServer(aiosmtplib.SMTPRecipientsRefused([]))
+        backend = self.create_backend(server, concurrency=1)
+
+        self.assertEqual(backend.deliver([create_message()]), set())
+        self.assertEqual(server.connections, 1)
+
+    def test_reconnect_on_disconnect(self):
+        '''
+        Test that a transaction is resent over a new connection when the server dropped the old
+        one
+        '''
+        server = FakeSmtpServer(aiosmtplib.SMTPServerDisconnected('dropped'))
+        backend = self.create_backend(server, concurrency=1)
+
+        self.assertEqual(backend.deliver([create_message()]), {100})
+        self.assertEqual(server.connections, 2)
+
+    def test_deliver_malformed_address(self):
+        '''
+        Test that messages with a malformed address are not delivered, and that the other
+        messages of the batch still are, over a reopened connection
+        '''
+        # like aiosmtplib, which refuses to send a command with a line break
+        server = FakeSmtpServer(ValueError('prohibited newline characters'))
+        backend = self.create_backend(server, concurrency=1)
+        messages = [
+            # the address is only sent in RCPT TO, not in the To header
+            create_message(message_id=1,
+                emails=['a@email.com', 'b@email.com\r\nBcc: evil@email.com']),
+            create_message(message_id=2),
+            create_message(message_id=3, emails=['c@email.com\r\nBcc: evil@email.com']),
+        ]
+
+        with self.assertLogs('dispatcher.async_backend', 'ERROR') as logs:
+            self.assertEqual(backend.deliver(messages), {200})
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(server.transactions, [(test_sender, ['test@email.com'])])
+        self.assertEqual(server.connections, 2)
+
+    def test_rate_limited_domain(self):
+        '''
+        Test that the rate limit of a domain delays sends to it
+        '''
+        server = FakeSmtpServer()
+        limiter = DomainRateLimiter({'limited.com': 100})
+        backend = self.create_backend(server, concurrency=10, rate_limiter=limiter)
+        messages = [
+            create_message(message_id=message_id, emails=['test@limited.com'])
+            for message_id in range(1, 111)
+        ]
+
+        start = time.monotonic()
+        self.assertEqual(len(backend.deliver(messages)), 110)
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+
+if __name__ == '__main__':
+    unittest.main()
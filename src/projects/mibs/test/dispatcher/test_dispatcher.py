@@ -0,0 +1,420 @@
+'''
+Dispatcher unit tests
+'''
+
+import shutil
+import tempfile
+import unittest
+
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from flask import Flask
+from sqlalchemy.orm import Session
+from dispatcher import DeliveryBackend, Dispatcher, SmtpBackend
+from models import Message, EmailMessageRecipient, db
+
+test_user_id = 'temp-user-id'
+test_now = datetime(2021, 11, 1, 12, 0, 0)
+
+
+class RecordingBackend(DeliveryBackend):
+    '''
+    Delivery backend that records deliveries instead of sending them. Recipients
+    whose email is in failing_emails are not delivered to.
+    '''
+    def __init__(self, failing_emails=()):
+        self.failing_emails = set(failing_emails)
+        self.deliveries = []
+
+    def deliver(self, messages, delivered=None):
+        delivered = set()
+        for message in messages:
+            for recipient in message.recipients:
+                if recipient.email not in self.failing_emails:
+                    self.deliveries.append((message.message_id, recipient.email))
+                    delivered.add(recipient.recipient_id)
+        return delivered
+
+
+class TestDispatcher(unittest.TestCase):
+    '''
+    Dispatcher unit tests
+    '''
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['TESTING'] = True
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        db.engine.execute('PRAGMA foreign_keys=ON')
+
+        self.backend = RecordingBackend()
+        self.dispatcher = Dispatcher(db.session, self.backend, batch_size=10)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_dispatch_no_messages(self):
+        '''
+        Test dispatch_batch when there are no messages
+        '''
+        self.assertEqual(self.dispatcher.dispatch_batch(test_now), 0)
+        self.assertEqual(self.backend.deliveries, [])
+
+    def test_dispatch_due_message(self):
+        '''
+        Test dispatch_batch sends a due message to all of its recipients and marks it sent
+        '''
+        message_id = self.create_message(emails=['a@email.com', 'b@email.com'])
+
+        self.assertEqual(self.dispatcher.dispatch_batch(test_now), 1)
+
+        self.assertEqual(sorted(self.backend.deliveries),
+            [(message_id, 'a@email.com'), (message_id, 'b@email.com')])
+        message = Message.query.get(message_id)
+        self.assertTrue(message.sent)
+        self.assertEqual(message.last_sent_time, test_now)
+        for recipient in message.email_recipients:
+            self.assertTrue(recipient.sent)
+            self.assertEqual(recipient.send_attempt_time, test_now)
+
+    def test_dispatch_future_message(self):
+        '''
+        Test dispatch_batch does not send a message whose sendTime has not passed
+        '''
+        message_id = self.create_message(send_time=test_now + timedelta(seconds=1))
+
+        self.assertEqual(self.dispatcher.dispatch_batch(test_now), 0)
+
+        message = Message.query.get(message_id)
+        self.assertFalse(message.sent)
+        self.assertIsNone(message.last_sent_time)
+
+    def test_dispatch_sent_message(self):
+        '''
+        Test dispatch_batch does not send a message that is already sent
+        '''
+        self.create_message(sent=True)
+
+        self.assertEqual(self.dispatcher.dispatch_batch(test_now), 0)
+        self.assertEqual(self.backend.deliveries, [])
+
+    def test_dispatch_batch_size(self):
+        '''
+        Test dispatch_batch claims at most batch_size messages, oldest sendTime first
+        '''
+        message_ids = [
+            self.create_message(send_time=test_now - timedelta(minutes=minutes))
+            for minutes in range(15)
+        ]
+
+        self.assertEqual(self.dispatcher.dispatch_batch(test_now), 10)
+        self.assertEqual(self.dispatcher.dispatch_batch(test_now), 5)
+        self.assertEqual(self.dispatcher.dispatch_batch(test_now), 0)
+
+        self.assertEqual([message_id for message_id, _ in self.backend.deliveries],
+            list(reversed(message_ids)))
+
+    def test_dispatch_claimed_message(self):
+        '''
+        Test that a message claimed by one dispatcher is not claimed by another
+        '''
+        message_id = self.create_message()
+        other_backend = RecordingBackend()
+        other_dispatcher = Dispatcher(db.session, other_backend)
+
+        self.assertEqual(self.dispatcher.claim(test_now), [message_id])
+        self.assertEqual(other_dispatcher.dispatch_batch(test_now), 0)
+        self.assertEqual(other_backend.deliveries, [])
+
+    def test_dispatch_increments_version(self):
+        '''
+        Test that claiming and sending a message increment its version, so that edits of the
+        message loaded before conflict
+        '''
+        message_id = self.create_message()
+        failing_message_id = self.create_message(emails=['fail@email.com'])
+        self.backend.failing_emails.add('fail@email.com')
+
+        self.dispatcher.dispatch_batch(test_now)
+
+        db.session.expire_all()
+        self.assertEqual(Message.query.get(message_id).version, 3)
+        self.assertEqual(Message.query.get(failing_message_id).version, 2)
+
+    def test_dispatch_failed_recipient(self):
+        '''
+        Test that a message with a failed recipient is not marked sent and that only the failed
+        recipient is retried once the claim times out
+        '''
+        message_id = self.create_message(emails=['a@email.com', 'b@email.com'])
+        self.backend.failing_emails = {'b@email.com'}
+
+        self.assertEqual(self.dispatcher.dispatch_batch(test_now), 1)
+
+        message = Message.query.get(message_id)
+        self.assertFalse(message.sent)
+        self.assertEqual(message.last_sent_time, test_now)
+        recipients = {recipient.email: recipient for recipient in message.email_recipients}
+        self.assertTrue(recipients['a@email.com'].sent)
+        self.assertFalse(recipients['b@email.com'].sent)
+        self.assertEqual(recipients['b@email.com'].send_attempt_time, test_now)
+
+        self.backend.failing_emails = set()
+        self.assertEqual(self.dispatcher.dispatch_batch(test_now + timedelta(minutes=1)), 0)
+
+        retry_time = test_now + self.dispatcher.claim_timeout
+        self.assertEqual(self.dispatcher.dispatch_batch(retry_time), 1)
+
+        self.assertEqual(self.backend.deliveries,
+            [(message_id, 'a@email.com'), (message_id, 'b@email.com')])
+        db.session.expire_all()
+        message = Message.query.get(message_id)
+        self.assertTrue(message.sent)
+        self.assertEqual(message.last_sent_time, retry_time)
+
+    def test_dispatch_message_without_recipients(self):
+        '''
+        Test that a due message with no unsent recipients is marked sent
+        '''
+        message_id = self.create_message(emails=[])
+
+        self.assertEqual(self.dispatcher.dispatch_batch(test_now), 1)
+
+        self.assertEqual(self.backend.deliveries, [])
+        self.assertTrue(Message.query.get(message_id).sent)
+
+    def test_dispatch_malformed_address(self):
+        '''
+        Test that a recipient whose email cannot be sent to, like an address with a header
+        injected, is treated like a refused recipient without failing the batch
+        '''
+        malformed = 'a@b.com\r\nBcc: evil@x.com'
+        message_id = self.create_message(emails=[malformed, 'a@email.com'])
+        other_message_id = self.create_message(emails=['b@email.com'])
+        dispatcher = Dispatcher(db.session, SmtpBackend('localhost', 25, 'sender@email.com'))
+
+        with patch('dispatcher.backends.smtplib.SMTP') as smtp:
+            with self.assertLogs('dispatcher.backends', 'ERROR'):
+                self.assertEqual(dispatcher.dispatch_batch(test_now), 2)
+
+        sent_to = [call.args[0]['To'] for call in
+            smtp.return_value.__enter__.return_value.send_message.call_args_list]
+        self.assertEqual(sent_to, ['a@email.com', 'b@email.com'])
+        self.assertFalse(Message.query.get(message_id).sent)
+        self.assertTrue(Message.query.get(other_message_id).sent)
+        recipients = {recipient.email: recipient
+            for recipient in Message.query.get(message_id).email_recipients}
+        self.assertFalse(recipients[malformed].sent)
+        self.assertEqual(recipients[malformed].send_attempt_time, test_now)
+        self.assertTrue(recipients['a@email.com'].sent)
+
+    def test_dispatch_backend_raises(self):
+        '''
+        Test that the deliveries a backend made before it raised are recorded
+        '''
+        message_ids = [self.create_message(emails=[f'{index}@email.com']) for index in range(2)]
+
+        class FailingBackend(DeliveryBackend):
+            '''
+            Delivers the first message, then raises
+            '''
+            def deliver(self, messages, delivered=None):
+                delivered.update(recipient.recipient_id for recipient in messages[0].recipients)
+                raise RuntimeError('backend failed')
+
+        with self.assertRaises(RuntimeError):
+            Dispatcher(db.session, FailingBackend()).dispatch_batch(test_now)
+
+        db.session.expire_all()
+        self.assertTrue(Message.query.get(message_ids[0]).sent)
+        message = Message.query.get(message_ids[1])
+        self.assertFalse(message.sent)
+        self.assertEqual(message.email_recipients[0].send_attempt_time, test_now)
+
+    def test_run_survives_failed_batch(self):
+        '''
+        Test that run logs a failed batch and keeps dispatching
+        '''
+        self.create_message()
+        batches = []
+
+        def should_stop():
+            batches.append(None)
+            return len(batches) > 2
+
+        self.dispatcher.claim_timeout = timedelta(0)
+        with patch.object(self.backend, 'deliver',
+            side_effect=[RuntimeError('failed'), set()]) as deliver, \
+            self.assertLogs('dispatcher.dispatcher', 'ERROR'):
+            self.dispatcher.run(poll_interval=0, should_stop=should_stop)
+        # the message is claimed again after the failed batch
+        self.assertEqual(deliver.call_count, 2)
+
+    def dispatch_in_groups(self, delivery_seconds, during, group):
+        '''
+        Dispatches three messages one at a time with a dispatcher whose backend takes
+        delivery_seconds[index] to deliver the message with the index, or delivery_seconds
+        if it is a number. during is called while the message with the index group is
+        delivered. Returns the messageIds.
+        '''
+        message_ids = [self.create_message(emails=[f'{index}@email.com']) for index in range(3)]
+        clock = [0.0]
+
+        class SlowBackend(RecordingBackend):
+            '''
+            Advances the dispatcher's clock by the delivery_seconds of each delivery
+            '''
+            def deliver(self, messages, delivered=None):
+                clock[0] += delivery_seconds if isinstance(delivery_seconds, float) \
+                    else delivery_seconds[len(self.deliveries)]
+                if len(self.deliveries) == group:
+                    during()
+                return super().deliver(messages, delivered)
+
+        self.backend = SlowBackend()
+        self.dispatcher = Dispatcher(db.session, self.backend, group_size=1,
+            clock=lambda: clock[0])
+        self.assertEqual(self.dispatcher.dispatch_batch(test_now), 3)
+        return message_ids
+
+    def test_dispatch_renews_claims(self):
+        '''
+        Test that the claims of the messages waiting for their group are renewed, so that
+        another dispatcher does not claim them while the batch takes longer than claim_timeout
+        '''
+        other_backend = RecordingBackend()
+        other_dispatcher = Dispatcher(db.session, other_backend)
+        seconds = self.dispatcher.claim_timeout.total_seconds() * 0.6
+
+        self.dispatch_in_groups(seconds, lambda: self.assertEqual(
+            other_dispatcher.dispatch_batch(test_now + timedelta(seconds=seconds * 1.9)), 0),
+            group=1)
+
+        self.assertEqual([email for _, email in self.backend.deliveries],
+            ['0@email.com', '1@email.com', '2@email.com'])
+        self.assertEqual(Message.query.filter_by(sent=True).count(), 3)
+        self.assertEqual(Message.query.order_by(Message.message_id.desc()).first()
+            .last_sent_time, test_now + timedelta(seconds=seconds * 2))
+
+    def test_dispatch_timed_out_claims_not_sent_twice(self):
+        '''
+        Test that the messages another dispatcher claimed while a group took longer than
+        claim_timeout are not sent by the dispatcher that lost their claims
+        '''
+        other_backend = RecordingBackend()
+        other_dispatcher = Dispatcher(db.session, other_backend)
+        timeout = self.dispatcher.claim_timeout.total_seconds()
+
+        # the second group outlives the claims renewed after the first one
+        with self.assertLogs('dispatcher.dispatcher', 'WARNING'):
+            self.dispatch_in_groups([timeout * 0.6, timeout * 1.1, timeout * 0.1],
+                lambda: self.assertEqual(other_dispatcher.dispatch_batch(
+                    test_now + timedelta(seconds=timeout * 1.7)), 2),
+                group=1)
+
+        self.assertEqual(self.backend.deliveries, [(1, '0@email.com'), (2, '1@email.com')])
+        self.assertEqual(other_backend.deliveries, [(2, '1@email.com'), (3, '2@email.com')])
+        self.assertEqual(Message.query.filter_by(sent=True).count(), 3)
+
+    def test_dispatch_max_attempts(self):
+        '''
+        Test that a message is claimed at most max_attempts times, and then marked as sent
+        and failed, so that it leaves the unsent messages
+        '''
+        message_id = self.create_message(emails=['a@email.com', 'b@email.com'])
+        delivered_id = self.create_message(emails=['c@email.com'])
+        self.backend.failing_emails = {'a@email.com'}
+        dispatcher = Dispatcher(db.session, self.backend, max_attempts=2)
+
+        self.assertEqual(dispatcher.dispatch_batch(test_now), 2)
+        self.assertFalse(Message.query.get(message_id).sent)
+        with self.assertLogs('dispatcher.dispatcher', 'WARNING'):
+            self.assertEqual(dispatcher.dispatch_batch(test_now + dispatcher.claim_timeout), 1)
+        self.assertEqual(dispatcher.dispatch_batch(test_now + 2 * dispatcher.claim_timeout), 0)
+
+        message = Message.query.get(message_id)
+        self.assertTrue(message.sent)
+        self.assertTrue(message.failed)
+        self.assertEqual(message.send_attempts, 2)
+        self.assertEqual([(recipient.email, recipient.sent)
+            for recipient in message.email_recipients],
+            [('a@email.com', False), ('b@email.com', True)])
+        self.assertFalse(Message.query.get(delivered_id).failed)
+
+    def create_message(self, emails=('test@email.com',), send_time=test_now, sent=False):
+        '''
+        Helper function to create and insert a message and its email recipients in the database
+        '''
+        message = Message(user_id=test_user_id,
+            message='test',
+            send_time=send_time,
+            sent=sent,
+            email_recipients=[EmailMessageRecipient(email=email) for email in emails])
+        db.session.add(message)
+        db.session.commit()
+        return message.message_id
+
+
+class TestDispatcherWithReadReplica(unittest.TestCase):
+    '''
+    Dispatcher tests with a primary and a read replica database file
+    '''
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.app = Flask(__name__)
+        self.app.config.update({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{self.directory}/primary.db',
+            'SQLALCHEMY_BINDS': {'replica_0': f'sqlite:///{self.directory}/replica.db'},
+        })
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        self.replica = db.get_engine(self.app, bind='replica_0')
+        db.Model.metadata.create_all(self.replica)
+
+        self.backend = RecordingBackend()
+        self.dispatcher = Dispatcher(db.session, self.backend, batch_size=10)
+
+    def tearDown(self):
+        db.session.remove()
+        db.engine.dispose()
+        self.replica.dispose()
+        self.context.pop()
+        shutil.rmtree(self.directory)
+
+    def create_message(self, email, sent_on_primary=False, on_replica=True):
+        '''
+        Inserts a due message into the primary and, unless the replica lags behind, into
+        the replica, where it is not sent yet
+        '''
+        engines = [db.engine] + ([self.replica] if on_replica else [])
+        for engine in engines:
+            with Session(engine) as session:
+                session.add(Message(user_id=test_user_id, message='test', send_time=test_now,
+                    sent=sent_on_primary and engine is db.engine,
+                    email_recipients=[EmailMessageRecipient(email=email)]))
+                session.commit()
+
+    def test_scans_replica(self):
+        '''
+        Test that the due messages are found on the replica and claimed on the primary
+        only if they are still due there
+        '''
+        self.create_message('due@email.com')
+        self.create_message('sent@email.com', sent_on_primary=True)
+        # not replicated yet, claimed by a later batch
+        self.create_message('lagging@email.com', on_replica=False)
+
+        self.assertEqual(self.dispatcher.dispatch_batch(test_now), 1)
+        self.assertEqual(self.backend.deliveries, [(1, 'due@email.com')])
+        self.assertEqual(Message.query.filter_by(sent=True).count(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
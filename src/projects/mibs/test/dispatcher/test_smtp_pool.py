@@ -0,0 +1,229 @@
+'''
+SMTP connection pool and pooled SMTP backend unit tests
+'''
+
+import smtplib
+import unittest
+
+from datetime import datetime
+from unittest.mock import MagicMock
+from dispatcher import OutgoingMessage, OutgoingRecipient, PooledSmtpBackend, SmtpConnectionPool
+
+test_sender = 'sender@email.com'
+
+
+class FakeSmtpFactory:
+    '''
+    Creates MagicMock SMTP connections and records every connection it created.
+    send_message_effects are used, in order, as the side_effect of the
+    send_message method of the created connections.
+    '''
+    def __init__(self, *send_message_effects):
+        self.connections = []
+        self.send_message_effects = list(send_message_effects)
+
+    def __call__(self, host, port, timeout=None):
+        connection = MagicMock()
+        effect = self.send_message_effects.pop(0) if self.send_message_effects else None
+        connection.send_message = MagicMock(side_effect=effect, return_value={})
+        self.connections.append(connection)
+        return connection
+
+
+def create_message(message_id=1, emails=('test@email.com',)):
+    '''
+    Helper function to create an outgoing message
+    '''
+    return OutgoingMessage(
+        message_id=message_id,
+        user_id='temp-user-id',
+        message='test',
+        send_time=datetime.now(),
+        recipients=[
+            OutgoingRecipient(recipient_id=message_id * 100 + index, email=email)
+            for index, email in enumerate(emails)
+        ])
+
+
+class TestSmtpConnectionPool(unittest.TestCase):
+    '''
+    SmtpConnectionPool unit tests
+    '''
+    def test_connection_reused(self):
+        '''
+        Test that a connection is opened once and reused across messages
+        '''
+        factory = FakeSmtpFactory()
+        pool = SmtpConnectionPool('localhost', 25, size=1, smtp_factory=factory)
+
+        for _ in range(3):
+            with pool.connection() as connection:
+                connection.send(MagicMock(), test_sender, ['test@email.com'])
+
+        self.assertEqual(len(factory.connections), 1)
+        self.assertEqual(factory.connections[0].send_message.call_count, 3)
+
+    def test_max_messages_per_connection(self):
+        '''
+        Test that a connection is closed and replaced once it sent max_messages_per_connection
+        '''
+        factory = FakeSmtpFactory()
+        pool = SmtpConnectionPool('localhost', 25, size=1, max_messages_per_connection=2,
+            smtp_factory=factory)
+
+        for _ in range(5):
+            with pool.connection() as connection:
+                connection.send(MagicMock(), test_sender, ['test@email.com'])
+
+        self.assertEqual(len(factory.connections), 3)
+        self.assertEqual([smtp.send_message.call_count for smtp in factory.connections], [2, 2, 1])
+        factory.connections[0].quit.assert_called_once()
+        factory.connections[1].quit.assert_called_once()
+        factory.connections[2].quit.assert_not_called()
+
+    def test_reconnect_on_disconnect(self):
+        '''
+        Test that a message is resent over a new connection when the server dropped the old one
+        '''
+        factory = FakeSmtpFactory(smtplib.SMTPServerDisconnected())
+        pool = SmtpConnectionPool('localhost', 25, size=1, smtp_factory=factory)
+
+        with pool.connection() as connection:
+            connection.send(MagicMock(), test_sender, ['test@email.com'])
+
+        self.assertEqual(len(factory.connections), 2)
+        self.assertEqual(factory.connections[1].send_message.call_count, 1)
+
+    def test_reconnect_fails(self):
+        '''
+        Test that the connection error is raised when the new connection fails too
+        '''
+        factory = FakeSmtpFactory(ConnectionResetError(), ConnectionResetError())
+        pool = SmtpConnectionPool('localhost', 25, size=1, smtp_factory=factory)
+
+        with pool.connection() as connection:
+            with self.assertRaises(ConnectionResetError):
+                connection.send(MagicMock(), test_sender, ['test@email.com'])
+            self.assertIsNone(connection.smtp)
+
+    def test_close(self):
+        '''
+        Test that close quits every open connection
+        '''
+        factory = FakeSmtpFactory()
+        pool = SmtpConnectionPool('localhost', 25, size=2, smtp_factory=factory)
+        with pool.connection() as first, pool.connection() as second:
+            first.send(MagicMock(), test_sender, ['test@email.com'])
+            second.send(MagicMock(), test_sender, ['test@email.com'])
+
+        pool.close()
+
+        self.assertEqual(len(factory.connections), 2)
+        for smtp in factory.connections:
+            smtp.quit.assert_called_once()
+
+
+class TestPooledSmtpBackend(unittest.TestCase):
+    '''
+    PooledSmtpBackend unit tests
+    '''
+    def create_backend(self, factory, **options):
+        '''
+        Helper function to create a backend that uses factory to connect
+        '''
+        backend = PooledSmtpBackend('localhost', 25, test_sender, smtp_factory=factory, **options)
+        self.addCleanup(backend.close)
+        return backend
+
+    def test_deliver_one_transaction_per_message(self):
+        '''
+        Test that all recipients of a message are sent to in one SMTP transaction
+        '''
+        factory = FakeSmtpFactory()
+        backend = self.create_backend(factory, pool_size=1)
+        message = create_message(emails=['a@email.com', 'b@email.com', 'c@email.com'])
+
+        delivered = backend.deliver([message])
+
+        self.assertEqual(delivered, {100, 101, 102})
+        smtp = factory.connections[0]
+        self.assertEqual(smtp.send_message.call_count, 1)
+        _, sender, to_addrs = smtp.send_message.call_args.args
+        self.assertEqual(sender, test_sender)
+        self.assertEqual(to_addrs, ['a@email.com', 'b@email.com', 'c@email.com'])
+
+    def test_deliver_max_recipients_per_message(self):
+        '''
+        Test that recipients beyond max_recipients_per_message are sent to in another transaction
+        '''
+        factory = FakeSmtpFactory()
+        backend = self.create_backend(factory, pool_size=1, max_recipients_per_message=2)
+        message = create_message(emails=['a@email.com', 'b@email.com', 'c@email.com'])
+
+        self.assertEqual(backend.deliver([message]), {100, 101, 102})
+        calls = factory.connections[0].send_message.call_args_list
+        self.assertEqual([call.args[2] for call in calls],
+            [['a@email.com', 'b@email.com'], ['c@email.com']])
+
+    def test_deliver_refused_recipient(self):
+        '''
+        Test that a recipient refused by the server is not reported as delivered
+        '''
+        factory = FakeSmtpFactory(lambda *args: {'b@email.com': (550, b'No such user')})
+        backend = self.create_backend(factory, pool_size=1)
+        message = create_message(emails=['a@email.com', 'b@email.com'])
+
+        self.assertEqual(backend.deliver([message]), {100})
+
+    def test_deliver_all_recipients_refused(self):
+        '''
+        Test that no recipient is delivered to when the server refuses all of them
+        '''
+        factory = FakeSmtpFactory(smtplib.SMTPRecipientsRefused({}))
+        backend = self.create_backend(factory, pool_size=1)
+
+        self.assertEqual(backend.deliver([create_message(emails=['a@email.com'])]), set())
+
+    def test_deliver_malformed_address(self):
+        '''
+        Test that a message with a malformed address is not delivered, and that the other
+        messages of the batch still are, over a reopened connection
+        '''
+        def send_message(*args):
+            # like smtplib, which refuses to send a command with a line break
+            if any('\n' in address for address in args[2]):
+                raise ValueError('prohibited newline characters')
+            return {}
+
+        factory = FakeSmtpFactory(send_message)
+        backend = self.create_backend(factory, pool_size=1)
+        messages = [
+            create_message(message_id=1, emails=['a@email.com\r\nBcc: evil@email.com']),
+            # the address is only sent in RCPT TO, not in the To header
+            create_message(message_id=2,
+                emails=['b@email.com', 'c@email.com\r\nBcc: evil@email.com']),
+            create_message(message_id=3, emails=['d@email.com']),
+        ]
+
+        with self.assertLogs('dispatcher.backends', 'ERROR'):
+            self.assertEqual(backend.deliver(messages), {300})
+        self.assertEqual(len(factory.connections), 2)
+        factory.connections[0].quit.assert_called_once()
+
+    def test_deliver_many_messages(self):
+        '''
+        Test that a batch of messages is delivered over at most pool_size connections
+        '''
+        factory = FakeSmtpFactory()
+        backend = self.create_backend(factory, pool_size=3)
+        messages = [create_message(message_id=message_id) for message_id in range(1, 21)]
+
+        delivered = backend.deliver(messages)
+
+        self.assertEqual(delivered, {message_id * 100 for message_id in range(1, 21)})
+        self.assertLessEqual(len(factory.connections), 3)
+        self.assertEqual(sum(smtp.send_message.call_count for smtp in factory.connections), 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+'''
+Archival of sent messages unit tests
+'''
+
+import unittest
+
+from datetime import datetime, timedelta
+from flask import Flask
+from models import ArchivedEmailMessageRecipient, ArchivedMessage, EmailMessageRecipient, \
+    Message, db
+from models.archive import archive_sent_messages
+from models.repository import MessageRepository
+
+test_user_id = 'test-user'
+test_now = datetime(2021, 12, 1, 12, 0, 0)
+test_sent_before = test_now - timedelta(days=30)
+
+
+class TestArchiveSentMessages(unittest.TestCase):
+    '''
+    archive_sent_messages unit tests
+    '''
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['TESTING'] = True
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        db.engine.execute('PRAGMA foreign_keys=ON')
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def add_message(self, message_id: int, sent: bool, last_sent_time: datetime,
+        recipients: int = 2):
+        '''
+        Adds a message of the test user with recipients that were sent if sent.
+        '''
+        db.session.add(Message(message_id=message_id, user_id=test_user_id,
+            message=f'message {message_id}', send_time=datetime(2021, 10, 1), sent=sent,
+            last_sent_time=last_sent_time, version=3,
+            email_recipients=[
+                EmailMessageRecipient(email=f'{message_id}-{index}@email.com', sent=sent,
+                    send_attempt_time=last_sent_time)
+                for index in range(recipients)
+            ]))
+
+    def test_archives_old_sent_messages(self):
+        '''
+        Test that only the messages sent before the cutoff are moved, with their recipients,
+        keeping their messageIds and columns
+        '''
+        old = test_sent_before - timedelta(days=1)
+        self.add_message(1, sent=True, last_sent_time=old)
+        # claimed long ago, but not every recipient was sent to
+        self.add_message(2, sent=False, last_sent_time=old)
+        self.add_message(3, sent=True, last_sent_time=test_sent_before + timedelta(days=1))
+        self.add_message(4, sent=False, last_sent_time=None)
+        self.add_message(5, sent=True, last_sent_time=old - timedelta(days=1))
+        db.session.commit()
+
+        self.assertEqual(archive_sent_messages(db.session, test_sent_before, now=test_now), 2)
+
+        self.assertEqual([message.message_id for message in Message.query], [2, 3, 4])
+        self.assertEqual(
+            sorted(recipient.message_id for recipient in EmailMessageRecipient.query),
+            [2, 2, 3, 3, 4, 4])
+
+        archived = ArchivedMessage.query.order_by(ArchivedMessage.message_id).all()
+        self.assertEqual([message.message_id for message in archived], [1, 5])
+        self.assertEqual(archived[0].user_id, test_user_id)
+        self.assertEqual(archived[0].message, 'message 1')
+        self.assertEqual(archived[0].send_time, datetime(2021, 10, 1))
+        self.assertTrue(archived[0].sent)
+        self.assertEqual(archived[0].last_sent_time, old)
+        self.assertEqual(archived[0].version, 3)
+        self.assertEqual(archived[0].archived_at, test_now)
+        self.assertEqual([recipient.email for recipient in archived[0].email_recipients],
+            ['1-0@email.com', '1-1@email.com'])
+        self.assertTrue(all(recipient.sent for recipient in archived[0].email_recipients))
+        self.assertEqual(ArchivedEmailMessageRecipient.query.count(), 4)
+
+        # nothing is left to archive
+        self.assertEqual(archive_sent_messages(db.session, test_sent_before, now=test_now), 0)
+
+    def test_batches(self):
+        '''
+        Test that every old sent message is archived in batches
+        '''
+        for message_id in range(1, 26):
+            self.add_message(message_id, sent=True,
+                last_sent_time=test_sent_before - timedelta(minutes=message_id), recipients=1)
+        db.session.commit()
+
+        for batch_size in [1, 5, 10, 100]:
+            with self.subTest(batch_size=batch_size):
+                self.assertEqual(archive_sent_messages(db.session, test_sent_before,
+                    batch_size=batch_size), 25 if batch_size == 1 else 0)
+        self.assertEqual(Message.query.count(), 0)
+        self.assertEqual(ArchivedMessage.query.count(), 25)
+        self.assertEqual(ArchivedEmailMessageRecipient.query.count(), 25)
+
+    def test_invalid_batch_size(self):
+        '''
+        Test that a batch must move at least one and at most MAX_ARCHIVE_BATCH_SIZE messages
+        '''
+        for batch_size in [0, -1, 10001]:
+            with self.subTest(batch_size=batch_size):
+                with self.assertRaises(AssertionError):
+                    archive_sent_messages(db.session, test_sent_before, batch_size=batch_size)
+
+    def test_message_ids_not_reused(self):
+        '''
+        Test that a new message never gets the messageId of an archived message
+        '''
+        self.add_message(1, sent=True, last_sent_time=test_sent_before - timedelta(days=1))
+        db.session.commit()
+        archive_sent_messages(db.session, test_sent_before)
+
+        message = Message(user_id=test_user_id, message='new', send_time=test_now)
+        db.session.add(message)
+        db.session.commit()
+        self.assertEqual(message.message_id, 2)
+
+    def test_archived_repository(self):
+        '''
+        Test that an archived repository reads the archived messages and that deleting
+        messages deletes archived messages too
+        '''
+        for message_id in range(1, 4):
+            self.add_message(message_id, sent=True,
+                last_sent_time=test_sent_before - timedelta(days=1))
+        self.add_message(4, sent=False, last_sent_time=None)
+        db.session.commit()
+        archive_sent_messages(db.session, test_sent_before)
+
+        archived = MessageRepository(test_user_id, archived=True)
+        self.assertEqual(archived.get(2).message, 'message 2')
+        self.assertIsNone(archived.get(4))
+        self.assertEqual([message.message_id for message in archived.page(None, None, 10)],
+            [1, 2, 3])
+        self.assertEqual(archived.last_message_id_of_page(None, 2), 2)
+        self.assertIsNone(MessageRepository('other-user', archived=True).get(2))
+
+        messages = MessageRepository(test_user_id)
+        self.assertIsNone(messages.get(2))
+        self.assertEqual(messages.delete([2, 4]), 2)
+        db.session.commit()
+        self.assertEqual([message.message_id for message in archived.after(None)], [1, 3])
+        self.assertEqual(ArchivedEmailMessageRecipient.query.count(), 4)
+        self.assertEqual(messages.delete(), 2)
+        db.session.commit()
+        self.assertEqual(ArchivedMessage.query.count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
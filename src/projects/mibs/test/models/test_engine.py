@@ -0,0 +1,56 @@
+'''
+Engine and connection pool option unit tests
+'''
+
+import unittest
+
+from sqlalchemy.pool import NullPool
+from models.engine import engine_options
+
+
+class TestEngineOptions(unittest.TestCase):
+    '''
+    engine_options unit tests
+    '''
+    def test_defaults(self):
+        '''
+        Test the default pool options
+        '''
+        self.assertEqual(engine_options(), {
+            'pool_pre_ping': True,
+            'pool_size': 5,
+            'max_overflow': 10,
+            'pool_timeout': 30,
+            'pool_recycle': 1800,
+        })
+
+    def test_null_pool(self):
+        '''
+        Test that a pool_size of 0 opens a connection for every transaction
+        '''
+        self.assertEqual(engine_options(pool_size=0, pool_pre_ping=False),
+            {'pool_pre_ping': False, 'poolclass': NullPool})
+
+    def test_statement_timeout(self):
+        '''
+        Test that the statement_timeout is a startup parameter, except with pgbouncer
+        '''
+        self.assertEqual(engine_options(statement_timeout=5000)['connect_args'],
+            {'options': '-c statement_timeout=5000'})
+        with self.assertLogs('models.engine', level='WARNING'):
+            options = engine_options(statement_timeout=5000, pgbouncer=True)
+        self.assertNotIn('connect_args', options)
+
+    def test_invalid(self):
+        '''
+        Test that negative sizes and timeouts are rejected
+        '''
+        for options in [{'pool_size': -1}, {'max_overflow': -1}, {'pool_timeout': 0},
+            {'statement_timeout': -1}]:
+            with self.subTest(options=options):
+                with self.assertRaises(AssertionError):
+                    engine_options(**options)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,236 @@
+'''
+Online migration helper and migration unit tests
+'''
+
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from datetime import datetime
+from alembic import command
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from sqlalchemy import column, create_engine, inspect, select, table, text
+from sqlalchemy.exc import OperationalError
+from models import Message
+from models.online import backfill, create_index_concurrently, lock_timeout
+
+message_table = Message.__table__
+migrations_directory = os.path.join(os.path.dirname(__file__), '..', '..', 'migrations')
+
+
+def seed_messages(engine, count: int):
+    '''
+    Inserts count messages of version 1 into the database of engine
+    '''
+    with engine.begin() as connection:
+        connection.execute(message_table.insert(), [
+            {'messageId': message_id, 'userId': 'user', 'message': 'seeded',
+                'sendTime': datetime(2021, 11, 1), 'sent': False, 'version': 1}
+            for message_id in range(1, count + 1)
+        ])
+
+
+class WriteTimer:
+    '''
+    Updates a message over and over from another thread until stopped, timing
+    how long every write takes, which is how long it waited for the locks of
+    other transactions
+    '''
+    def __init__(self, db_uri: str, message_id: int):
+        # a thread of its own needs a connection of its own, waiting for locks instead of failing
+        self.engine = create_engine(db_uri, connect_args={'timeout': 30})
+        self.message_id = message_id
+        self.waits = []
+        self.errors = []
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.write)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self.stopped.set()
+        self.thread.join()
+        self.engine.dispose()
+
+    def write(self):
+        # writes at least once, however soon it is stopped
+        while len(self.waits) == 0 or not self.stopped.is_set():
+            start = time.perf_counter()
+            try:
+                with self.engine.begin() as connection:
+                    connection.execute(message_table.update()
+                        .where(message_table.c.messageId == self.message_id)
+                        .values(message=f'written at {start}'))
+            except OperationalError as error:
+                self.errors.append(error)
+                return
+            self.waits.append(time.perf_counter() - start)
+            time.sleep(0.001)
+
+
+class TestOnlineHelpers(unittest.TestCase):
+    '''
+    models.online unit tests on a SQLite database file
+    '''
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db_uri = f'sqlite:///{self.directory}/mibs.db'
+        self.engine = create_engine(self.db_uri, connect_args={'timeout': 30})
+        message_table.metadata.create_all(self.engine)
+        seed_messages(self.engine, 2000)
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.directory)
+
+    def run_operations(self, operations):
+        '''
+        Runs operations() like a migration, and returns what it returns
+        '''
+        with self.engine.connect() as connection:
+            with Operations.context(MigrationContext.configure(connection)):
+                return operations()
+
+    def versions(self):
+        '''
+        Returns how many messages there are of each version
+        '''
+        with self.engine.connect() as connection:
+            return dict(connection.execute(select(message_table.c.version, text('count(*)'))
+                .group_by(message_table.c.version)).all())
+
+    def test_backfill(self):
+        '''
+        Test that a backfill updates the matching rows in batches of consecutive keys
+        '''
+        durations = self.run_operations(lambda: backfill('Message', 'messageId',
+            {'version': 2}, 'version = 1 AND "messageId" > 100', batch_size=500, pause=0))
+
+        # keys 101 to 2000
+        self.assertEqual(len(durations), 4)
+        self.assertEqual(self.versions(), {1: 100, 2: 1900})
+        # nothing matches anymore
+        self.assertEqual(self.run_operations(lambda: backfill('Message', 'messageId',
+            {'version': 2}, 'version = 1 AND "messageId" > 100')), [])
+
+    def test_backfill_leaves_room_for_writes(self):
+        '''
+        Test that other transactions write between the batches of a backfill, and only
+        wait for one batch at a time
+        '''
+        with WriteTimer(self.db_uri, message_id=1) as writes:
+            start = time.perf_counter()
+            durations = self.run_operations(lambda: backfill('Message', 'messageId',
+                {'version': 2}, 'version = 1', batch_size=100, pause=0.02))
+            backfill_seconds = time.perf_counter() - start
+            writes_during_backfill = len(writes.waits)
+
+        self.assertEqual(self.versions(), {2: 2000})
+        self.assertEqual(writes.errors, [])
+        self.assertEqual(len(durations), 20)
+        self.assertGreater(writes_during_backfill, 1)
+        # the longest lock hold is one batch, far shorter than the backfill
+        self.assertLess(max(durations), backfill_seconds / 2)
+        self.assertLess(max(writes.waits), backfill_seconds)
+
+    def test_create_index_and_lock_timeout(self):
+        '''
+        Test that indexes and lock timeouts work on databases without concurrent index
+        builds and lock timeouts
+        '''
+        def operations():
+            with lock_timeout(100):
+                create_index_concurrently('ix_Message_version', 'Message', ['version'])
+
+        self.run_operations(operations)
+        self.assertIn('ix_Message_version',
+            [index['name'] for index in inspect(self.engine).get_indexes('Message')])
+
+
+class TestMigrations(unittest.TestCase):
+    '''
+    Tests of the migrations in migrations/ on a seeded SQLite database file
+    '''
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db_uri = f'sqlite:///{self.directory}/mibs.db'
+        self.config = Config()
+        self.config.set_main_option('script_location', migrations_directory)
+        self.config.cmd_opts = argparse.Namespace(x=[f'db_uri={self.db_uri}'])
+        self.engine = create_engine(self.db_uri)
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.directory)
+
+    def test_upgrade_under_writes(self):
+        '''
+        Test that the migrations upgrade a seeded database to the models' schema while
+        another connection keeps writing, without a write waiting long for their locks
+        '''
+        # the tables of the initial schema, before the indexes and version column
+        command.upgrade(self.config, '3f1c2a7d9b40')
+        initial_message_table = table('Message', column('messageId'), column('userId'),
+            column('message'), column('sendTime'), column('sent'))
+        with self.engine.begin() as connection:
+            connection.execute(initial_message_table.insert(), [
+                {'messageId': message_id, 'userId': 'user', 'message': 'seeded',
+                    'sendTime': datetime(2021, 11, 1), 'sent': False}
+                for message_id in range(1, 20001)
+            ])
+
+        with WriteTimer(self.db_uri, message_id=1) as writes:
+            command.upgrade(self.config, 'head')
+
+        # no write failed or stalled behind the migrations
+        self.assertEqual(writes.errors, [])
+        self.assertGreater(len(writes.waits), 0)
+        self.assertLess(max(writes.waits), 1.0)
+
+        inspector = inspect(self.engine)
+        self.assertEqual(
+            {index['name'] for index in inspector.get_indexes('Message')},
+            {index.name for index in message_table.indexes})
+        with self.engine.connect() as connection:
+            self.assertEqual(connection.execute(
+                select(message_table.c.version).distinct()).scalars().all(), [1])
+
+        command.downgrade(self.config, 'base')
+        # SQLite keeps the table of the AUTOINCREMENT counters
+        self.assertEqual(inspect(self.engine).get_table_names(),
+            ['alembic_version', 'sqlite_sequence'])
+
+    def test_message_ids_not_reused(self):
+        '''
+        Test that SQLite does not reuse the messageId of the last message once it is deleted,
+        after the migrations and after a downgrade that recreates the Message table
+        '''
+        command.upgrade(self.config, 'head')
+        for revision in ['head', 'a9d4f1c7e3b2', 'c4d9e7a1f2b6']:
+            with self.subTest(revision=revision):
+                command.downgrade(self.config, revision)
+                initial_message_table = table('Message', column('messageId'),
+                    column('userId'), column('message'), column('sendTime'), column('sent'))
+                with self.engine.begin() as connection:
+                    last_id = connection.execute(initial_message_table.insert(),
+                        {'userId': 'user', 'message': 'deleted',
+                            'sendTime': datetime(2021, 11, 1), 'sent': False}) \
+                        .lastrowid
+                    connection.execute(initial_message_table.delete())
+                    next_id = connection.execute(initial_message_table.insert(),
+                        {'userId': 'user', 'message': 'next',
+                            'sendTime': datetime(2021, 11, 1), 'sent': False}) \
+                        .lastrowid
+                self.assertEqual(next_id, last_id + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,207 @@
+'''
+MessageRepository unit tests
+'''
+
+import unittest
+
+from datetime import datetime
+from flask import Flask
+from sqlalchemy.orm.exc import StaleDataError
+from api.validation import ParsedMib
+from models import Message, EmailMessageRecipient, db
+from models.repository import MessageRepository
+
+test_user_id = 'test-user'
+test_other_user = 'other-user'
+test_send_time = datetime(2021, 11, 1, 12, 0, 0)
+
+
+class TestMessageRepository(unittest.TestCase):
+    '''
+    MessageRepository unit tests
+    '''
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['TESTING'] = True
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        db.engine.execute('PRAGMA foreign_keys=ON')
+
+        # messages 1, 3 and 5 are the test user's, 2 and 4 the other user's
+        for message_id in range(1, 6):
+            user_id = test_user_id if message_id % 2 == 1 else test_other_user
+            db.session.add(Message(message_id=message_id, user_id=user_id,
+                message=f'message {message_id}', send_time=test_send_time,
+                email_recipients=[EmailMessageRecipient(email=f'{message_id}@email.com')]))
+        db.session.commit()
+
+        self.messages = MessageRepository(test_user_id)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def message_ids(self, messages):
+        '''
+        Returns the messageIds of messages.
+        '''
+        return [message.message_id for message in messages]
+
+    def test_invalid_user(self):
+        '''
+        Test that a repository must have a user
+        '''
+        for user_id in [None, '', 1]:
+            with self.subTest(user_id=user_id):
+                with self.assertRaises(AssertionError):
+                    MessageRepository(user_id)
+
+    def test_get(self):
+        '''
+        Test that get only returns the user's messages
+        '''
+        message = self.messages.get(3)
+        self.assertEqual(message.message, 'message 3')
+        self.assertEqual([r.email for r in message.email_recipients], ['3@email.com'])
+        self.assertIsNone(self.messages.get(2))
+        self.assertIsNone(self.messages.get(6))
+
+    def test_after(self):
+        '''
+        Test that after returns the user's messages after a messageId in order
+        '''
+        self.assertEqual(self.message_ids(self.messages.after(None)), [1, 3, 5])
+        self.assertEqual(self.message_ids(self.messages.after(1)), [3, 5])
+        self.assertEqual(self.message_ids(self.messages.after(5)), [])
+
+    def test_page(self):
+        '''
+        Test that page returns a page of the user's messages
+        '''
+        self.assertEqual(self.message_ids(self.messages.page(None, None, 2)), [1, 3])
+        self.assertEqual(self.message_ids(self.messages.page(1, None, 5)), [3, 5])
+        self.assertEqual(self.message_ids(self.messages.page(None, 3, 5)), [1, 3])
+        self.assertEqual(self.messages.last_message_id_of_page(None, 2), 3)
+        self.assertIsNone(self.messages.last_message_id_of_page(None, 3))
+
+    def test_add(self):
+        '''
+        Test that added messages belong to the user
+        '''
+        mib = ParsedMib(None, 'new message', test_send_time, ['new@email.com'])
+        message = self.messages.add(mib)
+        message_ids = self.messages.add_many([mib, mib])
+        db.session.commit()
+
+        self.assertEqual(self.message_ids(self.messages.after(5)),
+            [message.message_id] + message_ids)
+        for message in self.messages.after(5):
+            self.assertEqual(message.user_id, test_user_id)
+            self.assertEqual([r.email for r in message.email_recipients], ['new@email.com'])
+
+    def test_update(self):
+        '''
+        Test that update only replaces the recipients whose emails changed
+        '''
+        message = self.messages.get(3)
+        message.email_recipients[0].sent = True
+        message.email_recipients.append(EmailMessageRecipient(email='dup@email.com'))
+        db.session.commit()
+        kept_ids = [r.message_send_request_id for r in message.email_recipients]
+
+        self.messages.update(message, ParsedMib(3, 'changed', test_send_time,
+            ['dup@email.com', '3@email.com']))
+        db.session.commit()
+        self.assertEqual(message.message, 'changed')
+        self.assertEqual([r.message_send_request_id for r in message.email_recipients], kept_ids)
+        self.assertTrue(message.email_recipients[0].sent)
+
+        self.messages.update(message, ParsedMib(3, 'changed', test_send_time,
+            ['dup@email.com', 'new@email.com', 'dup@email.com']))
+        db.session.commit()
+        db.session.expire_all()
+        message = self.messages.get(3)
+        # kept recipients first, then the added emails in request order
+        self.assertEqual([r.email for r in message.email_recipients],
+            ['dup@email.com', 'dup@email.com', 'new@email.com'])
+        self.assertEqual(message.email_recipients[0].message_send_request_id, kept_ids[1])
+        self.assertEqual(EmailMessageRecipient.query
+            .filter(EmailMessageRecipient.email == '3@email.com').count(), 0)
+
+    def test_update_version(self):
+        '''
+        Test that update increments the version and fails if the message was changed after it
+        was loaded
+        '''
+        mib = ParsedMib(3, 'message 3', test_send_time, ['3@email.com'])
+        message = self.messages.get(3)
+        self.messages.update(message, mib)
+        db.session.commit()
+        self.assertEqual(message.version, 2)
+
+        db.session.execute(Message.__table__.update()
+            .where(Message.__table__.c.messageId == 3)
+            .values(version=Message.__table__.c.version + 1))
+        self.messages.update(message, mib)
+        with self.assertRaises(StaleDataError):
+            db.session.commit()
+
+    def test_update_other_user(self):
+        '''
+        Test that update only updates the user's messages
+        '''
+        with self.assertRaises(AssertionError):
+            self.messages.update(Message.query.get(2),
+                ParsedMib(2, 'changed', test_send_time, ['2@email.com']))
+
+    def test_patch(self):
+        '''
+        Test that patch only updates the user's unsent messages with the expected version
+        '''
+        self.assertTrue(self.messages.patch(3, {Message.message: 'changed'}))
+        self.assertTrue(self.messages.patch(3, {Message.message: 'changed again'}, version=2))
+        self.assertFalse(self.messages.patch(3, {Message.message: 'stale'}, version=2))
+        self.assertFalse(self.messages.patch(2, {Message.message: 'other user'}))
+        Message.query.get(5).sent = True
+        db.session.flush()
+        self.assertFalse(self.messages.patch(5, {Message.message: 'sent'}))
+        db.session.commit()
+
+        db.session.expire_all()
+        self.assertEqual([(m.message, m.version) for m in Message.query.order_by('messageId')], [
+            ('message 1', 1), ('message 2', 1), ('changed again', 3), ('message 4', 1),
+            ('message 5', 1),
+        ])
+        self.assertEqual(len(Message.query.get(3).email_recipients), 1)
+
+    def test_delete(self):
+        '''
+        Test that delete only deletes the user's messages
+        '''
+        self.assertEqual(self.messages.delete([1, 2]), 1)
+        self.assertEqual(self.messages.delete(), 2)
+        db.session.commit()
+
+        self.assertEqual(self.message_ids(Message.query.order_by(Message.message_id)), [2, 4])
+        self.assertEqual(EmailMessageRecipient.query.count(), 2)
+
+    def test_queries_use_user_index(self):
+        '''
+        Test that the queries of a user's messages search the userId index
+        instead of scanning every message
+        '''
+        for name, query in [
+            ('query', self.messages.query()),
+            ('after', self.messages.after(None)),
+            ('after messageId', self.messages.after(1)),
+            ('page', self.messages.after(1).filter(Message.message_id <= 3).limit(2)),
+        ]:
+            with self.subTest(query=name):
+                sql = str(query.statement.compile(db.engine,
+                    compile_kwargs={'literal_binds': True}))
+                plan = ' '.join(row[-1] for row in db.session.execute('EXPLAIN QUERY PLAN ' + sql))
+                self.assertRegex(plan, r'SEARCH (TABLE )?Message USING (COVERING )?INDEX '
+                    r'ix_Message_userId_messageId \(userId=')
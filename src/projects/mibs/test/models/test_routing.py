@@ -0,0 +1,122 @@
+'''
+Read replica routing unit tests
+'''
+
+import shutil
+import tempfile
+import unittest
+
+from datetime import datetime
+from flask import Flask
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from models import Message, db
+from models.routing import read_replica, replica_engines, use_read_replica
+
+test_user_id = 'temp-user-id'
+
+
+class TestReadReplica(unittest.TestCase):
+    '''
+    read_replica unit tests, with a primary and a replica database file
+    '''
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.app = Flask(__name__)
+        self.app.config.update({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{self.directory}/primary.db',
+            'SQLALCHEMY_BINDS': {
+                'replica_0': f'sqlite:///{self.directory}/replica.db',
+                # not a replica
+                'audit': 'sqlite://',
+            },
+        })
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        self.primary = db.engine
+        self.replica = db.get_engine(self.app, bind='replica_0')
+        db.Model.metadata.create_all(self.replica)
+
+        self.add_message(self.primary, 'primary')
+        self.add_message(self.replica, 'replica')
+
+    def tearDown(self):
+        db.session.remove()
+        for engine in [self.primary, self.replica]:
+            engine.dispose()
+        self.context.pop()
+        shutil.rmtree(self.directory)
+
+    def add_message(self, engine, text):
+        '''
+        Inserts a message with text into the database of engine
+        '''
+        with Session(engine) as session:
+            session.add(Message(user_id=test_user_id, message=text,
+                send_time=datetime(2021, 11, 1)))
+            session.commit()
+
+    def messages(self, engine):
+        '''
+        Returns the texts of the messages in the database of engine
+        '''
+        with engine.connect() as connection:
+            return connection.execute(select(Message.__table__.c.message)
+                .order_by(Message.__table__.c.messageId)).scalars().all()
+
+    def test_replica_engines(self):
+        '''
+        Test that only the binds with the replica prefix are replicas
+        '''
+        self.assertEqual(replica_engines(self.app), [self.replica])
+
+    def test_reads_replica(self):
+        '''
+        Test that queries in a read_replica block read the replica, and the primary after it
+        '''
+        with read_replica(db.session) as from_replica:
+            self.assertTrue(from_replica)
+            self.assertEqual([message.message for message in Message.query.all()], ['replica'])
+            self.assertEqual(
+                db.session.execute(select(Message.__table__.c.message)).scalars().all(),
+                ['replica'])
+        db.session.commit()
+        self.assertEqual([message.message for message in Message.query.all()], ['primary'])
+
+    def test_writes_primary(self):
+        '''
+        Test that flushes and bulk updates in a read_replica block write to the primary
+        '''
+        with read_replica(db.session):
+            db.session.add(Message(user_id=test_user_id, message='added',
+                send_time=datetime(2021, 11, 1)))
+            db.session.flush()
+            Message.query.filter(Message.message == 'primary') \
+                .update({'message': 'updated'}, synchronize_session=False)
+            db.session.commit()
+
+        self.assertEqual(self.messages(self.primary), ['updated', 'added'])
+        self.assertEqual(self.messages(self.replica), ['replica'])
+
+    def test_without_replicas(self):
+        '''
+        Test that queries read the primary if the app has no replicas or there is no app
+        '''
+        self.app.config['SQLALCHEMY_BINDS'] = {}
+        with read_replica(db.session) as from_replica:
+            self.assertFalse(from_replica)
+            self.assertEqual([message.message for message in Message.query.all()], ['primary'])
+
+        self.context.pop()
+        try:
+            with Session(self.primary) as session:
+                self.assertFalse(use_read_replica(session))
+        finally:
+            self.context.push()
+
+
+if __name__ == '__main__':
+    unittest.main()